@@ -0,0 +1,17 @@
+"""
+Indexing benchmarks for tsakorpus.
+
+The benchmark generates a reproducible synthetic corpus in tsakorpus
+JSON format (see corpus_generator.py), indexes it with the Indexator
+against an in-process stand-in for Elasticsearch (see fake_es.py), and
+measures time and memory for each stage: reading and processing the
+source files, sorting the words, generating the word documents etc.
+Nothing is sent to a real Elasticsearch instance, so the results show
+the cost of the indexator's own code. Run it from the indexator folder::
+
+    cd indexator
+    python3 -m benchmark --docs 200 --languages 2 --output bench.json
+    python3 -m benchmark --docs 200 --languages 2 --baseline bench.json
+
+Run ``python3 -m benchmark --help`` for the list of options.
+"""
@@ -0,0 +1,3 @@
+from benchmark.run_benchmark import main
+
+main()
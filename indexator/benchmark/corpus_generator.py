@@ -0,0 +1,217 @@
+import gzip
+import json
+import os
+import random
+import zlib
+from bisect import bisect
+
+
+class CorpusGenerator:
+    """
+    Generates synthetic corpora in tsakorpus JSON format. The same
+    parameters and seed always produce the same corpus. Word forms
+    follow a Zipfian distribution, so the numbers of word types and
+    lemmata grow with the corpus size as in real corpora.
+    """
+
+    consonants = 'bcdfghjklmnprstvzčšž'
+    vowels = 'aeiouy'
+    posTags = ['N', 'V', 'A', 'ADV', 'PRO']
+    caseTags = ['nom', 'gen', 'dat', 'acc', 'loc', 'ins']
+    numberTags = ['sg', 'pl']
+    suffixes = ['', 'a', 'u', 'om', 'ej', 'ami', 'ax', 'e']
+
+    def __init__(self, nDocs=100, sentencesPerDoc=50, sentenceLength=10,
+                 nLanguages=1, analysesPerWord=2, paraAlignment=0.0,
+                 srcAlignment=0.0, nLemmata=20000, seed=0):
+        """
+        nDocs: number of documents;
+        sentencesPerDoc: average number of sentences per language in a document;
+        sentenceLength: average number of words in a sentence;
+        nLanguages: number of languages (parallel tiers);
+        analysesPerWord: maximal number of analyses of an analyzed word;
+        paraAlignment: share of sentences aligned with other languages;
+        srcAlignment: share of sentences aligned with media files;
+        nLemmata: size of the vocabulary of each language.
+        """
+        self.nDocs = nDocs
+        self.sentencesPerDoc = sentencesPerDoc
+        self.sentenceLength = sentenceLength
+        self.nLanguages = nLanguages
+        self.analysesPerWord = analysesPerWord
+        self.paraAlignment = paraAlignment
+        self.srcAlignment = srcAlignment
+        self.nLemmata = nLemmata
+        self.seed = seed
+        self.languages = ['lang' + str(i) for i in range(nLanguages)]
+        rand = random.Random(seed)
+        self.lemmata = []
+        for langID in range(nLanguages):
+            lemmata = set()
+            while len(lemmata) < nLemmata:
+                lemmata.add(self.make_stem(rand))
+            self.lemmata.append(sorted(lemmata))
+        # Zipfian weights of the lemmata
+        self.cumWeights = []
+        total = 0.0
+        for i in range(nLemmata):
+            total += 1 / (i + 1)
+            self.cumWeights.append(total)
+
+    @staticmethod
+    def stable_hash(s):
+        # Unlike hash(), does not change between runs
+        return zlib.crc32(s.encode('utf-8'))
+
+    def make_stem(self, rand):
+        return ''.join(rand.choice(self.consonants) + rand.choice(self.vowels)
+                       for i in range(rand.randint(1, 4)))
+
+    def choose_lemma(self, rand, langID):
+        i = bisect(self.cumWeights, rand.random() * self.cumWeights[-1])
+        return self.lemmata[langID][min(i, self.nLemmata - 1)]
+
+    def make_word(self, rand, langID, lemma):
+        """
+        Return a word object with a random form and random analyses.
+        """
+        suffix = self.suffixes[self.stable_hash(lemma) % len(self.suffixes)]
+        if rand.random() < 0.5:
+            suffix = rand.choice(self.suffixes)
+        word = {'wf': lemma + suffix, 'wtype': 'word'}
+        if rand.random() < 0.1:
+            return word     # unanalyzed word
+        word['ana'] = []
+        for iAna in range(rand.randint(1, self.analysesPerWord)):
+            pos = self.posTags[(self.stable_hash(lemma) + iAna) % len(self.posTags)]
+            ana = {
+                'lex': lemma,
+                'gr.pos': pos,
+                'parts': lemma + '-' + suffix,
+                'gloss': 'STEM-' + suffix.upper(),
+                'trans_en': lemma.upper()
+            }
+            if pos in ('N', 'A', 'PRO'):
+                ana['gr.case'] = rand.choice(self.caseTags)
+                ana['gr.number'] = rand.choice(self.numberTags)
+            word['ana'].append(ana)
+        return word
+
+    def make_sentence(self, rand, langID, iSent, fnameMedia):
+        """
+        Return a sentence object with random words.
+        """
+        nWords = max(1, int(rand.gauss(self.sentenceLength, self.sentenceLength / 3)))
+        words = []
+        text = ''
+        for iWord in range(nWords):
+            word = self.make_word(rand, langID, self.choose_lemma(rand, langID))
+            if iWord > 0:
+                text += ' '
+            word['off_start'] = len(text)
+            text += word['wf']
+            word['off_end'] = len(text)
+            word['next_word'] = iWord + 1
+            words.append(word)
+        words.append({'wf': '.', 'wtype': 'punct',
+                      'off_start': len(text), 'off_end': len(text) + 1})
+        text += '.'
+        sentence = {
+            'text': text,
+            'words': words,
+            'lang': langID,
+            'meta': {'speaker': rand.choice(['A', 'B', 'C'])}
+        }
+        if self.nLanguages > 1 and rand.random() < self.paraAlignment:
+            sentence['para_alignment'] = [{'off_start': 0, 'off_end': len(text),
+                                           'para_id': iSent}]
+        if rand.random() < self.srcAlignment:
+            sentence['src_alignment'] = [{
+                'off_start_src': str(iSent * 2.0),
+                'off_end_src': str(iSent * 2.0 + 1.5),
+                'off_start_sent': 0,
+                'off_end_sent': len(text),
+                'mtype': 'audio',
+                'src_id': str(iSent * 2000) + '_' + str(iSent * 2000 + 1500),
+                'src': fnameMedia
+            }]
+        return sentence
+
+    def make_document(self, iDoc):
+        """
+        Return the document number iDoc. Each document has its
+        own random generator, so that documents do not depend
+        on each other.
+        """
+        rand = random.Random(self.seed * 1000003 + iDoc)
+        nSents = max(1, int(rand.gauss(self.sentencesPerDoc, self.sentencesPerDoc / 3)))
+        doc = {
+            'meta': {
+                'title': 'Document ' + str(iDoc),
+                'author': 'Author ' + str(iDoc % 17),
+                'filename': 'doc' + str(iDoc),
+                'year': 1900 + iDoc % 120,
+                'fulltext_id': 'doc' + str(iDoc)
+            },
+            'sentences': []
+        }
+        for langID in range(self.nLanguages):
+            for iSent in range(nSents):
+                doc['sentences'].append(self.make_sentence(rand, langID, iSent,
+                                                           'doc' + str(iDoc) + '.mp3'))
+            doc['sentences'][-1]['last'] = True
+        return doc
+
+    def write_corpus(self, corpusDir, inputFormat='json'):
+        """
+        Write all documents to corpusDir in one of the input formats
+        supported by the indexator. Return the list of filenames.
+        """
+        if not os.path.exists(corpusDir):
+            os.makedirs(corpusDir)
+        fext = {'json': '.json', 'json-gzip': '.json.gz',
+                'jsonl': '.jsonl', 'jsonl-gzip': '.jsonl.gz'}[inputFormat]
+        filenames = []
+        for iDoc in range(self.nDocs):
+            doc = self.make_document(iDoc)
+            fname = os.path.join(corpusDir, 'doc' + str(iDoc) + fext)
+            if inputFormat.endswith('gzip'):
+                fOut = gzip.open(fname, 'wt', encoding='utf-8')
+            else:
+                fOut = open(fname, 'w', encoding='utf-8')
+            if inputFormat.startswith('jsonl'):
+                fOut.write(json.dumps({'meta': doc['meta']}, ensure_ascii=False) + '\n')
+                for s in doc['sentences']:
+                    fOut.write(json.dumps(s, ensure_ascii=False) + '\n')
+            else:
+                json.dump(doc, fOut, ensure_ascii=False)
+            fOut.close()
+            filenames.append(fname)
+        return filenames
+
+    def corpus_settings(self, corpusName, inputFormat='json'):
+        """
+        Return the contents of corpus.json for the generated corpus.
+        """
+        return {
+            'corpus_name': corpusName,
+            'input_format': inputFormat,
+            'languages': self.languages,
+            'lang_props': {lang: {'gr_fields_order': ['pos', 'case', 'number']}
+                           for lang in self.languages},
+            'word_fields': ['trans_en'],
+            'viewable_meta': ['title', 'author', 'year'],
+            'sentence_meta': ['speaker'],
+            'generate_dictionary': False,
+            'fulltext_view_enabled': False,
+            'media': self.srcAlignment > 0
+        }
+
+    def categories(self):
+        """
+        Return the contents of categories.json for the generated corpus.
+        """
+        tags = {tag: 'pos' for tag in self.posTags}
+        tags.update((tag, 'case') for tag in self.caseTags)
+        tags.update((tag, 'number') for tag in self.numberTags)
+        return {lang: tags for lang in self.languages}
@@ -0,0 +1,90 @@
+import json
+import time
+
+
+class FakeElasticsearch:
+    """
+    In-process stand-in for the Elasticsearch client used by the
+    indexator. Bulk requests are split into actions and acknowledged
+    without storing the documents, so that benchmarks measure the
+    indexator itself. A fixed latency can be added to each bulk
+    request to imitate the network and the server.
+    """
+
+    def __init__(self, bulkLatency=0.0):
+        self.bulkLatency = bulkLatency      # seconds per bulk request
+        self.nRequests = 0
+        self.nActions = 0
+        self.nBytes = 0
+        self.nDocs = 0      # documents indexed with index()
+
+    def bulk(self, body, **kwargs):
+        if isinstance(body, bytes):
+            self.nBytes += len(body)
+            body = body.decode('utf-8')
+        else:
+            self.nBytes += len(body.encode('utf-8'))
+        items = []
+        lines = body.split('\n')
+        i = 0
+        while i < len(lines):
+            if len(lines[i]) <= 0:
+                i += 1
+                continue
+            opType = next(iter(json.loads(lines[i])))
+            items.append({opType: {'status': 200}})
+            i += 1
+            if opType != 'delete':
+                i += 1      # skip the source line
+        self.nRequests += 1
+        self.nActions += len(items)
+        if self.bulkLatency > 0:
+            time.sleep(self.bulkLatency)
+        return {'took': 0, 'errors': False, 'items': items}
+
+    def index(self, index, body, id=None, **kwargs):
+        self.nDocs += 1
+        return {'result': 'created'}
+
+    def __getattr__(self, name):
+        # Other requests (delete_by_query etc.) succeed without doing anything
+        return lambda *args, **kwargs: {}
+
+
+class FakeIndicesClient:
+    """
+    In-process stand-in for elasticsearch.client.IndicesClient.
+    No indexes or aliases exist before the benchmark starts.
+    """
+
+    def __init__(self):
+        self.indices = set()
+        self.aliases = {}   # alias -> index
+
+    def exists(self, index, **kwargs):
+        return index in self.indices or index in self.aliases
+
+    def exists_alias(self, name, **kwargs):
+        return name in self.aliases
+
+    def create(self, index, body=None, **kwargs):
+        self.indices.add(index)
+        return {'acknowledged': True}
+
+    def delete(self, index, **kwargs):
+        self.indices.discard(index)
+        return {'acknowledged': True}
+
+    def get_alias(self, index=None, name=None, **kwargs):
+        return {}
+
+    def update_aliases(self, body, **kwargs):
+        for action in body['actions']:
+            if 'add' in action:
+                self.aliases[action['add']['alias']] = action['add']['index']
+            elif 'remove' in action:
+                self.aliases.pop(action['remove']['alias'], None)
+        return {'acknowledged': True}
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: {}
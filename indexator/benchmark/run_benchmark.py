@@ -0,0 +1,247 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+INDEXATOR_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WEB_APP_DIR = os.path.join(os.path.dirname(INDEXATOR_DIR), 'search', 'web_app')
+for path in (WEB_APP_DIR, INDEXATOR_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from indexator import Indexator
+from indexing_report import IndexingReport
+from benchmark.corpus_generator import CorpusGenerator
+from benchmark.fake_es import FakeElasticsearch, FakeIndicesClient
+
+
+class Benchmark:
+    """
+    Generates a synthetic corpus in a temporary directory and runs
+    the stages of the indexation one by one against FakeElasticsearch,
+    recording time and memory for each of them.
+    """
+
+    def __init__(self, generator, settings=None, inputFormat='json',
+                 bulkLatency=0.0, useTracemalloc=False, workDir=None):
+        self.generator = generator
+        self.settings = {}      # corpus.json values that override the defaults
+        if settings is not None:
+            self.settings = settings
+        self.inputFormat = inputFormat
+        self.bulkLatency = bulkLatency
+        self.useTracemalloc = useTracemalloc
+        self.workDir = workDir
+        self.corpusName = 'benchmark'
+        self.results = []
+
+    def prepare_tree(self, root):
+        """
+        Create the directory structure the indexator expects
+        (conf, corpus, indexator) in root and generate the corpus.
+        """
+        confDir = os.path.join(root, 'conf')
+        os.makedirs(confDir)
+        os.makedirs(os.path.join(root, 'indexator'))
+        settings = self.generator.corpus_settings(self.corpusName, self.inputFormat)
+        settings.update(self.settings)
+        with open(os.path.join(confDir, 'corpus.json'), 'w', encoding='utf-8') as fOut:
+            json.dump(settings, fOut, ensure_ascii=False, indent=2)
+        with open(os.path.join(confDir, 'categories.json'), 'w', encoding='utf-8') as fOut:
+            json.dump(self.generator.categories(), fOut, ensure_ascii=False, indent=2)
+        t1 = time.time()
+        self.generator.write_corpus(os.path.join(root, 'corpus', self.corpusName),
+                                    self.inputFormat)
+        print('Corpus generated in', round(time.time() - t1, 2), 'seconds.')
+
+    def measure(self, stage, f, *args):
+        """
+        Run f(*args) and record its time and memory consumption.
+        Return the result of f.
+        """
+        if self.useTracemalloc:
+            tracemalloc.reset_peak()
+            tracedBefore = tracemalloc.get_traced_memory()[0]
+        t1 = time.perf_counter()
+        result = f(*args)
+        t2 = time.perf_counter()
+        stageResult = {
+            'stage': stage,
+            'time_s': t2 - t1,
+            'peak_rss_mb': IndexingReport.peak_rss()[0]
+        }
+        if self.useTracemalloc:
+            tracedAfter, tracedPeak = tracemalloc.get_traced_memory()
+            stageResult['traced_peak_mb'] = (tracedPeak - tracedBefore) / 1048576
+            stageResult['traced_diff_mb'] = (tracedAfter - tracedBefore) / 1048576
+        self.results.append(stageResult)
+        print('{0}: {1:.3f} s'.format(stage, stageResult['time_s']))
+        return result
+
+    @staticmethod
+    def consume(actions):
+        """
+        Iterate over bulk actions without sending them anywhere.
+        Return their number.
+        """
+        nActions = 0
+        for action in actions:
+            nActions += 1
+        return nActions
+
+    def run_stages(self):
+        """
+        Run the indexation stages in the current directory, which
+        has to be the indexator folder of the generated tree.
+        """
+        indexator = Indexator(overwrite=True)
+        indexator.es = FakeElasticsearch(self.bulkLatency)
+        indexator.es_ic = FakeIndicesClient()
+        indexator.bulkLoader.es = indexator.es
+        indexator.analyze_dir()
+        indexator.create_indices()
+        filenames = [fname for fname, fsize in sorted(indexator.filenames, key=lambda p: -p[1])]
+        self.measure('index_files', indexator.index_files, filenames)
+        # Parts of the previous stage, as measured by the indexator itself
+        for stage, stats in indexator.report.stages.items():
+            self.results.append({'stage': 'index_files.' + stage, 'time_s': stats['time']})
+        nLanguages = len(indexator.languages)
+        self.measure('sort_words', lambda: [indexator.sort_words(langID)
+                                            for langID in range(nLanguages)])
+        for collation in indexator.collations.values():
+            collation.clear()
+        nWordActions = self.measure('iterate_words', self.consume, indexator.iterate_words())
+        counters = {
+            'documents': indexator.dID,
+            'sentences': indexator.sID,
+            'words': indexator.totalNumWords,
+            'word_types': indexator.wordStats.n_items(),
+            'word_actions': nWordActions,
+            'bulk_requests': indexator.es.nRequests,
+            'bulk_bytes': indexator.es.nBytes
+        }
+        indexator.bulkLoader.close()
+        indexator.wordStats.close()
+        return counters
+
+    def run(self):
+        """
+        Generate the corpus, run all stages and return the results.
+        """
+        root = tempfile.mkdtemp(prefix='tsakorpus_benchmark_', dir=self.workDir)
+        cwd = os.getcwd()
+        try:
+            self.prepare_tree(root)
+            os.chdir(os.path.join(root, 'indexator'))
+            if self.useTracemalloc:
+                tracemalloc.start()
+            self.results = []
+            t1 = time.perf_counter()
+            counters = self.run_stages()
+            self.results.append({'stage': 'total', 'time_s': time.perf_counter() - t1,
+                                 'peak_rss_mb': IndexingReport.peak_rss()[0]})
+        finally:
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+            os.chdir(cwd)
+            shutil.rmtree(root, ignore_errors=True)
+        return {
+            'parameters': {
+                'docs': self.generator.nDocs,
+                'sentences_per_doc': self.generator.sentencesPerDoc,
+                'sentence_length': self.generator.sentenceLength,
+                'languages': self.generator.nLanguages,
+                'analyses_per_word': self.generator.analysesPerWord,
+                'para_alignment': self.generator.paraAlignment,
+                'src_alignment': self.generator.srcAlignment,
+                'lemmata': self.generator.nLemmata,
+                'seed': self.generator.seed,
+                'input_format': self.inputFormat,
+                'settings': self.settings
+            },
+            'counters': counters,
+            'stages': self.results
+        }
+
+
+def compare_results(results, baseline, tolerance):
+    """
+    Compare stage times with a previous run. Return the list
+    of stages that became slower by more than tolerance
+    (a share of the previous time).
+    """
+    prevTimes = {stage['stage']: stage['time_s'] for stage in baseline['stages']}
+    regressions = []
+    for stage in results['stages']:
+        if stage['stage'] not in prevTimes or prevTimes[stage['stage']] <= 0:
+            continue
+        ratio = stage['time_s'] / prevTimes[stage['stage']]
+        print('{0}: {1:.3f} s (was {2:.3f} s, x{3:.2f})'.format(stage['stage'], stage['time_s'],
+                                                               prevTimes[stage['stage']], ratio))
+        # Very short stages are too noisy to compare
+        if ratio > 1 + tolerance and stage['time_s'] >= 0.05:
+            regressions.append(stage['stage'])
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the tsakorpus indexator on a synthetic corpus.')
+    parser.add_argument('--docs', type=int, default=100, help='number of documents')
+    parser.add_argument('--sentences', type=int, default=50,
+                        help='average number of sentences per document and language')
+    parser.add_argument('--sentence-length', type=int, default=10,
+                        help='average number of words in a sentence')
+    parser.add_argument('--languages', type=int, default=1, help='number of languages')
+    parser.add_argument('--analyses', type=int, default=2,
+                        help='maximal number of analyses per word')
+    parser.add_argument('--para-alignment', type=float, default=0.8,
+                        help='share of sentences aligned with other languages')
+    parser.add_argument('--src-alignment', type=float, default=0.0,
+                        help='share of sentences aligned with media files')
+    parser.add_argument('--lemmata', type=int, default=20000,
+                        help='number of lemmata in each language')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--input-format', default='json',
+                        choices=['json', 'json-gzip', 'jsonl', 'jsonl-gzip'])
+    parser.add_argument('--settings', default='{}',
+                        help='JSON object with corpus.json values, e.g. \'{"word_stats_storage": "sqlite"}\'')
+    parser.add_argument('--bulk-latency', type=float, default=0.0,
+                        help='seconds added to each bulk request')
+    parser.add_argument('--tracemalloc', action='store_true',
+                        help='measure Python memory allocations in each stage (slow)')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare the results with this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='slowdown (share of the baseline time) reported as a regression')
+    args = parser.parse_args()
+
+    generator = CorpusGenerator(nDocs=args.docs, sentencesPerDoc=args.sentences,
+                                sentenceLength=args.sentence_length, nLanguages=args.languages,
+                                analysesPerWord=args.analyses, paraAlignment=args.para_alignment,
+                                srcAlignment=args.src_alignment, nLemmata=args.lemmata,
+                                seed=args.seed)
+    benchmark = Benchmark(generator, settings=json.loads(args.settings),
+                          inputFormat=args.input_format, bulkLatency=args.bulk_latency,
+                          useTracemalloc=args.tracemalloc)
+    results = benchmark.run()
+    print(json.dumps(results['counters']))
+    if args.output is not None:
+        with open(args.output, 'w', encoding='utf-8') as fOut:
+            json.dump(results, fOut, ensure_ascii=False, indent=2)
+    if args.baseline is not None:
+        with open(args.baseline, 'r', encoding='utf-8') as fIn:
+            baseline = json.load(fIn)
+        if baseline['parameters'] != results['parameters']:
+            print('Warning: the baseline was run with different parameters.')
+        regressions = compare_results(results, baseline, args.tolerance)
+        if len(regressions) > 0:
+            print('Slower than the baseline:', ', '.join(regressions))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+import json
+import time
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from elasticsearch.helpers import BulkIndexError
+from elasticsearch.helpers.actions import expand_action
+from elasticsearch.exceptions import ConnectionTimeout, TransportError
+
+
+class BulkLoader:
+    """
+    Sends bulk indexing requests to Elasticsearch. Unlike
+    elasticsearch.helpers.bulk, it splits the actions into
+    requests by their size in bytes, keeps several requests
+    in flight at once, and retries requests that were rejected
+    because Elasticsearch was overloaded (HTTP 429) or timed out,
+    waiting longer after each failure. The size of the requests
+    is reduced after such failures and increased back after
+    successful requests.
+    Statistics (numbers of actions, bytes, requests and retries,
+    time) are collected separately for each pipeline (e.g. sentences
+    or words).
+    """
+
+    def __init__(self, es, settings=None):
+        self.es = es
+        if settings is None:
+            settings = {}
+        self.maxChunkBytes = 10 * 1024 * 1024   # maximal size of a request body
+        if 'bulk_max_chunk_bytes' in settings:
+            self.maxChunkBytes = settings['bulk_max_chunk_bytes']
+        self.minChunkBytes = min(256 * 1024, self.maxChunkBytes)
+        self.maxChunkActions = 10000
+        self.nThreads = 2       # maximal number of requests in flight
+        if 'bulk_threads' in settings and settings['bulk_threads'] >= 1:
+            self.nThreads = settings['bulk_threads']
+        self.maxRetries = 8
+        if 'bulk_max_retries' in settings:
+            self.maxRetries = settings['bulk_max_retries']
+        self.initialBackoff = 2     # seconds
+        self.maxBackoff = 120       # seconds
+        self.requestTimeout = 60    # seconds
+        if 'bulk_request_timeout' in settings:
+            self.requestTimeout = settings['bulk_request_timeout']
+        self.chunkBytes = self.maxChunkBytes    # current target size of a request
+        self.lock = threading.Lock()
+        self.stats = collections.OrderedDict()  # pipeline name -> its statistics
+        self.pool = None
+
+    def serialize(self, action):
+        """
+        Return a list with one or two lines of a bulk request
+        body for an action.
+        """
+        actionLine, source = expand_action(action)
+        lines = [json.dumps(actionLine, ensure_ascii=False, separators=(',', ':'))]
+        if source is not None:
+            lines.append(json.dumps(source, ensure_ascii=False, separators=(',', ':')))
+        return lines
+
+    def get_stats(self, pipeline):
+        if pipeline not in self.stats:
+            self.stats[pipeline] = {
+                'actions': 0,
+                'bytes': 0,
+                'requests': 0,
+                'retries': 0,
+                'time': 0.0,
+                'latencies': []     # duration of each successful request, in seconds
+            }
+        return self.stats[pipeline]
+
+    def adapt_chunk_size(self, success):
+        """
+        Halve the target request size after a failure and
+        increase it gradually after a successful request.
+        """
+        with self.lock:
+            if success:
+                self.chunkBytes = min(self.maxChunkBytes, int(self.chunkBytes * 1.25))
+            else:
+                self.chunkBytes = max(self.minChunkBytes, self.chunkBytes // 2)
+
+    def send_chunk(self, chunk, pipeline, ignoreStatus):
+        """
+        Send one bulk request (chunk is a list of lists of lines,
+        one per action) and retry it, or the rejected actions, if needed.
+        Return the list of errors for the actions that failed.
+        """
+        errors = []
+        backoff = self.initialBackoff
+        for iAttempt in range(self.maxRetries + 1):
+            body = '\n'.join(line for lines in chunk for line in lines) + '\n'
+            t1 = time.time()
+            try:
+                response = self.es.bulk(body=body.encode('utf-8'), request_timeout=self.requestTimeout)
+            except (ConnectionTimeout, TransportError) as err:
+                if (iAttempt >= self.maxRetries
+                        or (not isinstance(err, ConnectionTimeout) and err.status_code != 429)):
+                    raise
+                print('Bulk request failed (' + str(err) + '), retrying in', backoff, 'seconds.')
+                self.adapt_chunk_size(False)
+                with self.lock:
+                    self.get_stats(pipeline)['retries'] += 1
+                time.sleep(backoff)
+                backoff = min(self.maxBackoff, backoff * 2)
+                continue
+            t2 = time.time()
+            rejected = []
+            for lines, item in zip(chunk, response['items']):
+                opType, result = item.popitem()
+                status = result.get('status', 500)
+                if 200 <= status < 300 or status in ignoreStatus:
+                    continue
+                if status == 429 and iAttempt < self.maxRetries:
+                    rejected.append(lines)
+                else:
+                    errors.append({opType: result})
+            with self.lock:
+                stats = self.get_stats(pipeline)
+                stats['requests'] += 1
+                stats['latencies'].append(t2 - t1)
+            if len(rejected) <= 0:
+                self.adapt_chunk_size(True)
+                break
+            print(len(rejected), 'actions rejected by Elasticsearch, retrying in', backoff, 'seconds.')
+            self.adapt_chunk_size(False)
+            with self.lock:
+                self.get_stats(pipeline)['retries'] += 1
+            time.sleep(backoff)
+            backoff = min(self.maxBackoff, backoff * 2)
+            chunk = rejected
+        return errors
+
+    def iterate_chunks(self, actions, stats):
+        """
+        Serialize the actions and group them into chunks whose size
+        does not exceed the current target size.
+        """
+        chunk = []
+        chunkSize = 0
+        for action in actions:
+            lines = self.serialize(action)
+            size = sum(len(line.encode('utf-8')) + 1 for line in lines)
+            stats['actions'] += 1
+            stats['bytes'] += size
+            if len(chunk) > 0 and (chunkSize + size > self.chunkBytes
+                                   or len(chunk) >= self.maxChunkActions):
+                yield chunk
+                chunk = []
+                chunkSize = 0
+            chunk.append(lines)
+            chunkSize += size
+        if len(chunk) > 0:
+            yield chunk
+
+    def load(self, actions, pipeline='default', ignoreStatus=()):
+        """
+        Send all actions to Elasticsearch. At most nThreads requests
+        are processed at the same time; reading the actions waits
+        while all threads are busy. Raise BulkIndexError if some
+        actions failed.
+        """
+        if self.pool is None:
+            self.pool = ThreadPoolExecutor(max_workers=self.nThreads)
+        t1 = time.time()
+        with self.lock:
+            stats = self.get_stats(pipeline)
+        pending = collections.deque()
+        errors = []
+        for chunk in self.iterate_chunks(actions, stats):
+            pending.append(self.pool.submit(self.send_chunk, chunk, pipeline, ignoreStatus))
+            while len(pending) > self.nThreads:
+                errors += pending.popleft().result()
+        while len(pending) > 0:
+            errors += pending.popleft().result()
+        stats['time'] += time.time() - t1
+        if len(errors) > 0:
+            raise BulkIndexError(str(len(errors)) + ' document(s) failed to index.', errors)
+
+    def report(self):
+        """
+        Print throughput statistics for each pipeline.
+        """
+        for pipeline, stats in self.stats.items():
+            if stats['actions'] <= 0:
+                continue
+            latencies = sorted(stats['latencies'])
+            medianLatency = 0
+            if len(latencies) > 0:
+                medianLatency = latencies[len(latencies) // 2]
+            seconds = max(stats['time'], 1e-6)
+            print('Bulk loading ({0}): {1} actions, {2:.1f} MB in {3} requests '
+                  '({4} retries), {5:.1f} s, {6:.0f} actions/s, {7:.2f} MB/s, '
+                  'median request time {8:.3f} s.'.format(pipeline, stats['actions'],
+                                                          stats['bytes'] / 1048576,
+                                                          stats['requests'], stats['retries'],
+                                                          stats['time'], stats['actions'] / seconds,
+                                                          stats['bytes'] / 1048576 / seconds,
+                                                          medianLatency))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
@@ -0,0 +1,78 @@
+class Collation:
+    """
+    Sort keys for the word forms and lemmata of one language.
+    If the language has a custom alphabetical order
+    (lang_props.lexicographic_order), the key of a string is a bytes
+    object where each character (or multicharacter sequence listed
+    in the order) is replaced with its 3-byte position in the order.
+    Characters absent from the order go after all others, sorted by
+    their code points. Comparing such keys gives the same result as
+    comparing lists of (position, character) tuples, but they take
+    much less memory and are compared much faster. Without a custom
+    order, a string is its own key.
+    Keys are cached, so that each string is processed only once
+    for sorting the words, the lemmata and the dictionary, unless
+    cacheKeys is False (then the memory used does not grow with
+    the number of different strings).
+    """
+
+    def __init__(self, order=None, rxChars=None, cacheKeys=True):
+        """
+        order is the list of characters in alphabetical order;
+        rxChars is a regex that splits a lowercase string into
+        characters (see Indexator.character_regex()).
+        """
+        self.rxChars = rxChars
+        self.cacheKeys = cacheKeys
+        self.codes = None
+        if order is not None:
+            self.codes = {order[i]: i.to_bytes(3, 'big') for i in range(len(order))}
+            self.unknownCode = len(order).to_bytes(3, 'big')
+        self.keys = {}      # string -> its sort key
+
+    def unit_code(self, c):
+        """
+        Return the code of a character absent from the order.
+        Such codes are cached together with the codes of the
+        characters from the order.
+        """
+        # Code points are shifted by 1, so that the terminating
+        # zero sorts a character sequence before its continuations
+        code = (self.unknownCode
+                + b''.join((ord(ch) + 1).to_bytes(3, 'big') for ch in c)
+                + b'\x00\x00\x00')
+        self.codes[c] = code
+        return code
+
+    def make_key(self, s):
+        """
+        Build the sort key for a string.
+        """
+        codes = self.codes
+        return b''.join([codes[c] if c in codes else self.unit_code(c)
+                         for c in self.rxChars.findall(s.lower())])
+
+    def sort_key(self, s):
+        """
+        Return the (cached) sort key for a string.
+        """
+        if self.codes is None:
+            return s
+        if not self.cacheKeys:
+            return self.make_key(s)
+        try:
+            return self.keys[s]
+        except KeyError:
+            key = self.make_key(s)
+            self.keys[s] = key
+            return key
+
+    def positions(self, strings):
+        """
+        Sort the strings. Return a dictionary with the position
+        of each string in the sorted list.
+        """
+        return {s: i for i, s in enumerate(sorted(strings, key=self.sort_key))}
+
+    def clear(self):
+        self.keys = {}
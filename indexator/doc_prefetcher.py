@@ -0,0 +1,84 @@
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+
+class DocPrefetcher:
+    """
+    Reads source files ahead of the indexator. While one file
+    is being processed and loaded into Elasticsearch, the next
+    files are decompressed and parsed in background threads
+    (zlib and file reading release the GIL, so decompression
+    really runs in parallel with the main thread).
+    The number of files read in advance and their total
+    uncompressed size are limited, so that read-ahead does not
+    make the indexator run out of memory. Files that are larger
+    than the limit are not read in advance; the reader processes
+    them as usual when their turn comes.
+    """
+
+    def __init__(self, reader, settings=None, keepText=False):
+        self.reader = reader
+        if settings is None:
+            settings = {}
+        self.nFiles = 2         # maximal number of files read in advance
+        if 'read_ahead_files' in settings:
+            self.nFiles = settings['read_ahead_files']
+        self.maxBytes = 256 * 1024 * 1024   # maximal total uncompressed size of these files
+        if 'read_ahead_max_bytes' in settings:
+            self.maxBytes = settings['read_ahead_max_bytes']
+        # If True, the JSON text is kept along with the parsed
+        # document (e.g. for generating full-text views)
+        self.keepText = keepText
+
+    def enabled(self):
+        return self.nFiles > 0 and self.reader.format in ('json', 'json-gzip')
+
+    def read_file(self, fname):
+        """
+        Decompress and parse one file in a background thread.
+        Return its JSON text (if needed) and the parsed document.
+        """
+        text = self.reader.read_text(fname)
+        doc = self.reader.parse_doc(text)
+        if not self.keepText:
+            text = None
+        return text, doc
+
+    def iterate(self, filenames):
+        """
+        Iterate over (filename, text, document) tuples in the order
+        of filenames. The text and the document are None if the file
+        has not been read in advance.
+        """
+        if not self.enabled():
+            for fname in filenames:
+                yield fname, None, None
+            return
+        sizeFactor = 1
+        if self.keepText:
+            sizeFactor = 2
+        sizes = [self.reader.uncompressed_size(fname) * sizeFactor for fname in filenames]
+        pending = collections.deque()   # (index of the file, future or None)
+        pendingBytes = 0
+        iFile = 0
+        with ThreadPoolExecutor(max_workers=self.nFiles) as pool:
+            while iFile < len(filenames) or len(pending) > 0:
+                while (iFile < len(filenames) and len(pending) < self.nFiles
+                       and (len(pending) <= 0 or pendingBytes + sizes[iFile] <= self.maxBytes)):
+                    if sizes[iFile] > self.maxBytes:
+                        pending.append((iFile, None))
+                    else:
+                        pending.append((iFile, pool.submit(self.read_file, filenames[iFile])))
+                        pendingBytes += sizes[iFile]
+                    iFile += 1
+                iCurFile, future = pending.popleft()
+                if future is None:
+                    yield filenames[iCurFile], None, None
+                    continue
+                try:
+                    text, doc = future.result()
+                except MemoryError:
+                    print('Memory error when reading', filenames[iCurFile], 'in advance.')
+                    text, doc = None, None
+                pendingBytes -= sizes[iCurFile]
+                yield filenames[iCurFile], text, doc
@@ -0,0 +1,164 @@
+import os
+import json
+import hashlib
+import collections
+import multiprocessing
+from json2html import JSON2HTML
+
+
+class FulltextGenerator:
+    """
+    Generates full-text HTML views of the source documents with
+    JSON2HTML. If fulltext_processes in the settings is greater
+    than 1, the documents are rendered in a pool of worker processes,
+    either while the sentences are being loaded into Elasticsearch
+    or, if fulltext_concurrent is false, in a separate stage after
+    all documents have been indexed.
+    The hashes of the source files are stored after each run, so that
+    the views of unchanged documents are not generated again. The
+    sentences are numbered from the beginning in each view, so a view
+    only depends on its source file and the corpus settings.
+    """
+
+    def __init__(self, j2h, settings, fnameHashes):
+        self.j2h = j2h      # JSON2HTML used if there are no worker processes
+        self.settings = settings
+        self.fnameHashes = fnameHashes
+        self.nProcesses = 1
+        if 'fulltext_processes' in settings and settings['fulltext_processes'] > 1:
+            self.nProcesses = settings['fulltext_processes']
+        self.concurrent = True
+        if 'fulltext_concurrent' in settings and not settings['fulltext_concurrent']:
+            self.concurrent = False
+        self.pool = None
+        self.pending = collections.deque()    # results of the tasks sent to the pool
+        self.queue = []     # tasks waiting for the separate stage
+        # The views also depend on the corpus settings, so they are
+        # generated anew if the settings change
+        self.settingsHash = self.settings_hash()
+        self.hashes = {}    # output filename -> hash of the source file
+        self.prevHashes = self.load_hashes()
+        self.nGenerated = 0
+        self.nSkipped = 0
+
+    def settings_hash(self):
+        """
+        Return the hash of the corpus settings files.
+        """
+        h = hashlib.sha1()
+        for fname in ['corpus.json', 'categories.json']:
+            with open(os.path.join(JSON2HTML.SETTINGS_DIR, fname), 'rb') as fIn:
+                h.update(fIn.read())
+        return h.hexdigest()
+
+    def load_hashes(self):
+        """
+        Load the hashes of the source files saved by the previous run.
+        Return an empty dictionary if they cannot be used.
+        """
+        if not os.path.exists(self.fnameHashes):
+            return {}
+        with open(self.fnameHashes, 'r', encoding='utf-8') as fIn:
+            data = json.load(fIn)
+        if data['settings_hash'] != self.settingsHash:
+            return {}
+        return data['files']
+
+    def save_hashes(self):
+        """
+        Save the hashes of the source files whose views are up to date.
+        """
+        dirname = os.path.dirname(self.fnameHashes)
+        if len(dirname) > 0 and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        hashes = dict(self.prevHashes)
+        hashes.update(self.hashes)
+        with open(self.fnameHashes + '.tmp', 'w', encoding='utf-8') as fOut:
+            json.dump({'settings_hash': self.settingsHash, 'files': hashes},
+                      fOut, ensure_ascii=False, indent=1)
+        os.replace(self.fnameHashes + '.tmp', self.fnameHashes)
+
+    def generate(self, fnameIn, fnameOut, sourceHash):
+        """
+        Generate the view of the document fnameIn and store it
+        in fnameOut, unless the view exists and the source file has
+        not changed since it was generated.
+        """
+        if (fnameOut in self.prevHashes and self.prevHashes[fnameOut] == sourceHash
+                and os.path.exists(fnameOut)):
+            self.hashes[fnameOut] = sourceHash
+            self.nSkipped += 1
+            return
+        self.prevHashes.pop(fnameOut, None)
+        task = (fnameIn, fnameOut)
+        if self.nProcesses <= 1:
+            self.j2h.process_file(fnameIn, fnameOut, numSentStart=0)
+            self.hashes[fnameOut] = sourceHash
+            self.nGenerated += 1
+        elif self.concurrent:
+            self.submit(task, sourceHash)
+        else:
+            self.queue.append((task, sourceHash))
+
+    def submit(self, task, sourceHash):
+        """
+        Send a task to the pool. Wait for the earlier tasks if too
+        many of them are pending.
+        """
+        if self.pool is None:
+            self.pool = multiprocessing.Pool(self.nProcesses, initializer=init_fulltext_worker,
+                                             initargs=(self.settings,))
+        self.pending.append((self.pool.apply_async(process_file_in_worker, task),
+                             task[1], sourceHash))
+        while len(self.pending) > 4 * self.nProcesses:
+            self.wait_one()
+
+    def wait_one(self):
+        result, fnameOut, sourceHash = self.pending.popleft()
+        result.get()
+        self.hashes[fnameOut] = sourceHash
+        self.nGenerated += 1
+
+    def wait(self):
+        """
+        Wait until all views submitted to the pool have been generated.
+        """
+        while len(self.pending) > 0:
+            self.wait_one()
+
+    def finish(self):
+        """
+        Generate the views that are still queued, wait for all
+        workers and save the hashes of the source files.
+        """
+        for task, sourceHash in self.queue:
+            self.submit(task, sourceHash)
+        self.queue = []
+        self.wait()
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        if self.nGenerated > 0 or self.nSkipped > 0:
+            print('Full-text views:', self.nGenerated, 'generated,',
+                  self.nSkipped, 'unchanged.')
+            self.save_hashes()
+
+    def remove(self, fnameOut):
+        """
+        Forget the hash of a view that has been deleted.
+        """
+        self.prevHashes.pop(fnameOut, None)
+        self.hashes.pop(fnameOut, None)
+
+
+workerJ2H = None    # JSON2HTML instance used in a worker process
+
+
+def init_fulltext_worker(settings):
+    global workerJ2H
+    workerJ2H = JSON2HTML(settings=settings)
+
+
+def process_file_in_worker(fnameIn, fnameOut):
+    workerJ2H.process_file(fnameIn, fnameOut, numSentStart=0)
@@ -1,21 +1,41 @@
 import os; print(os.getcwd())
 from elasticsearch import Elasticsearch
 from elasticsearch.client import IndicesClient
-from elasticsearch.helpers import bulk
 from elasticsearch.exceptions import RequestError
 import json
 import ijson
 import os
 import re
+import shutil
+import array
+import hashlib
+import pickle
 import time
 import math
 import random
 import sys
 import subprocess
 import argparse
+import collections
+import copy
+import itertools
+import multiprocessing
 from prepare_data import PrepareData
 from json_doc_reader import JSONDocReader
 from json2html import JSON2HTML
+sys.path.insert(0, '../search/web_app')
+from fulltext_store import FulltextStore
+from doc_freq_matrix import DocFreqMatrix, DocFreqMatrixWriter
+from corpus_stats import CorpusStats
+from word_stats import WordStats, SQLiteWordStats, SortPositions
+from word_keys import word_key, word_from_key
+from bulk_loader import BulkLoader
+from doc_prefetcher import DocPrefetcher
+from collation import Collation
+from indexing_report import IndexingReport
+from fulltext_generator import FulltextGenerator
+sys.path.insert(0, '../search')
+from search_engine.client import SearchClient
 
 
 class Indexator:
@@ -24,10 +44,12 @@ class Indexator:
     database.
     """
     SETTINGS_DIR = '../conf'
+    WORD_BATCH_SIZE = 1000      # number of words or lemmata whose statistics are retrieved at once
     rxBadFileName = re.compile('[^\\w_.-]*', flags=re.DOTALL)
 
-    def __init__(self, overwrite=False):
+    def __init__(self, overwrite=False, incremental=False):
         self.overwrite = overwrite  # whether to overwrite an existing index without asking
+        self.incremental = incremental  # whether to index only the files changed since the last indexation
         with open(os.path.join(self.SETTINGS_DIR, 'corpus.json'),
                   'r', encoding='utf-8') as fSettings:
             self.settings = json.load(fSettings)
@@ -43,9 +65,33 @@ class Indexator:
         if 'wf_lowercase' not in self.settings or self.settings['wf_lowercase']:
             self.lowerWf = True
         self.iterSent = None
-        if self.input_format in ['json', 'json-gzip']:
+        self.prefetcher = None
+        if self.input_format in JSONDocReader.extensions:
             self.iterSent = JSONDocReader(format=self.input_format,
                                           settings=self.settings)
+            # Full-text views are generated from the JSON text read in advance,
+            # unless they are generated in separate processes
+            self.prefetcher = DocPrefetcher(self.iterSent, self.settings,
+                                            keepText=('fulltext_view_enabled' in self.settings
+                                                      and self.settings['fulltext_view_enabled']
+                                                      and ('fulltext_processes' not in self.settings
+                                                           or self.settings['fulltext_processes'] <= 1)))
+        # Two-pass alignment only saves memory if the file can be read
+        # sentence by sentence in the second pass, i.e. in line-delimited
+        # formats; other JSON files are loaded entirely anyway
+        self.twoPassAlignment = False
+        if (len(self.languages) > 1
+                and 'two_pass_alignment' in self.settings
+                and self.settings['two_pass_alignment']):
+            if self.input_format in ('jsonl', 'jsonl-gzip'):
+                self.twoPassAlignment = True
+            else:
+                print('Warning: two_pass_alignment is only used with the jsonl and '
+                      'jsonl-gzip input formats; the sentences of each document '
+                      'will be kept in memory until they are aligned.')
+        self.nProcesses = 1     # number of worker processes that read and process source files
+        if 'indexing_processes' in self.settings and self.settings['indexing_processes'] > 1:
+            self.nProcesses = self.settings['indexing_processes']
 
         # Make sure only commonly used word fields and those listed
         # in corpus.json get into the words index.
@@ -73,6 +119,7 @@ class Indexator:
                                 for v in categories[lang].values()]
         self.goodWordFields = set(self.goodWordFields)
         self.characterRegexes = {}
+        self.collations = {}    # language -> Collation object with cached sort keys
 
         self.pd = PrepareData()
 
@@ -84,42 +131,121 @@ class Indexator:
         else:
             self.es = Elasticsearch()
         self.es_ic = IndicesClient(self.es)
+        self.bulkLoader = BulkLoader(self.es, self.settings)
+        # The search app accesses the indexes through aliases named
+        # %corpus_name%.docs/words/sentences. Full indexation creates
+        # new versions of the indexes and switches the aliases to them
+        # when they are ready, so that the old version can be used
+        # in the meantime.
+        self.indexTypes = ['docs', 'words', 'sentences']
+        self.indexNames = {indexType: self.name + '.' + indexType
+                           for indexType in self.indexTypes}   # index type -> name of the index being loaded
+        self.servingSettings = {}   # index type -> settings to be restored after loading
 
         self.shuffled_ids = [i for i in range(1, 1000000)]
         random.shuffle(self.shuffled_ids)
         self.shuffled_ids.insert(0, 0)    # id=0 is special and should not change
-        self.tmpWordIDs = [{} for i in range(len(self.languages))]    # word as JSON -> its integer ID
-        self.tmpLemmaIDs = [{} for i in range(len(self.languages))]   # lemma as string -> its integer ID
-        # Apart from the two dictionaries above, words and lemmata
-        # have string IDs starting with 'w' or 'l' followed by an integer
-        self.word2lemma = [{} for i in range(len(self.languages))]    # word/lemma ID -> ID of its lemma (or -1, if none)
-        self.wordFreqs = [{} for i in range(len(self.languages))]     # word/lemma ID -> its frequency
-        self.wordSFreqs = [{} for i in range(len(self.languages))]    # word/lemma ID -> its number of sentences
-        self.wordDocFreqs = [{} for i in range(len(self.languages))]  # (word/lemma ID, dID) -> word frequency in the document
-        # self.wordSIDs = [{} for i in range(len(self.languages))]      # word's ID -> set of sentence IDs
-        self.wordDIDs = [{} for i in range(len(self.languages))]      # word/lemma ID -> set of document IDs
-        self.wfs = set()         # set of word forms (for sorting)
-        self.lemmata = set()     # set of lemmata (for sorting)
+        self.init_word_stats()
         self.sID = 0          # current sentence ID for each language
         self.dID = 0          # current document ID
         self.wID = 0          # current word ID
         self.wordFreqID = 0   # current word_freq ID for word/document frequencies
         self.lemmaFreqID = 0  # current word_freq ID for lemma/document frequencies
+        # Word/document and lemma/document frequencies are stored either
+        # as word_freq documents in the words index, or in files read
+        # by the corpus app (see doc_freq_matrix.py)
+        self.wordFreqStorage = 'index'
+        if 'word_freq_storage' in self.settings and self.settings['word_freq_storage'] == 'sidecar':
+            self.wordFreqStorage = 'sidecar'
+        self.docFreqDir = os.path.join('../search/corpus_freqs', self.name)
+        self.docFreqWriters = None    # item type (w/l) -> DocFreqMatrixWriter
+        self.docFreqVersion = None    # subdirectory where the new files are written
+
+        self.filenames = []   # List of tuples (filename, filesize)
+        self.corpusSizeInBytes = 0
+
+        # The state of the indexes is saved after indexation if needed
+        # for subsequent incremental indexation
+        self.keepState = self.incremental
+        if 'keep_index_state' in self.settings and self.settings['keep_index_state']:
+            self.keepState = True
+        self.stateDir = os.path.join('../corpus', self.name + '_index_state')
+        if 'index_state_dir' in self.settings and len(self.settings['index_state_dir']) > 0:
+            self.stateDir = self.settings['index_state_dir']
+        self.indexedFiles = {}   # source filename (relative to corpus_dir) -> {'hash', 'd_id', 'fulltext_id'}
+        self.fulltext = FulltextGenerator(self.j2h, self.settings,
+                                          os.path.join(self.stateDir, 'fulltext_hashes.json'))
+        # During full indexation, a checkpoint can be saved after every
+        # checkpoint_interval source files, so that an interrupted
+        # indexation can be resumed (see resume_corpus())
+        self.checkpointInterval = 0
+        if 'checkpoint_interval' in self.settings and self.settings['checkpoint_interval'] > 0:
+            self.checkpointInterval = self.settings['checkpoint_interval']
+        self.sourceFiles = []    # all source files of the current full indexation, in the order of indexing
+        self.nFilesDone = 0      # number of files from self.sourceFiles indexed so far
+        fnameReport = os.path.join('../corpus', self.name + '_indexing_report.json')
+        if 'indexing_report_file' in self.settings and len(self.settings['indexing_report_file']) > 0:
+            fnameReport = self.settings['indexing_report_file']
+        self.report = IndexingReport(self.settings, fname=fnameReport)
+
+    def init_word_stats(self, inMemory=False):
+        """
+        Create an empty storage for word and lemma statistics
+        and reset the word counters. The storage is kept on disk
+        if the settings say so, unless inMemory is True.
+        """
+        # Words and lemmata have integer IDs in the statistics storage.
+        # In the indexes, their IDs are strings starting with 'w' or 'l'
+        # followed by the integer.
+        if not inMemory and self.word_stats_storage() == 'sqlite':
+            self.wordStats = SQLiteWordStats(len(self.languages), **self.sqlite_word_stats_options())
+        else:
+            self.wordStats = WordStats(len(self.languages))
+        # Sort orders of the words and lemmata in the words index
+        # (-1 if an item is not in the index)
+        self.wordOrders = array.array('q')    # 2 * word ID -> wf_order, 2 * word ID + 1 -> l_order
+        self.lemmaOrders = array.array('q')   # lemma ID -> l_order
+        # Word forms and lemmata of each language (for sorting); if the
+        # statistics are kept on disk, they are taken from there instead
+        self.wfs = None
+        self.lemmata = None
+        if not isinstance(self.wordStats, SQLiteWordStats):
+            self.wfs = [set() for i in range(len(self.languages))]
+            self.lemmata = [set() for i in range(len(self.languages))]
         self.numWords = 0     # number of words in current document
         self.numSents = 0     # number of sentences in current document
         self.numWordsLang = [0] * len(self.languages)    # number of words in each language in current document
         self.numSentsLang = [0] * len(self.languages)    # number of sentences in each language in current document
         self.totalNumWords = 0
 
-        self.filenames = []   # List of tuples (filename, filesize)
-        self.corpusSizeInBytes = 0
+    def word_stats_storage(self):
+        """
+        Return the type of storage for word statistics
+        (memory or sqlite) set in the settings.
+        """
+        if 'word_stats_storage' in self.settings and self.settings['word_stats_storage'] == 'sqlite':
+            return 'sqlite'
+        return 'memory'
+
+    def sqlite_word_stats_options(self):
+        """
+        Return keyword arguments for SQLiteWordStats based on the settings.
+        """
+        options = {'cacheSize': 1000000, 'dirname': None}
+        if 'word_stats_cache_size' in self.settings:
+            options['cacheSize'] = self.settings['word_stats_cache_size']
+        if 'word_stats_dir' in self.settings and len(self.settings['word_stats_dir']) > 0:
+            options['dirname'] = self.settings['word_stats_dir']
+        return options
 
     def delete_indices(self):
         """
         If there already exist indices with the same names,
         ask the user if they want to overwrite them. If they
-        say yes, remove the indices and return True. Otherwise,
-        return False.
+        say no, return False. Otherwise, remove the index versions
+        left by unfinished indexations and return True. The indexes
+        that are currently in use are only removed after the new
+        ones are ready (see switch_aliases()).
         """
         if not self.overwrite:
             if (self.es_ic.exists(index=self.name + '.docs')
@@ -131,12 +257,10 @@ class Indexator:
                 if reply.lower() != 'y':
                     print('Indexation aborted.')
                     return False
-        if self.es_ic.exists(index=self.name + '.docs'):
-            self.es_ic.delete(index=self.name + '.docs')
-        if self.es_ic.exists(index=self.name + '.words'):
-            self.es_ic.delete(index=self.name + '.words')
-        if self.es_ic.exists(index=self.name + '.sentences'):
-            self.es_ic.delete(index=self.name + '.sentences')
+        for indexType in self.indexTypes:
+            for index, indexInfo in self.es_ic.get_alias(index=self.name + '.' + indexType + '_*').items():
+                if len(indexInfo['aliases']) <= 0:
+                    self.es_ic.delete(index=index)
         # Obsolete index word_freq can be present in pre-2019 corpora
         if self.es_ic.exists(index=self.name + '.word_freqs'):
             self.es_ic.delete(index=self.name + '.word_freqs')
@@ -145,7 +269,10 @@ class Indexator:
     def create_indices(self):
         """
         Create empty elasticsearch indices for corpus data, using
-        mappings provided by PrepareData.
+        mappings provided by PrepareData. The names of the indices
+        get a version suffix. For faster loading, the indices are
+        created without replicas and with refresh switched off;
+        their normal settings are restored by switch_aliases().
         """
         self.sentWordMapping = self.pd.generate_words_mapping(wordFreqs=False)
         self.wordMapping = self.pd.generate_words_mapping(wordFreqs=True)
@@ -153,12 +280,128 @@ class Indexator:
                                                               corpusSizeInBytes=self.corpusSizeInBytes)
         self.docMapping = self.pd.generate_docs_mapping()
 
-        self.es_ic.create(index=self.name + '.docs',
-                          body=self.docMapping)
-        self.es_ic.create(index=self.name + '.words',
-                          body=self.wordMapping)
-        self.es_ic.create(index=self.name + '.sentences',
-                          body=self.sentMapping)
+        timestamp = time.strftime('%Y%m%d%H%M%S')
+        version = timestamp
+        iVersion = 1
+        while any(self.es_ic.exists(index=self.name + '.' + indexType + '_' + version)
+                  for indexType in self.indexTypes):
+            # The previous indexation started less than a second ago
+            version = timestamp + '_' + str(iVersion)
+            iVersion += 1
+        for indexType, mapping in [('docs', self.docMapping),
+                                   ('words', self.wordMapping),
+                                   ('sentences', self.sentMapping)]:
+            mapping = copy.deepcopy(mapping)
+            if 'settings' not in mapping:
+                mapping['settings'] = {}
+            refreshInterval = None      # None stands for the default value
+            if 'refresh_interval' in mapping['settings']:
+                refreshInterval = mapping['settings']['refresh_interval']
+            self.servingSettings[indexType] = {
+                'refresh_interval': refreshInterval,
+                'number_of_replicas': None
+            }
+            mapping['settings']['refresh_interval'] = '-1'
+            mapping['settings']['number_of_replicas'] = 0
+            self.indexNames[indexType] = self.name + '.' + indexType + '_' + version
+            self.es_ic.create(index=self.indexNames[indexType],
+                              body=mapping)
+
+    def switch_aliases(self):
+        """
+        Make newly loaded indices ready for search: merge their segments,
+        restore their refresh interval and number of replicas, and
+        atomically switch the aliases to them, together with the
+        document frequency files, if any. Remove the previous
+        versions of the indices.
+        """
+        self.report.begin_phase('aliases')
+        print('Optimizing the indexes...')
+        aliasActions = []
+        oldIndices = []
+        for indexType in self.indexTypes:
+            alias = self.name + '.' + indexType
+            index = self.indexNames[indexType]
+            self.es_ic.forcemerge(index=index, max_num_segments=1, request_timeout=3600)
+            self.es_ic.put_settings(index=index, body={'index': self.servingSettings[indexType]})
+            self.es_ic.refresh(index=index)
+            if self.es_ic.exists_alias(name=alias):
+                for oldIndex in self.es_ic.get_alias(name=alias):
+                    if oldIndex == index:
+                        # The aliases were switched by an interrupted
+                        # indexation that is being resumed
+                        continue
+                    aliasActions.append({'remove': {'index': oldIndex, 'alias': alias}})
+                    oldIndices.append(oldIndex)
+            elif self.es_ic.exists(index=alias):
+                # Index created by an older version of the indexator
+                # under the name of the alias
+                aliasActions.append({'remove_index': {'index': alias}})
+            aliasActions.append({'add': {'index': index, 'alias': alias}})
+        self.increase_write_counter()
+        self.es_ic.update_aliases(body={'actions': aliasActions})
+        self.switch_doc_freqs()
+        for oldIndex in oldIndices:
+            self.es_ic.delete(index=oldIndex)
+        self.indexNames = {indexType: self.name + '.' + indexType
+                           for indexType in self.indexTypes}
+
+    def increase_write_counter(self):
+        """
+        Increase the counter of indexations stored in the metadata
+        of the docs index. The corpus app keeps some data retrieved
+        from the indexes in memory and discards it when the counter
+        changes (see SearchClient.indexes_version()). The indexes are
+        refreshed first, so that the changes are already visible.
+        """
+        self.es_ic.refresh(index=','.join(self.indexNames[indexType] for indexType in self.indexTypes))
+        counter = 0
+        for indexInfo in self.es_ic.get_mapping(index=self.indexNames['docs']).values():
+            if '_meta' in indexInfo['mappings'] and 'write_counter' in indexInfo['mappings']['_meta']:
+                counter = max(counter, indexInfo['mappings']['_meta']['write_counter'])
+        self.es_ic.put_mapping(index=self.indexNames['docs'],
+                               body={'_meta': {'write_counter': counter + 1}})
+
+    def new_doc_freq_version(self):
+        """
+        Return the name of a new subdirectory of the document frequency
+        files directory (see doc_freq_matrix.py). In a full indexation,
+        it is the name of the words index being loaded; in an incremental
+        one, the indexes are not versioned, so a timestamp is used.
+        """
+        if self.indexNames['words'] != self.name + '.words':
+            return self.indexNames['words']
+        timestamp = time.strftime('%Y%m%d%H%M%S')
+        version = self.name + '.words_' + timestamp
+        iVersion = 1
+        while os.path.exists(os.path.join(self.docFreqDir, version)):
+            version = self.name + '.words_' + timestamp + '_' + str(iVersion)
+            iVersion += 1
+        return version
+
+    def switch_doc_freqs(self):
+        """
+        Make the document frequency files written by the last call
+        of iterate_words() the current ones for the corpus app and
+        remove the previous versions. Must be called when the words
+        index these files correspond to becomes searchable.
+        """
+        if self.docFreqVersion is None:
+            return
+        fnamePointer = os.path.join(self.docFreqDir, DocFreqMatrix.CURRENT)
+        with open(fnamePointer + '.tmp', 'w', encoding='utf-8') as fOut:
+            fOut.write(self.docFreqVersion)
+        os.replace(fnamePointer + '.tmp', fnamePointer)
+        for fname in os.listdir(self.docFreqDir):
+            path = os.path.join(self.docFreqDir, fname)
+            if fname == self.docFreqVersion or fname == DocFreqMatrix.CURRENT:
+                continue
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            elif fname in DocFreqMatrix.FILENAMES.values():
+                # Files written by an older version of the indexator
+                os.remove(path)
+        self.docFreqVersion = None
 
     def randomize_id(self, realID):
         """
@@ -197,10 +440,12 @@ class Indexator:
                 if field == 'wf':
                     if self.lowerWf:
                         wClean[field] = wClean[field].lower()
-                    self.wfs.add(wClean[field])
+                    if self.wfs is not None:
+                        self.wfs[langID].add(wClean[field])
         if 'ana' in w:
             lemma = self.get_lemma(w, lower_lemma=self.lowerWf)
-            self.lemmata.add(lemma)
+            if self.lemmata is not None:
+                self.lemmata[langID].add(lemma)
             wClean['ana'] = []
             for ana in w['ana']:
                 cleanAna = {}
@@ -235,44 +480,19 @@ class Indexator:
                 bUniquelyAnalyzed = False
 
             wClean, lemma = self.clean_word(w, langID)
-            wCleanTxt = json.dumps(wClean, ensure_ascii=False, sort_keys=True)
-            if wCleanTxt in self.tmpWordIDs[langID]:
-                wID = self.tmpWordIDs[langID][wCleanTxt]
-            else:
-                wID = sum(len(self.tmpWordIDs[i]) for i in range(len(self.languages)))
-                self.tmpWordIDs[langID][wCleanTxt] = wID
-            wID = 'w' + str(wID)
-            w['w_id'] = wID
-            lID = 'l0'   # Default: no analysis
+            wID = self.wordStats.word_id(langID, word_key(wClean))
+            w['w_id'] = 'w' + str(wID)
+            lID = 0   # Default: no analysis
             if len(lemma) > 0:
-                try:
-                    lID = self.tmpLemmaIDs[langID][lemma]
-                except KeyError:
-                    lID = sum(len(self.tmpLemmaIDs[i])
-                              for i in range(len(self.languages))) + 1
-                    self.tmpLemmaIDs[langID][lemma] = lID
-                lID = 'l' + str(lID)
-                self.word2lemma[langID][wID] = lID
-            w['l_id'] = lID
-            for itemID in [wID, lID]:
-                try:
-                    self.wordFreqs[langID][itemID] += 1
-                except KeyError:
-                    self.wordFreqs[langID][itemID] = 1
-                if itemID not in sIDAdded:
-                    sIDAdded.add(itemID)
-                    try:
-                        self.wordSFreqs[langID][itemID] += 1
-                    except KeyError:
-                        self.wordSFreqs[langID][itemID] = 1
-                try:
-                    self.wordDIDs[langID][itemID].add(self.dID)
-                except KeyError:
-                    self.wordDIDs[langID][itemID] = {self.dID}
-                try:
-                    self.wordDocFreqs[langID][(itemID, self.dID)] += 1
-                except KeyError:
-                    self.wordDocFreqs[langID][(itemID, self.dID)] = 1
+                lID = self.wordStats.lemma_id(langID, lemma)
+                self.wordStats.set_word_lemma(wID, lID)
+            w['l_id'] = 'l' + str(lID)
+            for itemType, itemID in [('w', wID), ('l', lID)]:
+                sFreq = 0
+                if (itemType, itemID) not in sIDAdded:
+                    sIDAdded.add((itemType, itemID))
+                    sFreq = 1
+                self.wordStats.add_occurrences(langID, itemType, itemID, self.dID, sFreq=sFreq)
         if not bFullyAnalyzed:
             return 'incomplete'
         if not bUniquelyAnalyzed:
@@ -300,75 +520,83 @@ class Indexator:
         self.characterRegexes[lang] = rxChars
         return rxChars
 
-    def make_sorting_function(self, lang):
+    def collation(self, lang):
         """
-        Return a function that can be used for sorting tokens
-        in a list according to the alphabetical ordering specified
-        for the language lang.
+        Return the Collation object that sorts tokens according
+        to the alphabetical ordering specified for the language lang.
+        The sort keys it computes are kept until all words have
+        been indexed and the dictionaries have been generated.
         """
-        sortingFunction = lambda x: x
+        if lang in self.collations:
+            return self.collations[lang]
+        order = None
         if lang in self.settings['lang_props'] and 'lexicographic_order' in self.settings['lang_props'][lang]:
-            dictSort = {self.settings['lang_props'][lang]['lexicographic_order'][i]:
-                            (i, self.settings['lang_props'][lang]['lexicographic_order'][i])
-                        for i in range(len(self.settings['lang_props'][lang]['lexicographic_order']))}
-            maxIndex = len(dictSort)
-            rxChars = self.character_regex(lang)
-
-            def charReplaceFunction(c):
-                if c in dictSort:
-                    return dictSort[c]
-                return (maxIndex, c)
-
-            sortingFunction = lambda x: [charReplaceFunction(c) for c in rxChars.findall(x.lower())]
-        return sortingFunction
+            order = self.settings['lang_props'][lang]['lexicographic_order']
+        # With on-disk word statistics, the number of different
+        # strings is not limited by memory, so their keys are not cached
+        self.collations[lang] = Collation(order, self.character_regex(lang),
+                                          cacheKeys=(self.word_stats_storage() != 'sqlite'))
+        return self.collations[lang]
 
-    def sort_words(self, lang):
+    def sort_words(self, langID):
         """
-        Sort word forms and lemmata stored at earlier stages.
-        Return dictionaries with positions of word forms and
-        lemmata in the sorted list.
+        Sort word forms and lemmata of one language stored at earlier
+        stages. Return SortPositions objects (or SQLiteSortPositions,
+        if the word statistics are kept on disk) with positions of word
+        forms and lemmata in the sorted list.
         If there is a custom alphabetical order for the language,
         use it. Otherwise, use standard lexicographic sorting.
         """
-        wfsSorted = {}
-        iOrder = 0
-        sortingFunction = self.make_sorting_function(lang)
-        for wf in sorted(self.wfs, key=sortingFunction):
-            wfsSorted[wf] = iOrder
-            iOrder += 1
-        lemmataSorted = {}
-        iOrder = 0
-        for l in sorted(self.lemmata, key=sortingFunction):
-            lemmataSorted[l] = iOrder
-            iOrder += 1
+        collation = self.collation(self.languages[langID])
+        if isinstance(self.wordStats, SQLiteWordStats):
+            wfsSorted = self.wordStats.sort_positions('wf', self.iterate_sort_strings(langID, 'wf'),
+                                                      collation.sort_key)
+            lemmataSorted = self.wordStats.sort_positions('lemma', self.iterate_sort_strings(langID, 'lemma'),
+                                                          collation.sort_key)
+            return wfsSorted, lemmataSorted
+        wfsSorted = SortPositions(collation.positions(self.wfs[langID]))
+        lemmataSorted = SortPositions(collation.positions(self.lemmata[langID]))
         return wfsSorted, lemmataSorted
 
-    def get_freq_ranks(self, freqsSorted):
+    def iterate_sort_strings(self, langID, field):
+        """
+        Iterate over the word forms (field == 'wf') or the lemmata
+        (field == 'lemma') of all words of one language that occur
+        in the corpus, taking them from the word statistics.
+        The same string can be returned several times.
+        """
+        for w, wID, lID, wordFreq, wordSFreq in self.wordStats.iterate_words(langID):
+            if wordFreq <= 0:
+                continue
+            wJson = word_from_key(w)
+            if field == 'wf' and 'wf' in wJson:
+                yield wJson['wf']
+            elif field == 'lemma' and 'ana' in wJson:
+                yield self.get_lemma(wJson, lower_lemma=self.lowerWf)
+
+    def get_freq_ranks(self, freqCounts):
         """
         Calculate frequency ranks and rank/quantile labels for words
-        or lemmata.
+        or lemmata. freqCounts is a list of (frequency, number of items)
+        tuples sorted by frequency in decreasing order.
         """
         freqToRank = {}
         quantiles = {}
-        prevFreq = 0
-        prevRank = 0
-        for i in range(len(freqsSorted)):
-            v = freqsSorted[i]
-            if v != prevFreq:
-                if prevFreq != 0:
-                    freqToRank[prevFreq] = prevRank + (i - prevRank) // 2
-                prevRank = i
-                prevFreq = v
-        if prevFreq != 0:
-            freqToRank[prevFreq] = prevRank + (len(freqsSorted) - prevRank) // 2
+        qIndexes = {}
+        nItems = sum(count for freq, count in freqCounts)
         for q in [0.03, 0.04, 0.05, 0.1, 0.15, 0.2, 0.25, 0.5]:
-            qIndex = math.ceil(q * len(freqsSorted))
-            if qIndex >= len(freqsSorted):
-                qIndex = len(freqsSorted) - 1
-            if qIndex >= 0:
-                quantiles[q] = freqsSorted[qIndex]
-            else:
-                quantiles[q] = 0
+            qIndex = math.ceil(q * nItems)
+            if qIndex >= nItems:
+                qIndex = nItems - 1
+            qIndexes[q] = qIndex
+            quantiles[q] = 0
+        rank = 0
+        for freq, count in freqCounts:
+            freqToRank[freq] = rank + count // 2
+            for q in qIndexes:
+                if rank <= qIndexes[q] < rank + count:
+                    quantiles[q] = freq
+            rank += count
         return freqToRank, quantiles
 
     def quantile_label(self, freq, rank, quantiles):
@@ -462,59 +690,85 @@ class Indexator:
         Iterate over all lemmata for one language collected at the
         word iteration stage.
         """
-        lFreqsSorted = [self.wordFreqs[langID][itemID]
-                        for itemID in self.wordFreqs[langID]
-                        if itemID.startswith('l')]
-        lFreqsSorted.sort(reverse=True)
-        lemmaFreqToRank, quantiles = self.get_freq_ranks(lFreqsSorted)
+        with self.report.timer('word_ranks'):
+            lemmaFreqToRank, quantiles = self.get_freq_ranks(self.wordStats.freq_counts(langID, 'l'))
         iLemma = 0
-        for l, lID in self.tmpLemmaIDs[langID].items():
-            lID = 'l' + str(lID)
-            if iLemma % 250 == 0:
-                print('indexing lemma', iLemma)
-            lOrder = lemmataSorted[l]
-            lemmaJson = {
-                'wf': l,
-                'wtype': 'lemma',
-                'lang': langID,
-                'l_order': lOrder,
-                'freq': self.wordFreqs[langID][lID],
-                'lemma_freq': self.wordFreqs[langID][lID],
-                'rank_true': lemmaFreqToRank[self.wordFreqs[langID][lID]],
-                'rank': self.quantile_label(self.wordFreqs[langID][lID],
-                                            lemmaFreqToRank[self.wordFreqs[langID][lID]],
-                                            quantiles),
-                'n_sents': self.wordSFreqs[langID][lID],
-                'n_docs': len(self.wordDIDs[langID][lID]),
-                'freq_join': 'word'
-            }
-            curAction = {
-                '_index': self.name + '.words',
-                '_id': lID,
-                '_source': lemmaJson
-            }
-            iLemma += 1
-            yield curAction
-
-            for docID in self.wordDIDs[langID][lID]:
-                lfreqJson = {
-                    'wtype': 'word_freq',
-                    'l_id': lID,
-                    'd_id': docID,
+        lemmata = self.wordStats.iterate_lemmata(langID)
+        while True:
+            batch = list(itertools.islice(lemmata, self.WORD_BATCH_SIZE))
+            if len(batch) <= 0:
+                break
+            lIDs = [lIDInt for l, lIDInt, lemmaFreq, lemmaSFreq in batch if lemmaFreq > 0]
+            lOrders = lemmataSorted.lookup(l for l, lIDInt, lemmaFreq, lemmaSFreq in batch if lemmaFreq > 0)
+            docFreqsBatch = self.wordStats.doc_freqs_batch(langID, 'l', lIDs)
+            for l, lIDInt, lemmaFreq, lemmaSFreq in batch:
+                lID = 'l' + str(lIDInt)
+                if lemmaFreq <= 0:
+                    # All documents with this lemma have been removed
+                    if self.replace_order(self.lemmaOrders, lIDInt, -1) >= 0:
+                        yield {'_op_type': 'delete', '_index': self.indexNames['words'], '_id': lID}
+                    continue
+                docFreqs = docFreqsBatch[lIDInt]
+                if iLemma % 250 == 0:
+                    print('indexing lemma', iLemma)
+                lOrder = lOrders[l]
+                bOrderChanged = (self.replace_order(self.lemmaOrders, lIDInt, lOrder) != lOrder)
+                lemmaJson = {
+                    'wf': l,
+                    'wtype': 'lemma',
+                    'lang': langID,
                     'l_order': lOrder,
-                    'freq': self.wordDocFreqs[langID][(lID, docID)],
-                    'freq_join': {
-                        'name': 'word_freq',
-                        'parent': lID
-                    }
+                    'freq': lemmaFreq,
+                    'lemma_freq': lemmaFreq,
+                    'rank_true': lemmaFreqToRank[lemmaFreq],
+                    'rank': self.quantile_label(lemmaFreq,
+                                                lemmaFreqToRank[lemmaFreq],
+                                                quantiles),
+                    'n_sents': lemmaSFreq,
+                    'n_docs': len(docFreqs),
+                    'freq_join': 'word'
+                }
+                curAction = {
+                    '_index': self.indexNames['words'],
+                    '_id': lID,
+                    '_source': lemmaJson
                 }
-                curAction = {'_index': self.name + '.words',
-                             '_id': 'lfreq' + str(self.lemmaFreqID),
-                             '_source': lfreqJson,
-                             '_routing': lID}
-                self.lemmaFreqID += 1
+                iLemma += 1
                 yield curAction
 
+                if self.docFreqWriters is not None:
+                    self.docFreqWriters['l'].add_row(lIDInt, docFreqs)
+                    continue
+                for docID, docFreq, childID in docFreqs:
+                    if childID >= 0:
+                        # This document was indexed earlier
+                        if bOrderChanged:
+                            yield {'_op_type': 'update',
+                                   '_index': self.indexNames['words'],
+                                   '_id': 'lfreq' + str(childID),
+                                   '_routing': lID,
+                                   'doc': {'l_order': lOrder}}
+                        continue
+                    lfreqJson = {
+                        'wtype': 'word_freq',
+                        'l_id': lID,
+                        'd_id': docID,
+                        'l_order': lOrder,
+                        'freq': docFreq,
+                        'freq_join': {
+                            'name': 'word_freq',
+                            'parent': lID
+                        }
+                    }
+                    curAction = {'_index': self.indexNames['words'],
+                                 '_id': 'lfreq' + str(self.lemmaFreqID),
+                                 '_source': lfreqJson,
+                                 '_routing': lID}
+                    if self.keepState:
+                        self.wordStats.set_child_id(langID, 'l', lIDInt, docID, self.lemmaFreqID)
+                    self.lemmaFreqID += 1
+                    yield curAction
+
     def iterate_words(self):
         """
         Iterate through all words collected at the previous
@@ -522,89 +776,127 @@ class Indexator:
         in Elasticsearch.
         """
         self.wID = 0
+        if self.incremental and not isinstance(self.wordStats, SQLiteWordStats):
+            self.collect_sort_keys()
+        if self.wordFreqStorage == 'sidecar':
+            # The corpus app keeps reading the previous files until
+            # switch_doc_freqs() is called, since the word and document
+            # IDs in the new ones may not match the indexes it searches
+            self.docFreqVersion = self.new_doc_freq_version()
+            docFreqDir = os.path.join(self.docFreqDir, self.docFreqVersion)
+            self.docFreqWriters = {itemType: DocFreqMatrixWriter(os.path.join(docFreqDir, fname))
+                                   for itemType, fname in DocFreqMatrix.FILENAMES.items()}
 
         for langID in range(len(self.languages)):
-            wfsSorted, lemmataSorted = self.sort_words(self.languages[langID])
+            with self.report.timer('word_sorting'):
+                wfsSorted, lemmataSorted = self.sort_words(langID)
             iWord = 0
             print('Processing words in ' + self.languages[langID] + '...')
 
-            wFreqsSorted = [self.wordFreqs[langID][itemID]
-                            for itemID in self.wordFreqs[langID]
-                            if itemID.startswith('w')]
-            wFreqsSorted.sort(reverse=True)
-            wordFreqToRank, quantiles = self.get_freq_ranks(wFreqsSorted)
-
-            lFreqsSorted = [self.wordFreqs[langID][itemID]
-                            for itemID in self.wordFreqs[langID]
-                            if itemID.startswith('l')]
-            lFreqsSorted.sort(reverse=True)
-            lemmaFreqToRank, lemmaQuantiles = self.get_freq_ranks(lFreqsSorted)
-
-            # for wID in self.wordFreqs[langID]:
-            for w, wID in self.tmpWordIDs[langID].items():
-                wID = 'w' + str(wID)
-                if iWord % 500 == 0:
-                    print('indexing word', iWord)
-                try:
-                    lID = self.word2lemma[langID][wID]
-                except KeyError:
-                    lID = 'l0'
-                wJson = json.loads(w)
-                wfOrder = len(wfsSorted) + 1
-                if 'wf' in wJson:
-                    wfOrder = wfsSorted[wJson['wf']]
-                lOrder = len(lemmataSorted) + 1
-                if 'ana' in wJson:
-                    lOrder = lemmataSorted[self.get_lemma(wJson, lower_lemma=self.lowerWf)]
-                wJson['wf_order'] = wfOrder
-                wJson['l_order'] = lOrder
-                wJson['l_id'] = lID
-                wordFreq = self.wordFreqs[langID][wID]
-                lemmaFreq = self.wordFreqs[langID][lID]
-                wJson['freq'] = wordFreq
-                wJson['lemma_freq'] = lemmaFreq
-                # wJson['sids'] = [sid for sid in sorted(self.wordSIDs[langID][wID])]
-                wJson['dids'] = [did for did in sorted(self.wordDIDs[langID][wID])]
-                wJson['n_sents'] = self.wordSFreqs[langID][wID]
-                wJson['n_docs'] = len(wJson['dids'])
-                wJson['rank_true'] = wordFreqToRank[wJson['freq']]  # for the calculations
-                wJson['lemma_rank_true'] = lemmaFreqToRank[self.wordFreqs[langID][lID]]  # for the calculations
-                wJson['rank'] = self.quantile_label(wJson['freq'],
-                                                    wJson['rank_true'],
-                                                    quantiles)  # for the user
-                wJson['freq_join'] = 'word'
-                wJson['wtype'] = 'word'
-                curAction = {
-                    '_index': self.name + '.words',
-                    '_id': wID,
-                    '_source': wJson
-                }
-                yield curAction
+            with self.report.timer('word_ranks'):
+                wordFreqToRank, quantiles = self.get_freq_ranks(self.wordStats.freq_counts(langID, 'w'))
+                lemmaFreqToRank, lemmaQuantiles = self.get_freq_ranks(self.wordStats.freq_counts(langID, 'l'))
 
-                for docID in wJson['dids']:
-                    wfreqJson = {
-                        'wtype': 'word_freq',
-                        'w_id': wID,
-                        'l_id': lID,
-                        'd_id': docID,
-                        'wf_order': wfOrder,
-                        'l_order': lOrder,
-                        'freq': self.wordDocFreqs[langID][(wID, docID)],
-                        'freq_join': {
-                            'name': 'word_freq',
-                            'parent': wID
-                        }
+            words = self.wordStats.iterate_words(langID)
+            while True:
+                # The data needed for the words is retrieved for
+                # a batch of words at once
+                batch = list(itertools.islice(words, self.WORD_BATCH_SIZE))
+                if len(batch) <= 0:
+                    break
+                wJsons = {wIDInt: word_from_key(w)
+                          for w, wIDInt, lID, wordFreq, wordSFreq in batch if wordFreq > 0}
+                lemmata = {wIDInt: self.get_lemma(wJson, lower_lemma=self.lowerWf)
+                           for wIDInt, wJson in wJsons.items() if 'ana' in wJson}
+                wfOrders = wfsSorted.lookup(set(wJson['wf'] for wJson in wJsons.values() if 'wf' in wJson))
+                lOrders = lemmataSorted.lookup(set(lemmata.values()))
+                lemmaFreqs = self.wordStats.lemma_freqs(langID, set(lID for w, wIDInt, lID, wordFreq, wordSFreq in batch
+                                                                    if wordFreq > 0))
+                docFreqsBatch = self.wordStats.doc_freqs_batch(langID, 'w', list(wJsons))
+                for w, wIDInt, lID, wordFreq, wordSFreq in batch:
+                    wID = 'w' + str(wIDInt)
+                    if wordFreq <= 0:
+                        # All documents with this word have been removed
+                        if self.replace_order(self.wordOrders, 2 * wIDInt, -1) >= 0:
+                            yield {'_op_type': 'delete', '_index': self.indexNames['words'], '_id': wID}
+                        continue
+                    lemmaFreq = lemmaFreqs[lID]
+                    docFreqs = docFreqsBatch[wIDInt]
+                    lID = 'l' + str(lID)
+                    if iWord % 500 == 0:
+                        print('indexing word', iWord)
+                    wJson = wJsons[wIDInt]
+                    wfOrder = len(wfsSorted) + 1
+                    if 'wf' in wJson:
+                        wfOrder = wfOrders[wJson['wf']]
+                    lOrder = len(lemmataSorted) + 1
+                    if wIDInt in lemmata:
+                        lOrder = lOrders[lemmata[wIDInt]]
+                    wJson['wf_order'] = wfOrder
+                    wJson['l_order'] = lOrder
+                    bOrderChanged = (self.replace_order(self.wordOrders, 2 * wIDInt, wfOrder) != wfOrder)
+                    if self.replace_order(self.wordOrders, 2 * wIDInt + 1, lOrder) != lOrder:
+                        bOrderChanged = True
+                    wJson['l_id'] = lID
+                    wJson['freq'] = wordFreq
+                    wJson['lemma_freq'] = lemmaFreq
+                    wJson['dids'] = [did for did, docFreq, childID in docFreqs]
+                    wJson['n_sents'] = wordSFreq
+                    wJson['n_docs'] = len(wJson['dids'])
+                    wJson['rank_true'] = wordFreqToRank[wJson['freq']]  # for the calculations
+                    wJson['lemma_rank_true'] = lemmaFreqToRank[lemmaFreq]  # for the calculations
+                    wJson['rank'] = self.quantile_label(wJson['freq'],
+                                                        wJson['rank_true'],
+                                                        quantiles)  # for the user
+                    wJson['freq_join'] = 'word'
+                    wJson['wtype'] = 'word'
+                    curAction = {
+                        '_index': self.indexNames['words'],
+                        '_id': wID,
+                        '_source': wJson
                     }
-                    curAction = {'_index': self.name + '.words',
-                                 '_id': 'wfreq' + str(self.wordFreqID),
-                                 '_source': wfreqJson,
-                                 '_routing': wID}
-                    self.wordFreqID += 1
                     yield curAction
-                iWord += 1
-                self.wID += 1
+                    iWord += 1
+                    self.wID += 1
+
+                    if self.docFreqWriters is not None:
+                        self.docFreqWriters['w'].add_row(wIDInt, docFreqs)
+                        continue
+                    for docID, docFreq, childID in docFreqs:
+                        if childID >= 0:
+                            # This document was indexed earlier
+                            if bOrderChanged:
+                                yield {'_op_type': 'update',
+                                       '_index': self.indexNames['words'],
+                                       '_id': 'wfreq' + str(childID),
+                                       '_routing': wID,
+                                       'doc': {'wf_order': wfOrder, 'l_order': lOrder}}
+                            continue
+                        wfreqJson = {
+                            'wtype': 'word_freq',
+                            'w_id': wID,
+                            'l_id': lID,
+                            'd_id': docID,
+                            'wf_order': wfOrder,
+                            'l_order': lOrder,
+                            'freq': docFreq,
+                            'freq_join': {
+                                'name': 'word_freq',
+                                'parent': wID
+                            }
+                        }
+                        curAction = {'_index': self.indexNames['words'],
+                                     '_id': 'wfreq' + str(self.wordFreqID),
+                                     '_source': wfreqJson,
+                                     '_routing': wID}
+                        if self.keepState:
+                            self.wordStats.set_child_id(langID, 'w', wIDInt, docID, self.wordFreqID)
+                        self.wordFreqID += 1
+                        yield curAction
             for lAction in self.iterate_lemmata(langID, lemmataSorted):
                 yield lAction
+            wfsSorted.close()
+            lemmataSorted.close()
         emptyLemmaJson = {
             'wf': '',
             'wtype': 'lemma',
@@ -612,14 +904,49 @@ class Indexator:
             'rank_true': -1
         }
         curAction = {
-            '_index': self.name + '.words',
+            '_index': self.indexNames['words'],
             '_id': 'l0',    # l prefix stands for "lemma"
             '_source': emptyLemmaJson
         }
         yield curAction
+        if self.docFreqWriters is not None:
+            for writer in self.docFreqWriters.values():
+                writer.finish()
+            self.docFreqWriters = None
         self.wfs = None
         self.lemmata = None
 
+    @staticmethod
+    def replace_order(orders, pos, value):
+        """
+        Store the sort order of an indexed item at the position pos
+        of the orders array (-1 means that the item is not in the index).
+        Return the previous value.
+        """
+        if pos >= len(orders):
+            orders.extend([-1] * (pos + 1 - len(orders)))
+        prevValue = orders[pos]
+        orders[pos] = value
+        return prevValue
+
+    def collect_sort_keys(self):
+        """
+        Collect the word forms and lemmata of all words that occur
+        in the corpus from the word statistics. This is needed when
+        only a part of the corpus has been read from the source files.
+        """
+        self.wfs = [set() for i in range(len(self.languages))]
+        self.lemmata = [set() for i in range(len(self.languages))]
+        for langID in range(len(self.languages)):
+            for w, wID, lID, wordFreq, wordSFreq in self.wordStats.iterate_words(langID):
+                if wordFreq <= 0:
+                    continue
+                wJson = word_from_key(w)
+                if 'wf' in wJson:
+                    self.wfs[langID].add(wJson['wf'])
+                if 'ana' in wJson:
+                    self.lemmata[langID].add(self.get_lemma(wJson, lower_lemma=self.lowerWf))
+
     def generate_dictionary(self):
         """
         For each language, print out an HTML dictionary containing all lexemes of the corpus.
@@ -628,20 +955,17 @@ class Indexator:
             iWord = 0
             print('Generating dictionary for ' + self.languages[langID] + '...')
             lexFreqs = {}       # lemma ID -> its frequency
-            wFreqsSorted = [v for v in sorted(self.wordFreqs[langID].values(), reverse=True)]
-            freqToRank, quantiles = self.get_freq_ranks(wFreqsSorted)
-            # for wID in self.wordFreqs[langID]:
-            for w, wID in self.tmpWordIDs[langID].items():
-                wID = 'w' + str(wID)
+            for w, wID, lID, wordFreq, wordSFreq in self.wordStats.iterate_words(langID):
                 if iWord % 1000 == 0:
                     print('processing word', iWord, 'for the dictionary')
                 iWord += 1
-                wJson = json.loads(w)
+                if wordFreq <= 0:
+                    continue
+                wJson = word_from_key(w)
                 if 'ana' not in wJson or len(wJson['ana']) <= 0:
                     continue
                 lemma = self.get_lemma(wJson, lower_lemma=False)
                 grdic, translations = self.get_grdic(wJson, self.languages[langID])
-                wordFreq = self.wordFreqs[langID][wID]
                 lexTuple = (lemma, grdic, translations)
                 if lexTuple not in lexFreqs:
                     lexFreqs[lexTuple] = wordFreq
@@ -657,8 +981,8 @@ class Indexator:
             fOut.write('<h1 class="dictionary_header"> {{ _(\'Dictionary_header\') }} '
                        '({{ _(\'langname_' + self.languages[langID] + '\') }})</h1>\n')
             prevLetter = ''
-            sortingFunction = self.make_sorting_function(self.settings['languages'][langID])
-            for lemma, grdic, trans in sorted(lexFreqs, key=lambda x: (sortingFunction(x[0].lower()), -lexFreqs[x])):
+            sortKey = self.collation(self.languages[langID]).sort_key
+            for lemma, grdic, trans in sorted(lexFreqs, key=lambda x: (sortKey(x[0].lower()), -lexFreqs[x])):
                 if len(lemma) <= 0:
                     continue
                 mChar = self.character_regex(self.languages[langID]).search(lemma.lower())
@@ -689,9 +1013,13 @@ class Indexator:
         Index all words that have been collected at the previous stage
         in self.words (while the sentences were being indexed).
         """
-        bulk(self.es, self.iterate_words(), chunk_size=300, request_timeout=60)
+        self.report.begin_phase('words')
+        self.bulkLoader.load(self.iterate_words(), pipeline='words')
         if 'generate_dictionary' in self.settings and self.settings['generate_dictionary']:
+            self.report.begin_phase('dictionary')
             self.generate_dictionary()
+        for collation in self.collations.values():
+            collation.clear()
 
     def add_parallel_sids(self, sentences, paraIDs):
         """
@@ -711,24 +1039,85 @@ class Indexator:
                     if paraID in paraIDs[i]:
                         pa['sent_ids'] += paraIDs[i][paraID]
 
-    def iterate_sentences(self, fname):
+    def process_sentence(self, s):
+        """
+        Process the words of one sentence read from a source file:
+        clean them, collect word statistics and add sentence-level
+        metadata that depends on them. Return the language ID of the
+        sentence.
+        """
+        if 'lang' in s:
+            langID = s['lang']
+        else:
+            langID = 0
+            s['lang'] = langID
+        s['n_words'] = 0
+        if 'words' in s:
+            sentAnaMeta = self.process_sentence_words(s['words'], langID)
+            s['n_words'] = sum(1 for w in s['words'] if 'wtype' in w and w['wtype'] == 'word')
+            if 'meta' not in s:
+                s['meta'] = {}
+            s['meta']['sent_analyses'] = sentAnaMeta
+        if 'meta' in s:
+            for metaField in [mf for mf in s['meta'].keys() if not (mf.startswith('year') or mf.endswith('_kw'))]:
+                s['meta'][metaField + '_kw'] = s['meta'][metaField]
+        return langID
+
+    def collect_para_ids(self, alignment):
+        """
+        Take (language ID, list of para_ids) tuples for the sentences of
+        the current document, as returned by JSONDocReader.get_para_alignment().
+        Return the IDs the sentences will get, for each language and para_id.
+        """
+        paraIDs = [{} for i in range(len(self.languages))]
+        sID = self.sID
+        for langID, sentParaIDs in alignment:
+            for paraID in sentParaIDs:
+                paraID = str(self.dID) + '_' + str(paraID)
+                try:
+                    paraIDs[langID][paraID].append(self.randomize_id(sID))
+                except KeyError:
+                    paraIDs[langID][paraID] = [self.randomize_id(sID)]
+            sID += 1
+        return paraIDs
+
+    def iterate_sentences(self, fname, sentences=None):
+        """
+        Iterate over bulk indexing actions for the sentences of one
+        source file. If sentences is None, read them from the file.
+        Otherwise, sentences should contain (sentence, bLast) tuples
+        that have already passed process_sentence() in a worker process.
+        In a corpus with several languages, the sentences of a document
+        are kept in memory until all of them have been read, so that
+        the IDs of the aligned sentences can be added to them. If
+        two_pass_alignment is on, only the IDs are collected in a
+        first pass, and the sentences are streamed in the second one.
+        """
         self.numSents = 0
         prevLast = False
-        sentences = []
+        sentActions = []
         paraIDs = [{} for i in range(len(self.languages))]
-        for s, bLast in self.iterSent.get_sentences(fname):
-            if 'lang' in s:
+        twoPass = self.twoPassAlignment
+        if twoPass:
+            if sentences is None:
+                alignment = self.iterSent.get_para_alignment(fname)
+            else:
+                alignment = (self.iterSent.sentence_alignment(s) for s, bLast in sentences)
+            paraIDs = self.collect_para_ids(alignment)
+        if sentences is None:
+            sentences = self.iterSent.get_sentences(fname)
+            bProcessed = False
+        else:
+            bProcessed = True
+        tRead = time.perf_counter()
+        for s, bLast in sentences:
+            t = time.perf_counter()
+            self.report.add_time('reading', t - tRead)
+            if bProcessed:
                 langID = s['lang']
             else:
-                langID = 0
-                s['lang'] = langID
-            s['n_words'] = 0
-            if 'words' in s:
-                sentAnaMeta = self.process_sentence_words(s['words'], langID)
-                s['n_words'] = sum(1 for w in s['words'] if 'wtype' in w and w['wtype'] == 'word')
-                if 'meta' not in s:
-                    s['meta'] = {}
-                s['meta']['sent_analyses'] = sentAnaMeta
+                langID = self.process_sentence(s)
+                self.report.add_time('word_processing', time.perf_counter() - t)
             if prevLast:
                 prevLast = False
             elif self.numSents > 0:
@@ -738,39 +1127,119 @@ class Indexator:
             else:
                 prevLast = True
             s['doc_id'] = self.dID
-            if 'meta' in s:
-                for metaField in [mf for mf in s['meta'].keys() if not (mf.startswith('year') or mf.endswith('_kw'))]:
-                    s['meta'][metaField + '_kw'] = s['meta'][metaField]
             # self.es.index(index=self.name + '.sentences',
             #               id=self.sID,
             #               body=s)
-            curAction = {'_index': self.name + '.sentences',
+            curAction = {'_index': self.indexNames['sentences'],
                          '_id': self.randomize_id(self.sID),
                          '_source': s}
             if len(self.languages) <= 1:
                 yield curAction
             else:
-                sentences.append(curAction)
                 if 'para_alignment' in s:
                     s['para_ids'] = []
                     for pa in s['para_alignment']:
                         paraID = str(self.dID) + '_' + str(pa['para_id'])
                         pa['para_id'] = paraID
                         s['para_ids'].append(paraID)
+                        if twoPass:
+                            continue
                         try:
                             paraIDs[langID][paraID].append(self.randomize_id(self.sID))
                         except KeyError:
                             paraIDs[langID][paraID] = [self.randomize_id(self.sID)]
+                if twoPass:
+                    self.add_parallel_sids([curAction], paraIDs)
+                    yield curAction
+                else:
+                    sentActions.append(curAction)
             if self.sID % 500 == 0:
                 print('Indexing sentence', self.sID, ',', self.totalNumWords, 'words so far.')
             self.numSents += 1
             self.numSentsLang[langID] += 1
             self.sID += 1
-        if len(self.languages) > 1:
-            self.add_parallel_sids(sentences, paraIDs)
-            for s in sentences:
+            self.report.count('sentences')
+            self.report.count('words', s['n_words'])
+            tRead = time.perf_counter()
+        if len(self.languages) > 1 and not twoPass:
+            self.add_parallel_sids(sentActions, paraIDs)
+            for s in sentActions:
                 yield s
 
+    def prepare_file(self, fname):
+        """
+        Read and process one source file (this is done in a worker
+        process). Return a dictionary with the document metadata,
+        processed sentences and word statistics for this file.
+        Word and lemma IDs in the sentences and the statistics
+        are local to the file; they are replaced with global IDs
+        by merge_file_stats() in the main process.
+        """
+        self.init_word_stats(inMemory=True)
+        self.dID = 0
+        if self.iterSent.format in ('json', 'json-gzip'):
+            # Decompress and parse the file only once
+            try:
+                self.iterSent.set_prepared_doc(fname, doc=self.iterSent.parse_doc(self.iterSent.read_text(fname)))
+            except MemoryError:
+                pass
+        sentences = []
+        for s, bLast in self.iterSent.get_sentences(fname):
+            self.process_sentence(s)
+            sentences.append((s, bLast))
+        fileData = {
+            'fname': fname,
+            'meta': self.iterSent.get_metadata(fname),
+            'sentences': sentences
+        }
+        for k in ['wordStats', 'wfs', 'lemmata',
+                  'numWords', 'numWordsLang', 'totalNumWords']:
+            fileData[k] = getattr(self, k)
+        return fileData
+
+    def merge_file_stats(self, fileData):
+        """
+        Add word and lemma statistics collected by a worker process
+        for one file (see prepare_file()) to the global statistics.
+        Replace local word and lemma IDs in the sentences of the file
+        with the global ones.
+        """
+        wIDMap, lIDMap = self.wordStats.merge(fileData['wordStats'], self.dID)
+        itemIDMap = {}
+        itemIDMap.update(('w' + str(localID), 'w' + str(wID)) for localID, wID in wIDMap.items())
+        itemIDMap.update(('l' + str(localID), 'l' + str(lID)) for localID, lID in lIDMap.items())
+        for langID in range(len(self.languages)):
+            self.numWordsLang[langID] += fileData['numWordsLang'][langID]
+        if self.wfs is not None:
+            for langID in range(len(self.languages)):
+                self.wfs[langID] |= fileData['wfs'][langID]
+                self.lemmata[langID] |= fileData['lemmata'][langID]
+        self.numWords += fileData['numWords']
+        self.totalNumWords += fileData['totalNumWords']
+        for s, bLast in fileData['sentences']:
+            if 'words' not in s:
+                continue
+            for w in s['words']:
+                if 'w_id' in w:
+                    w['w_id'] = itemIDMap[w['w_id']]
+                    w['l_id'] = itemIDMap[w['l_id']]
+
+    def iterate_prepared_files(self, filenames):
+        """
+        Read and process source files in a pool of worker processes.
+        Yield the results of prepare_file() in the order of filenames.
+        Only a limited number of files is processed in advance, so that
+        the memory consumption does not depend on the corpus size.
+        """
+        with multiprocessing.Pool(self.nProcesses, initializer=init_indexing_worker) as pool:
+            pending = collections.deque()
+            iFile = 0
+            while iFile < len(filenames) or len(pending) > 0:
+                while iFile < len(filenames) and len(pending) < 2 * self.nProcesses:
+                    pending.append(pool.apply_async(prepare_file_in_worker, (filenames[iFile],)))
+                    iFile += 1
+                yield pending.popleft().get()
+
     @staticmethod
     def add_meta_keywords(meta):
         """
@@ -780,13 +1249,15 @@ class Indexator:
         for field in [k for k in meta.keys() if not k.startswith('year')]:
             meta[field + '_kw'] = meta[field]
 
-    def index_doc(self, fname):
+    def index_doc(self, fname, meta=None):
         """
-        Store the metadata of the source file.
+        Store the metadata of the source file. If meta is None,
+        read it from the file.
         """
         if self.dID % 100 == 0:
             print('Indexing document', self.dID)
-        meta = self.iterSent.get_metadata(fname)
+        if meta is None:
+            meta = self.iterSent.get_metadata(fname)
         self.add_meta_keywords(meta)
         meta['n_words'] = self.numWords
         meta['n_sents'] = self.numSents
@@ -798,8 +1269,24 @@ class Indexator:
         self.numSents = 0
         self.numWordsLang = [0] * len(self.languages)
         self.numSentsLang = [0] * len(self.languages)
+        fulltextEnabled = ('fulltext_view_enabled' in self.settings
+                           and self.settings['fulltext_view_enabled']
+                           and 'fulltext_id' in meta)
+        fileHash = None
+        if self.keepState or fulltextEnabled:
+            fileHash = self.file_hash(fname)
+        if self.keepState:
+            fulltextID = None
+            if 'fulltext_id' in meta:
+                fulltextID = meta['fulltext_id']
+            self.indexedFiles[os.path.relpath(fname, self.corpus_dir)] = {
+                'hash': fileHash,
+                'd_id': self.dID,
+                'fulltext_id': fulltextID
+            }
+        t = time.perf_counter()
         try:
-            self.es.index(index=self.name + '.docs',
+            self.es.index(index=self.indexNames['docs'],
                           id=self.dID,
                           body=meta)
         except RequestError as err:
@@ -810,17 +1297,19 @@ class Indexator:
             if 'title' in meta:
                 shortMeta['title'] = meta['title']
                 shortMeta['title_kw'] = meta['title']
-                self.es.index(index=self.name + '.docs',
+                self.es.index(index=self.indexNames['docs'],
                               id=self.dID,
                               body=shortMeta)
-        if ('fulltext_view_enabled' in self.settings
-                and self.settings['fulltext_view_enabled']
-                and 'fulltext_id' in meta):
-            fnameOut = meta['fulltext_id'] + '.json'
-            self.j2h.process_file(fname,
-                                  os.path.join('../search/corpus_html',
-                                               self.name,
-                                               fnameOut))
+        self.report.add_time('document_metadata', time.perf_counter() - t)
+        if fulltextEnabled:
+            fnameOut = meta['fulltext_id'] + FulltextStore.EXTENSION
+            with self.report.timer('fulltext_html'):
+                self.fulltext.generate(fname,
+                                       os.path.join('../search/corpus_html',
+                                                    self.name,
+                                                    fnameOut),
+                                       fileHash)
+        self.report.count('documents')
         self.dID += 1
 
     def analyze_dir(self):
@@ -832,10 +1321,8 @@ class Indexator:
         self.corpusSizeInBytes = 0
         for root, dirs, files in os.walk(self.corpus_dir):
             for fname in files:
-                if (not ((self.settings['input_format'] == 'json'
-                          and fname.lower().endswith('.json'))
-                         or (self.settings['input_format'] == 'json-gzip'
-                             and fname.lower().endswith('.json.gz')))):
+                if (self.input_format not in JSONDocReader.extensions
+                        or not fname.lower().endswith(JSONDocReader.extensions[self.input_format])):
                     continue
                 fnameFull = os.path.join(root, fname)
                 fileSize = os.path.getsize(fnameFull)
@@ -851,20 +1338,334 @@ class Indexator:
         the whole file is into memory, and there is more free memory
         in the beginning of the process. If MemoryError occurs, the
         iterative JSON parser is used, which works much slower.
+        If indexing_processes in the settings is greater than 1, the
+        files are read and processed in a pool of worker processes,
+        while the main process assigns the IDs and loads the data
+        into Elasticsearch.
         """
         if len(self.filenames) <= 0:
             print('There are no files in this corpus.')
             return
+        filenames = []
         for fname, fsize in sorted(self.filenames, key=lambda p: -p[1]):
             # print(fname, fsize)
             if 'sample_size' in self.settings and 0 < self.settings['sample_size'] < 1:
                 # Only take a random sample of the source files (for test purposes)
                 if random.random() > self.settings['sample_size']:
                     continue
-            bulk(self.es, self.iterate_sentences(fname), chunk_size=200, request_timeout=60)
-            self.index_doc(fname)
+            filenames.append(fname)
+        self.sourceFiles = filenames
+        self.index_files(filenames)
         self.index_words()
 
+    def checkpoints_enabled(self):
+        """
+        Check if checkpoints should be saved during indexation.
+        Only full indexation can be resumed from a checkpoint.
+        """
+        return self.checkpointInterval > 0 and not self.incremental
+
+    def index_files(self, filenames):
+        """
+        Index the sentences and the metadata of the source files
+        and collect their word statistics. If checkpoints are enabled,
+        loading stops after every checkpoint_interval files until
+        Elasticsearch has accepted all sentences sent so far, and
+        a checkpoint is saved.
+        """
+        self.report.begin_phase('documents')
+        actions = self.iterate_files(filenames)
+        while True:
+            nFilesDone = self.nFilesDone
+            # iterate_files() yields None after each checkpoint_interval files
+            self.bulkLoader.load(itertools.takewhile(lambda action: action is not None, actions),
+                                 pipeline='sentences')
+            if self.nFilesDone <= nFilesDone:
+                break
+            if self.checkpoints_enabled():
+                with self.report.timer('checkpoints'):
+                    self.fulltext.finish()
+                    self.save_checkpoint()
+        if 'fulltext_view_enabled' in self.settings and self.settings['fulltext_view_enabled']:
+            self.report.begin_phase('fulltext')
+            self.fulltext.finish()
+
+    def iterate_files(self, filenames):
+        """
+        Iterate over bulk indexing actions for the sentences
+        of all source files. The metadata of each file is indexed
+        after all its sentences have been generated.
+        """
+        if self.nProcesses <= 1:
+            # The next files are read while the current one is being indexed
+            files = self.prefetcher.iterate(filenames)
+            while True:
+                with self.report.timer('reading'):
+                    fname, text, doc = next(files, (None, None, None))
+                if fname is None:
+                    break
+                self.report.count('bytes', os.path.getsize(fname))
+                if doc is not None:
+                    self.iterSent.set_prepared_doc(fname, doc=doc)
+                    if text is not None:
+                        self.j2h.iterSent.set_prepared_doc(fname, text=text)
+                for action in self.iterate_sentences(fname):
+                    yield action
+                self.index_doc(fname)
+                self.nFilesDone += 1
+                if self.checkpoints_enabled() and self.nFilesDone % self.checkpointInterval == 0:
+                    yield None
+        else:
+            files = self.iterate_prepared_files(filenames)
+            while True:
+                with self.report.timer('reading'):
+                    fileData = next(files, None)
+                if fileData is None:
+                    break
+                self.report.count('bytes', os.path.getsize(fileData['fname']))
+                with self.report.timer('word_stats_merge'):
+                    self.merge_file_stats(fileData)
+                self.iterSent.add_nonpersistent_fulltext_id(fileData['meta'])
+                for action in self.iterate_sentences(fileData['fname'], sentences=fileData['sentences']):
+                    yield action
+                self.index_doc(fileData['fname'], meta=fileData['meta'])
+                self.nFilesDone += 1
+                if self.checkpoints_enabled() and self.nFilesDone % self.checkpointInterval == 0:
+                    yield None
+
+    @staticmethod
+    def file_hash(fname):
+        """
+        Return a hash of the contents of a file.
+        """
+        h = hashlib.sha1()
+        with open(fname, 'rb') as fIn:
+            for chunk in iter(lambda: fIn.read(1 << 20), b''):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def remove_docs(self, fnames):
+        """
+        Remove the documents that were indexed from the source files
+        fnames (relative to the corpus directory) from the indexes,
+        together with their sentences, word_freq documents and
+        full-text views, and subtract their word statistics.
+        """
+        dIDs = set(self.indexedFiles[fname]['d_id'] for fname in fnames)
+        if len(dIDs) <= 0:
+            return
+        print('Removing', len(dIDs), 'documents...')
+        dIDsSorted = sorted(dIDs)
+        for i in range(0, len(dIDsSorted), 10000):
+            self.es.delete_by_query(index=self.indexNames['sentences'],
+                                    body={'query': {'terms': {'doc_id': dIDsSorted[i:i+10000]}}},
+                                    conflicts='proceed', request_timeout=600)
+        actions = [{'_op_type': 'delete',
+                    '_index': self.indexNames['docs'],
+                    '_id': dID}
+                   for dID in dIDsSorted]
+        for itemType, itemID, childID in self.wordStats.remove_docs(dIDs):
+            actions.append({'_op_type': 'delete',
+                            '_index': self.indexNames['words'],
+                            '_id': itemType + 'freq' + str(childID),
+                            '_routing': itemType + str(itemID)})
+        self.bulkLoader.load(actions, pipeline='deletions', ignoreStatus=(404,))
+        for fname in fnames:
+            fulltextID = self.indexedFiles[fname]['fulltext_id']
+            if fulltextID is not None:
+                # Views generated by older versions are stored in JSON
+                for ext in [FulltextStore.EXTENSION, '.json']:
+                    fnameHtml = os.path.join('../search/corpus_html', self.name, fulltextID + ext)
+                    if os.path.exists(fnameHtml):
+                        os.remove(fnameHtml)
+                    self.fulltext.remove(fnameHtml)
+            del self.indexedFiles[fname]
+
+    def save_state(self):
+        """
+        Save the word statistics, ID counters and the list of indexed
+        files to self.stateDir, so that the corpus can be updated
+        later without full reindexation.
+        """
+        print('Saving indexation state...')
+        if not os.path.exists(self.stateDir):
+            os.makedirs(self.stateDir)
+        state = {
+            'languages': self.languages,
+            'word_stats_storage': self.word_stats_storage(),
+            'sID': self.sID,
+            'dID': self.dID,
+            'wordFreqID': self.wordFreqID,
+            'lemmaFreqID': self.lemmaFreqID,
+            'nonpersistentID': self.iterSent.nonpersistentID,
+            'shuffled_ids': array.array('l', self.shuffled_ids),
+            'word_orders': self.wordOrders,
+            'lemma_orders': self.lemmaOrders,
+            'files': self.indexedFiles
+        }
+        # Write to temporary files first, so that a failure does not
+        # leave the state inconsistent
+        fnameStats = os.path.join(self.stateDir, 'word_stats')
+        fnameState = os.path.join(self.stateDir, 'index_state.pickle')
+        self.wordStats.save(fnameStats + '.tmp')
+        with open(fnameState + '.tmp', 'wb') as fOut:
+            pickle.dump(state, fOut, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(fnameStats + '.tmp', fnameStats)
+        os.replace(fnameState + '.tmp', fnameState)
+
+    def load_state(self):
+        """
+        Load the state saved after the last indexation. Return True
+        if it can be used for incremental indexation, False otherwise.
+        """
+        fnameState = os.path.join(self.stateDir, 'index_state.pickle')
+        if not os.path.exists(fnameState):
+            print('There is no saved indexation state in ' + self.stateDir + '. '
+                  'Index the entire corpus with keep_index_state set to true first.')
+            return False
+        for indexName in ['.docs', '.words', '.sentences']:
+            if not self.es_ic.exists(index=self.name + indexName):
+                print('Index ' + self.name + indexName + ' does not exist. '
+                      'Index the entire corpus first.')
+                return False
+        with open(fnameState, 'rb') as fIn:
+            state = pickle.load(fIn)
+        if (state['languages'] != self.languages
+                or state['word_stats_storage'] != self.word_stats_storage()):
+            print('The list of languages or the word statistics storage has changed '
+                  'since the last indexation. Index the entire corpus first.')
+            return False
+        self.sID = state['sID']
+        self.dID = state['dID']
+        self.wordFreqID = state['wordFreqID']
+        self.lemmaFreqID = state['lemmaFreqID']
+        self.iterSent.nonpersistentID = state['nonpersistentID']
+        self.shuffled_ids = state['shuffled_ids'].tolist()
+        self.wordOrders = state['word_orders']
+        self.lemmaOrders = state['lemma_orders']
+        self.indexedFiles = state['files']
+        self.load_word_stats(os.path.join(self.stateDir, 'word_stats'))
+        return True
+
+    def load_word_stats(self, fnameStats):
+        """
+        Replace the current word statistics with those saved
+        to fnameStats.
+        """
+        self.wordStats.close()
+        if self.word_stats_storage() == 'sqlite':
+            self.wordStats = SQLiteWordStats.load(fnameStats, len(self.languages),
+                                                  **self.sqlite_word_stats_options())
+        else:
+            self.wordStats = WordStats.load(fnameStats, len(self.languages))
+
+    def save_checkpoint(self):
+        """
+        Save everything needed to resume the current full indexation
+        after the files indexed so far: the ID counters, the word
+        statistics, the names of the indexes being loaded and the
+        list of source files. Must only be called when all sentences
+        of these files have been accepted by Elasticsearch.
+        """
+        print('Saving a checkpoint after', self.nFilesDone, 'files...')
+        if not os.path.exists(self.stateDir):
+            os.makedirs(self.stateDir)
+        # Each checkpoint has its own statistics file, which only becomes
+        # valid when the checkpoint file referring to it has been replaced
+        fnameState = os.path.join(self.stateDir, 'checkpoint.pickle')
+        fnameStats = 'checkpoint_word_stats_' + str(self.nFilesDone)
+        prevFnameStats = None
+        if os.path.exists(fnameState):
+            with open(fnameState, 'rb') as fIn:
+                prevFnameStats = pickle.load(fIn)['word_stats_file']
+        state = {
+            'settings': self.settings,
+            'index_names': self.indexNames,
+            'serving_settings': self.servingSettings,
+            'source_files': self.sourceFiles,
+            'n_files_done': self.nFilesDone,
+            'sID': self.sID,
+            'dID': self.dID,
+            'totalNumWords': self.totalNumWords,
+            'nonpersistentID': self.iterSent.nonpersistentID,
+            'shuffled_ids': array.array('l', self.shuffled_ids),
+            'wfs': self.wfs,
+            'lemmata': self.lemmata,
+            'files': self.indexedFiles,
+            'word_stats_file': fnameStats
+        }
+        self.wordStats.save(os.path.join(self.stateDir, fnameStats))
+        with open(fnameState + '.tmp', 'wb') as fOut:
+            pickle.dump(state, fOut, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(fnameState + '.tmp', fnameState)
+        if prevFnameStats is not None and prevFnameStats != fnameStats:
+            fnamePrevStats = os.path.join(self.stateDir, prevFnameStats)
+            if os.path.exists(fnamePrevStats):
+                os.remove(fnamePrevStats)
+
+    def load_checkpoint(self):
+        """
+        Load the last checkpoint of an interrupted full indexation.
+        Return True if the indexation can be resumed from it,
+        False otherwise.
+        """
+        fnameState = os.path.join(self.stateDir, 'checkpoint.pickle')
+        if not os.path.exists(fnameState):
+            print('There is no checkpoint in ' + self.stateDir + '. '
+                  'Only indexations with checkpoint_interval set can be resumed.')
+            return False
+        with open(fnameState, 'rb') as fIn:
+            state = pickle.load(fIn)
+        if state['settings'] != self.settings:
+            print('The corpus settings have changed since the indexation '
+                  'was interrupted. Index the entire corpus again.')
+            return False
+        for indexType, indexName in state['index_names'].items():
+            if not self.es_ic.exists(index=indexName):
+                print('Index ' + indexName + ' does not exist. Index the entire corpus again.')
+                return False
+        self.indexNames = state['index_names']
+        self.servingSettings = state['serving_settings']
+        self.sourceFiles = state['source_files']
+        self.nFilesDone = state['n_files_done']
+        self.sID = state['sID']
+        self.dID = state['dID']
+        self.totalNumWords = state['totalNumWords']
+        self.iterSent.nonpersistentID = state['nonpersistentID']
+        self.shuffled_ids = state['shuffled_ids'].tolist()
+        self.wfs = state['wfs']
+        self.lemmata = state['lemmata']
+        self.indexedFiles = state['files']
+        self.load_word_stats(os.path.join(self.stateDir, state['word_stats_file']))
+        return True
+
+    def remove_checkpoint(self):
+        """
+        Delete the checkpoint files, if any.
+        """
+        if not os.path.exists(self.stateDir):
+            return
+        for fname in os.listdir(self.stateDir):
+            if fname.startswith('checkpoint'):
+                os.remove(os.path.join(self.stateDir, fname))
+
+    def remove_unfinished_docs(self):
+        """
+        Remove the sentences and the documents that were sent to
+        Elasticsearch after the last checkpoint of an interrupted
+        indexation. They will be indexed again with the same IDs.
+        """
+        self.es_ic.refresh(index=self.indexNames['sentences'])
+        self.es.delete_by_query(index=self.indexNames['sentences'],
+                                body={'query': {'range': {'doc_id': {'gte': self.dID}}}},
+                                conflicts='proceed', request_timeout=600)
+        # Each remaining file yields at most one document
+        actions = [{'_op_type': 'delete',
+                    '_index': self.indexNames['docs'],
+                    '_id': dID}
+                   for dID in range(self.dID, self.dID + len(self.sourceFiles) - self.nFilesDone)]
+        self.bulkLoader.load(actions, pipeline='deletions', ignoreStatus=(404,))
+
     def compile_translations(self):
         """
         Compile flask_babel translations in ../search/web_app.
@@ -885,6 +1686,38 @@ class Indexator:
         else:
             print('Interface translations compiled.')
 
+    def save_corpus_stats(self):
+        """
+        Save a snapshot of the corpus-wide statistics (corpus size,
+        frequency ranks, metafield buckets) that the corpus app
+        loads at startup instead of querying Elasticsearch.
+        """
+        print('Saving corpus statistics...')
+        try:
+            self.es_ic.refresh(index=','.join(self.name + '.' + indexType for indexType in self.indexTypes))
+            sc = SearchClient(self.SETTINGS_DIR, self.j2h.settings)
+            corpusStats = CorpusStats(sc, self.j2h.sentView, self.j2h.settings)
+            corpusStats.collect()
+            corpusStats.save(os.path.join('../search/corpus_stats', self.name + '.json'))
+        except Exception as err:
+            # The corpus app can calculate the statistics itself
+            print('Could not save corpus statistics:', err)
+
+    def report_summary(self, mode):
+        """
+        Return general information about the indexation
+        for the indexing report.
+        """
+        return {
+            'corpus_name': self.name,
+            'mode': mode,
+            'indexing_processes': self.nProcesses,
+            'word_stats_storage': self.word_stats_storage(),
+            'total_documents': self.dID,
+            'total_sentences': self.sID,
+            'word_types': self.wordStats.n_items()
+        }
+
     def load_corpus(self):
         """
         Drop the current database, if any, and load the entire corpus.
@@ -892,25 +1725,160 @@ class Indexator:
         t1 = time.time()
         # self.compile_translations()
         indicesDeleted = self.delete_indices()
+        self.report.start()
         if not indicesDeleted:
+            self.wordStats.close()
             return
+        # The state of the previous indexation, if any, is no longer valid
+        fnameState = os.path.join(self.stateDir, 'index_state.pickle')
+        if os.path.exists(fnameState):
+            os.remove(fnameState)
+        self.remove_checkpoint()
         self.analyze_dir()
         self.create_indices()
         self.index_dir()
+        self.finish_full_indexation(t1, 'full')
+
+    def resume_corpus(self):
+        """
+        Resume a full indexation that was interrupted, starting
+        from its last checkpoint. Only the source files that had not
+        been indexed by the time of the checkpoint are read.
+        """
+        t1 = time.time()
+        if not self.load_checkpoint():
+            self.wordStats.close()
+            return
+        self.report.start()
+        print('Resuming the indexation after', self.nFilesDone, 'of',
+              len(self.sourceFiles), 'files.')
+        self.report.begin_phase('removal')
+        self.remove_unfinished_docs()
+        self.index_files(self.sourceFiles[self.nFilesDone:])
+        self.index_words()
+        self.finish_full_indexation(t1, 'resumed')
+
+    def finish_full_indexation(self, t1, mode):
+        """
+        Make the indexes loaded by a full indexation available
+        for search, save the state if needed and write the report.
+        t1 is the time when the indexation started.
+        """
+        self.switch_aliases()
+        if self.keepState:
+            self.report.begin_phase('state')
+            self.save_state()
+        self.remove_checkpoint()
+        self.report.begin_phase('statistics')
+        self.save_corpus_stats()
         t2 = time.time()
         print('Corpus indexed in', t2-t1, 'seconds:',
               self.dID, 'documents,',
               self.sID, 'sentences,',
               self.totalNumWords, 'words,',
-              sum(len(self.wordFreqs[i]) for i in range(len(self.languages))), 'word types (different words).')
+              self.wordStats.n_items(), 'word types (different words).')
+        self.bulkLoader.report()
+        self.report.finish(self.bulkLoader.stats, extra=self.report_summary(mode))
+        self.bulkLoader.close()
+        self.wordStats.close()
+
+    def update_corpus(self):
+        """
+        Update the indexes after some source files have been added,
+        changed or deleted since the last indexation, using the state
+        saved by that indexation. Only new and changed files are read.
+        Documents that correspond to changed or deleted files are
+        removed from the indexes, and the word statistics are updated.
+        """
+        t1 = time.time()
+        if not self.load_state():
+            self.wordStats.close()
+            return
+        self.report.start()
+        self.analyze_dir()
+        newFiles = []       # new and changed files (full paths)
+        removedFiles = []   # changed and deleted files (relative to corpus_dir)
+        curFiles = set()
+        for fname, fsize in sorted(self.filenames, key=lambda p: -p[1]):
+            relName = os.path.relpath(fname, self.corpus_dir)
+            curFiles.add(relName)
+            if relName not in self.indexedFiles:
+                newFiles.append(fname)
+            elif self.indexedFiles[relName]['hash'] != self.file_hash(fname):
+                newFiles.append(fname)
+                removedFiles.append(relName)
+        nChanged = len(removedFiles)
+        removedFiles += [relName for relName in self.indexedFiles if relName not in curFiles]
+        if len(newFiles) <= 0 and len(removedFiles) <= 0:
+            print('No source files have changed since the last indexation.')
+            self.wordStats.close()
+            return
+        self.report.begin_phase('removal')
+        self.remove_docs(removedFiles)
+        sID = self.sID
+        self.index_files(newFiles)
+        self.index_words()
+        self.switch_doc_freqs()
+        self.increase_write_counter()
+        self.report.begin_phase('state')
+        self.save_state()
+        self.report.begin_phase('statistics')
+        self.save_corpus_stats()
+        t2 = time.time()
+        print('Corpus updated in', t2-t1, 'seconds:',
+              len(newFiles) - nChanged, 'documents added,',
+              nChanged, 'documents changed,',
+              len(removedFiles) - nChanged, 'documents deleted,',
+              self.sID - sID, 'sentences and',
+              self.totalNumWords, 'words indexed,',
+              self.wordStats.n_items(), 'word types (different words) in the corpus.')
+        self.bulkLoader.report()
+        self.report.finish(self.bulkLoader.stats, extra=self.report_summary('incremental'))
+        self.bulkLoader.close()
+        self.wordStats.close()
+
+
+workerIndexator = None     # Indexator instance used in a worker process
+
+
+def init_indexing_worker():
+    """
+    Create an Indexator instance in a newly started worker process.
+    Non-persistent fulltext IDs are generated in the main process,
+    so that they remain unique.
+    """
+    global workerIndexator
+    workerIndexator = Indexator(overwrite=True)
+    # Each file gets its own in-memory statistics (see prepare_file())
+    workerIndexator.wordStats.close()
+    workerIndexator.iterSent.settings = {k: v for k, v in workerIndexator.settings.items()
+                                         if k != 'use_nonpersistent_fulltext_id'}
+
+
+def prepare_file_in_worker(fname):
+    """
+    Read and process one source file in a worker process.
+    """
+    return workerIndexator.prepare_file(fname)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Index corpus in Elasticsearch 7.x.')
     parser.add_argument('-y', help='overwrite existing database without asking first')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only index source files added or changed since the last indexation '
+                             'and remove deleted ones (requires keep_index_state)')
+    parser.add_argument('--resume', action='store_true',
+                        help='resume an interrupted indexation from its last checkpoint '
+                             '(requires checkpoint_interval)')
     args = parser.parse_args()
     overwrite = False
     if args.y is not None:
         overwrite = True
-    x = Indexator(overwrite)
-    x.load_corpus()
+    x = Indexator(overwrite, incremental=args.incremental)
+    if args.incremental:
+        x.update_corpus()
+    elif args.resume:
+        x.resume_corpus()
+    else:
+        x.load_corpus()
@@ -0,0 +1,222 @@
+import json
+import os
+import sys
+import time
+import collections
+from contextlib import contextmanager
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+import tracemalloc
+
+
+class IndexingReport:
+    """
+    Collects statistics about one indexation run: time spent in each
+    stage (reading source files, processing words, bulk requests,
+    full-text views, ranks etc.), counters (documents, sentences,
+    words, bytes), bulk request latencies, and, for each phase of
+    the indexation, peak RSS and (optionally) the lines of code
+    that allocated most memory according to tracemalloc.
+    At the end of the run, the report is written to a JSON file.
+    If indexing_report_interval is set, a short progress line
+    is printed every indexing_report_interval seconds.
+    Stages may overlap (e.g. bulk requests are sent in background
+    threads), so their times do not have to sum up to the total time.
+    """
+
+    def __init__(self, settings=None, fname=''):
+        if settings is None:
+            settings = {}
+        self.fname = fname
+        self.interval = 0    # seconds between progress reports, 0 = never
+        if 'indexing_report_interval' in settings:
+            self.interval = settings['indexing_report_interval']
+        self.useTracemalloc = ('indexing_tracemalloc' in settings
+                               and settings['indexing_tracemalloc'])
+        self.nTopAllocations = 10
+        self.stages = collections.OrderedDict()     # stage -> {'time': seconds, 'calls': number}
+        self.counters = collections.OrderedDict()   # counter -> value
+        self.phases = []
+        self.curPhase = None
+        self.tStart = time.time()
+        self.tLastReport = self.tStart
+
+    def start(self):
+        self.tStart = time.time()
+        self.tLastReport = self.tStart
+        if self.useTracemalloc and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def add_time(self, stage, seconds, calls=1):
+        if stage not in self.stages:
+            self.stages[stage] = {'time': 0.0, 'calls': 0}
+        self.stages[stage]['time'] += seconds
+        self.stages[stage]['calls'] += calls
+
+    @contextmanager
+    def timer(self, stage):
+        """
+        Measure the time spent in a with block.
+        """
+        t1 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - t1)
+
+    def count(self, counter, value=1):
+        """
+        Increase a counter. Print the progress line if it is time.
+        """
+        try:
+            self.counters[counter] += value
+        except KeyError:
+            self.counters[counter] = value
+        if self.interval > 0 and time.time() - self.tLastReport >= self.interval:
+            self.print_progress()
+
+    @staticmethod
+    def peak_rss():
+        """
+        Return peak resident set size of this process and
+        of its terminated child processes, in megabytes.
+        """
+        if resource is None:
+            return None, None
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        unit = 1024
+        if sys.platform == 'darwin':
+            unit = 1024 * 1024
+        return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit,
+                resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / unit)
+
+    @staticmethod
+    def take_snapshot():
+        """
+        Take a tracemalloc snapshot without the memory
+        allocated by tracemalloc itself.
+        """
+        return tracemalloc.take_snapshot().filter_traces(
+            (tracemalloc.Filter(False, tracemalloc.__file__),))
+
+    def begin_phase(self, name):
+        """
+        Start a phase of the indexation (e.g. documents or words).
+        """
+        if self.curPhase is not None:
+            self.end_phase()
+        self.curPhase = {
+            'name': name,
+            'start': time.time()
+        }
+        if self.useTracemalloc:
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            self.curPhase['snapshot'] = self.take_snapshot()
+
+    def end_phase(self):
+        """
+        Finish the current phase and record its duration,
+        memory consumption and top allocations.
+        """
+        if self.curPhase is None:
+            return
+        phase = {
+            'name': self.curPhase['name'],
+            'time': time.time() - self.curPhase['start']
+        }
+        phase['peak_rss_mb'], phase['peak_rss_children_mb'] = self.peak_rss()
+        if self.useTracemalloc:
+            phase['traced_peak_mb'] = tracemalloc.get_traced_memory()[1] / 1048576
+            snapshot = self.take_snapshot()
+            stats = snapshot.compare_to(self.curPhase['snapshot'], 'lineno')
+            phase['top_allocations'] = [
+                {
+                    'location': str(stat.traceback),
+                    'size_diff_kb': stat.size_diff / 1024,
+                    'size_kb': stat.size / 1024,
+                    'count_diff': stat.count_diff
+                }
+                for stat in stats[:self.nTopAllocations]
+            ]
+        self.phases.append(phase)
+        self.curPhase = None
+
+    def rates(self, seconds):
+        """
+        Return the throughput (items per second) for each counter.
+        """
+        seconds = max(seconds, 1e-6)
+        return collections.OrderedDict((counter + '_per_s', value / seconds)
+                                       for counter, value in self.counters.items())
+
+    def print_progress(self):
+        self.tLastReport = time.time()
+        elapsed = self.tLastReport - self.tStart
+        progress = collections.OrderedDict([('elapsed_s', round(elapsed, 1))])
+        progress.update(self.counters)
+        progress.update((k, round(v, 1)) for k, v in self.rates(elapsed).items())
+        progress['peak_rss_mb'] = self.peak_rss()[0]
+        print('Progress:', json.dumps(progress))
+
+    @staticmethod
+    def percentile(values, p):
+        """
+        Return the p-th percentile of a sorted list (nearest rank).
+        """
+        if len(values) <= 0:
+            return None
+        return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+    def bulk_report(self, bulkStats):
+        """
+        Summarize the statistics collected by BulkLoader.
+        """
+        report = collections.OrderedDict()
+        for pipeline, stats in bulkStats.items():
+            latencies = sorted(stats['latencies'])
+            report[pipeline] = collections.OrderedDict([
+                ('actions', stats['actions']),
+                ('bytes', stats['bytes']),
+                ('requests', stats['requests']),
+                ('retries', stats['retries']),
+                ('time_s', stats['time']),
+                ('latency_p50_s', self.percentile(latencies, 50)),
+                ('latency_p90_s', self.percentile(latencies, 90)),
+                ('latency_p99_s', self.percentile(latencies, 99)),
+                ('latency_max_s', latencies[-1] if len(latencies) > 0 else None)
+            ])
+        return report
+
+    def finish(self, bulkStats=None, extra=None):
+        """
+        Finish the report and write it to the JSON file.
+        Return the report as a dictionary.
+        """
+        self.end_phase()
+        elapsed = time.time() - self.tStart
+        report = collections.OrderedDict([
+            ('elapsed_s', elapsed),
+            ('counters', self.counters),
+            ('throughput', self.rates(elapsed)),
+            ('stages', self.stages),
+            ('phases', self.phases)
+        ])
+        if bulkStats is not None:
+            report['bulk'] = self.bulk_report(bulkStats)
+        report['peak_rss_mb'], report['peak_rss_children_mb'] = self.peak_rss()
+        if extra is not None:
+            report.update(extra)
+        if self.useTracemalloc and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        if len(self.fname) > 0:
+            dirname = os.path.dirname(self.fname)
+            if len(dirname) > 0 and not os.path.exists(dirname):
+                os.makedirs(dirname)
+            with open(self.fname, 'w', encoding='utf-8') as fOut:
+                json.dump(report, fOut, ensure_ascii=False, indent=2)
+            print('Indexing report written to', self.fname)
+        return report
@@ -7,6 +7,7 @@ from json_doc_reader import JSONDocReader
 
 sys.path.insert(0, '../search/web_app')
 from corpus_settings import CorpusSettings
+from fulltext_store import FulltextStore
 from response_processors import SentenceViewer
 
 
@@ -23,7 +24,7 @@ class JSON2HTML:
                                os.path.join(self.SETTINGS_DIR, 'categories.json'))
         self.sentView = SentenceViewer(self.settings, None, fullText=True)
         self.iterSent = None
-        if self.settings.input_format in ['json', 'json-gzip']:
+        if self.settings.input_format in JSONDocReader.extensions:
             self.iterSent = JSONDocReader(format=self.settings.input_format,
                                           settings=settings)
         self.lastSentNum = 0  # for the IDs in the HTML
@@ -61,11 +62,16 @@ class JSON2HTML:
             paragraph += sent
         return paragraph
 
-    def process_file(self, fnameIn, fnameOut):
+    def process_file(self, fnameIn, fnameOut, numSentStart=None):
         """
         Read one JSON file (fnameIn). Generate an HTML representation for it
-        and store it in fnameOut.
+        and store it in fnameOut: in the paged format read by the corpus app
+        (see FulltextStore) or, if fnameOut ends with .json, in JSON. If numSentStart is given, the numbering
+        of the sentences in the HTML starts after it, so that the files
+        can be processed independently.
         """
+        if numSentStart is not None:
+            self.lastSentNum = numSentStart
         htmlByTier = [[]]
         nTier = 0
         paraIDsByTier = [set()]
@@ -144,8 +150,11 @@ class JSON2HTML:
 
         if not os.path.exists(os.path.dirname(fnameOut)):
             os.makedirs(os.path.dirname(fnameOut))
-        with open(fnameOut, 'w', encoding='utf-8') as fOut:
-            json.dump(dataFinal, fOut, indent=1, ensure_ascii=False)
+        if fnameOut.lower().endswith('.json'):
+            with open(fnameOut, 'w', encoding='utf-8') as fOut:
+                json.dump(dataFinal, fOut, indent=1, ensure_ascii=False)
+        else:
+            FulltextStore.write(fnameOut, dataFinal['meta'], dataFinal['rows'])
 
 
 if __name__ == '__main__':
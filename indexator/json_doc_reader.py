@@ -3,6 +3,7 @@ import ijson
 import os
 import gzip
 import random
+import decimal
 
 
 class JSONDocReader:
@@ -10,12 +11,30 @@ class JSONDocReader:
     An instance of this class is used by the indexator to iterate
     through sentences read from corpus files in tsakorpus native
     JSON format.
+    In the line-delimited formats (jsonl and jsonl-gzip), the first line
+    of a file is a JSON object with the document-level data, e.g.
+    {"meta": {...}}, and each subsequent line contains one sentence.
+    Such files are read line by line, so that only one sentence
+    has to be kept in memory at a time.
     """
+
+    # File extensions for each input format
+    extensions = {
+        'json': '.json',
+        'json-gzip': '.json.gz',
+        'jsonl': '.jsonl',
+        'jsonl-gzip': '.jsonl.gz'
+    }
+
     def __init__(self, format, settings):
         self.filesize_limit = -1
         self.lastFileName = ''
         self.format = format
         self.lastDocMeta = None         # for lazy calculations
+        # A document that has already been read by DocPrefetcher
+        self.preparedFileName = ''
+        self.preparedDoc = None
+        self.preparedText = None
         self.settings = settings
         self.nonpersistentID = random.randint(1, 100)
 
@@ -43,6 +62,115 @@ class JSONDocReader:
             if 'year_to' not in metadata:
                 metadata['year_to'] = metadata['year']
 
+    def add_nonpersistent_fulltext_id(self, metadata):
+        """
+        If the settings say so, generate a fulltext_id for a document
+        that does not have one. Such IDs are only unique within one
+        indexation run.
+        """
+        if ('fulltext_id' not in metadata
+                and 'use_nonpersistent_fulltext_id' in self.settings
+                and self.settings['use_nonpersistent_fulltext_id']):
+            metadata['fulltext_id'] = str(self.nonpersistentID)
+            self.nonpersistentID += random.randint(1, 100)
+
+    def open_file(self, fname):
+        """
+        Open a corpus file for reading according to the input format.
+        Return None if the format is not supported.
+        """
+        if self.format in ('json', 'jsonl'):
+            return open(fname, 'r', encoding='utf-8-sig')
+        elif self.format in ('json-gzip', 'jsonl-gzip'):
+            return gzip.open(fname, 'rt', encoding='utf-8-sig')
+        return None
+
+    @staticmethod
+    def uncompressed_size(fname):
+        """
+        Return the size of the contents of a file. For gzipped
+        files, it is taken from the gzip trailer (modulo 2^32).
+        """
+        fileSize = os.path.getsize(fname)
+        if not fname.lower().endswith('.gz') or fileSize < 4:
+            return fileSize
+        with open(fname, 'rb') as fIn:
+            fIn.seek(-4, os.SEEK_END)
+            return max(fileSize, int.from_bytes(fIn.read(4), 'little'))
+
+    def read_text(self, fname):
+        """
+        Return the (decompressed) contents of a file.
+        """
+        fIn = self.open_file(fname)
+        text = fIn.read()
+        fIn.close()
+        return text
+
+    @staticmethod
+    def parse_doc(text):
+        return json.loads(text)
+
+    def set_prepared_doc(self, fname, doc=None, text=None):
+        """
+        Make get_metadata() and get_sentences() use a document that has
+        already been read, instead of reading fname. Either the parsed
+        document or its JSON text can be given.
+        """
+        self.preparedFileName = fname
+        self.preparedDoc = doc
+        self.preparedText = text
+
+    def get_prepared_doc(self, fname):
+        """
+        Return the document prepared for fname, or None if
+        there is no such document.
+        """
+        if fname != self.preparedFileName:
+            return None
+        if self.preparedDoc is None and self.preparedText is not None:
+            self.preparedDoc = self.parse_doc(self.preparedText)
+            self.preparedText = None
+        return self.preparedDoc
+
+    @classmethod
+    def decimals_to_float(cls, value):
+        """
+        Replace the Decimal numbers produced by ijson with floats,
+        as json.loads() would have returned them.
+        """
+        if type(value) == decimal.Decimal:
+            return float(value)
+        elif type(value) == list:
+            return [cls.decimals_to_float(v) for v in value]
+        elif type(value) == dict:
+            return {k: cls.decimals_to_float(v) for k, v in value.items()}
+        return value
+
+    def set_doc_meta(self, fname, metadata):
+        """
+        Process and cache the metadata of the document stored in fname.
+        """
+        self.lastFileName = fname
+        self.add_nonpersistent_fulltext_id(metadata)
+        self.lastDocMeta = metadata
+        self.insert_meta_year(metadata)
+        return metadata
+
+    @staticmethod
+    def read_header(fIn):
+        """
+        Read the first line of a line-delimited JSON file
+        and return the document-level metadata.
+        """
+        for line in fIn:
+            if len(line.strip()) > 0:
+                header = json.loads(line)
+                if 'meta' in header:
+                    return header['meta']
+                return {}
+        return {}
+
     def get_metadata(self, fname):
         """
         If the file is not too large, return its metadata.
@@ -52,31 +180,29 @@ class JSONDocReader:
         if fname == self.lastFileName and self.lastDocMeta is not None:
             return self.lastDocMeta
         self.lastFileName = fname
-        if self.format == 'json':
-            fIn = open(fname, 'r', encoding='utf-8-sig')
-        elif self.format == 'json-gzip':
-            fIn = gzip.open(fname, 'rt', encoding='utf-8-sig')
-        else:
+        doc = self.get_prepared_doc(fname)
+        if doc is not None:
+            metadata = {}
+            if 'meta' in doc:
+                metadata = doc['meta']
+            return self.set_doc_meta(fname, metadata)
+        fIn = self.open_file(fname)
+        if fIn is None:
             return {}
+        if self.format in ('jsonl', 'jsonl-gzip'):
+            metadata = self.read_header(fIn)
+            fIn.close()
+            return self.set_doc_meta(fname, metadata)
+        # Only the beginning of the file is parsed, up to the end of
+        # the metadata; the values are the same as with json.loads(),
+        # which is used for the documents that have been read in advance
         metadata = {}
-        curMetaField = ''
-        JSONParser = ijson.parse(fIn)
-        for prefix, event, value in JSONParser:
-            if (prefix, event) == ('meta', 'map_key'):
-                curMetaField = value
-            elif len(curMetaField) > 0 and prefix.startswith('meta.'):
-                metadata[curMetaField] = value
-            elif (prefix, event) == ('meta', 'end_map'):
-                break
-        if ('fulltext_id' not in metadata
-                and 'use_nonpersistent_fulltext_id' in self.settings
-                and self.settings['use_nonpersistent_fulltext_id']):
-            metadata['fulltext_id'] = str(self.nonpersistentID)
-            self.nonpersistentID += random.randint(1, 100)
-        self.lastDocMeta = metadata
+        for meta in ijson.items(fIn, 'meta'):
+            if type(meta) == dict:
+                metadata = self.decimals_to_float(meta)
+            break
         fIn.close()
-        self.insert_meta_year(metadata)
-        return metadata
+        return self.set_doc_meta(fname, metadata)
 
     def insert_doc_level_meta(self, sentence):
         """
@@ -92,6 +218,80 @@ class JSONDocReader:
             return
         sentence['meta']['year'] = self.lastDocMeta['year_from']
 
+    def iterate_doc_sentences(self, doc):
+        """
+        Iterate through the sentences of a parsed document.
+        """
+        for i in range(len(doc['sentences'])):
+            self.insert_doc_level_meta(doc['sentences'][i])
+            if i < len(doc['sentences']) - 1:
+                yield doc['sentences'][i], False
+            else:
+                yield doc['sentences'][i], True
+                return
+
+    @staticmethod
+    def sentence_alignment(sentence):
+        """
+        Return the language ID of a sentence and the list
+        of its para_ids.
+        """
+        langID = 0
+        if 'lang' in sentence:
+            langID = sentence['lang']
+        paraIDs = []
+        if 'para_alignment' in sentence:
+            paraIDs = [pa['para_id'] for pa in sentence['para_alignment']]
+        return langID, paraIDs
+
+    def get_para_alignment(self, fname):
+        """
+        Iterate through the language IDs and para_ids of the sentences
+        of a file without keeping the sentences in memory. This is
+        a lightweight first pass needed to align the sentences of a
+        parallel corpus before they are indexed. A document that has
+        been read in advance is not released after this pass.
+        """
+        doc = self.get_prepared_doc(fname)
+        if doc is not None:
+            for sentence in doc['sentences']:
+                yield self.sentence_alignment(sentence)
+            return
+        fIn = self.open_file(fname)
+        if fIn is None:
+            return
+        if self.format in ('jsonl', 'jsonl-gzip'):
+            self.read_header(fIn)
+            for line in fIn:
+                if len(line.strip()) > 0:
+                    yield self.sentence_alignment(json.loads(line))
+        else:
+            for sentence in ijson.items(fIn, 'sentences.item'):
+                yield self.sentence_alignment(sentence)
+        fIn.close()
+
+    def get_sentences_jsonl(self, fname, fIn):
+        """
+        Iterate through the sentences of a line-delimited JSON file,
+        reading one line at a time. The metadata are taken from
+        the first line, unless they have already been read.
+        """
+        metadata = self.read_header(fIn)
+        if fname != self.lastFileName or self.lastDocMeta is None:
+            self.set_doc_meta(fname, metadata)
+        prevSent = None
+        for line in fIn:
+            if len(line.strip()) <= 0:
+                continue
+            sentence = json.loads(line)
+            self.insert_doc_level_meta(sentence)
+            if prevSent is not None:
+                yield prevSent, False
+            prevSent = sentence
+        fIn.close()
+        if prevSent is not None:
+            yield prevSent, True
+
     def get_sentences(self, fname):
         """
         If the file is not too large, iterate through its
@@ -99,32 +299,29 @@ class JSONDocReader:
         """
         if os.stat(fname).st_size > self.filesize_limit > 0:
             return
+        if self.format in ('jsonl', 'jsonl-gzip'):
+            fIn = self.open_file(fname)
+            yield from self.get_sentences_jsonl(fname, fIn)
+            return
         self.get_metadata(fname)
-        if self.format == 'json':
-            fIn = open(fname, 'r', encoding='utf-8-sig')
-        elif self.format == 'json-gzip':
-            fIn = gzip.open(fname, 'rt', encoding='utf-8-sig')
-        else:
+        doc = self.get_prepared_doc(fname)
+        if doc is not None:
+            # The document is not needed after this
+            self.set_prepared_doc('')
+            yield from self.iterate_doc_sentences(doc)
+            return
+        fIn = self.open_file(fname)
+        if fIn is None:
             return {}, True
         try:
             doc = json.load(fIn)
             fIn.close()
-            for i in range(len(doc['sentences'])):
-                self.insert_doc_level_meta(doc['sentences'][i])
-                if i < len(doc['sentences']) - 1:
-                    yield doc['sentences'][i], False
-                else:
-                    yield doc['sentences'][i], True
-                    return
+            yield from self.iterate_doc_sentences(doc)
+            return
         except MemoryError:
             print('Memory error when reading', fname, ', trying iterative JSON parser (will work slowly).')
             fIn.close()
-            if self.format == 'json':
-                fIn = open(fname, 'r', encoding='utf-8-sig')
-            elif self.format == 'json-gzip':
-                fIn = gzip.open(fname, 'rt', encoding='utf-8-sig')
-            else:
-                return {}, True
+            fIn = self.open_file(fname)
             prevSent = {}
             for sentence in ijson.items(fIn, 'sentences.item'):
                 self.insert_doc_level_meta(sentence)
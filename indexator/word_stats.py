@@ -0,0 +1,775 @@
+import array
+import bisect
+import json
+import os
+import pickle
+import shutil
+import sqlite3
+import tempfile
+from word_keys import key_to_text, key_from_text
+
+
+class SortPositions(dict):
+    """
+    Positions of word forms or lemmata in their sorted list
+    (string -> position), kept in memory.
+    """
+
+    def lookup(self, strings):
+        """
+        Return a dictionary {string: position} for several strings.
+        """
+        return {s: self[s] for s in strings}
+
+    def close(self):
+        pass
+
+
+class SQLiteSortPositions:
+    """
+    Positions of word forms or lemmata in their sorted list, kept
+    in a table of the word statistics database instead of memory
+    (see SQLiteWordStats.sort_positions()).
+    """
+
+    def __init__(self, db, table, strings, sortKey, batchSize):
+        self.db = db
+        self.table = table
+        self.batchSize = batchSize      # maximal number of strings in one query
+        for suffix in ['', '_strings', '_keys']:
+            self.db.execute('DROP TABLE IF EXISTS ' + table + suffix)
+        # Sort keys are only calculated once for each string
+        self.db.execute('CREATE TABLE ' + table + '_strings (s TEXT PRIMARY KEY)')
+        self.insert_batches('INSERT OR IGNORE INTO ' + table + '_strings VALUES (?)',
+                            ((s,) for s in strings))
+        self.db.execute('CREATE TABLE ' + table + '_keys (s TEXT, key)')
+        self.insert_batches('INSERT INTO ' + table + '_keys VALUES (?, ?)',
+                            ((s, sortKey(s)) for s, in self.db.execute('SELECT s FROM ' + table + '_strings')))
+        # Row IDs are assigned in the order of insertion, starting with 1
+        self.db.execute('CREATE TABLE ' + table + ' (pos INTEGER PRIMARY KEY, s TEXT)')
+        self.db.execute('INSERT INTO ' + table + ' (s) SELECT s FROM ' + table + '_keys ORDER BY key, s')
+        self.db.execute('CREATE UNIQUE INDEX ' + table + '_s ON ' + table + ' (s)')
+        self.db.execute('DROP TABLE ' + table + '_strings')
+        self.db.execute('DROP TABLE ' + table + '_keys')
+        self.db.commit()
+        self.nStrings = self.db.execute('SELECT COUNT(*) FROM ' + table).fetchone()[0]
+
+    def insert_batches(self, query, rows):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batchSize:
+                self.db.executemany(query, batch)
+                batch = []
+        self.db.executemany(query, batch)
+
+    def __len__(self):
+        return self.nStrings
+
+    def lookup(self, strings):
+        """
+        Return a dictionary {string: position} for several strings.
+        """
+        strings = list(strings)
+        positions = {}
+        for i in range(0, len(strings), self.batchSize):
+            batch = strings[i:i + self.batchSize]
+            positions.update(self.db.execute('SELECT s, pos - 1 FROM ' + self.table + ' WHERE s IN ('
+                                             + ','.join('?' * len(batch)) + ')', batch))
+        for s in strings:
+            if s not in positions:
+                raise KeyError(s)
+        return positions
+
+    def close(self):
+        """
+        Remove the table with the positions.
+        """
+        self.db.execute('DROP TABLE IF EXISTS ' + self.table)
+        self.db.commit()
+
+
+class WordStats:
+    """
+    Keeps the word and lemma statistics collected by the indexator:
+    integer IDs of words and lemmata, their frequencies, numbers of
+    sentences, and their frequencies in each document.
+    Words and lemmata have integer IDs shared by all languages.
+    Lemma ID 0 stands for "no lemma" (unanalyzed words); its statistics
+    are kept separately for each language.
+    This class stores everything in memory in a compact form: scalar
+    statistics are kept in arrays indexed by IDs, and word/document
+    frequencies, in flat arrays of (item, document, frequency) triples.
+    Each such triple can also hold the ID of the word_freq document
+    that was created for it in the index, so that the statistics can
+    be updated incrementally later.
+    """
+
+    def __init__(self, nLanguages):
+        self.nLanguages = nLanguages
+        self.nWords = 0
+        self.nLemmata = 0
+        self.curDID = -1
+        self.curDocFreqs = {}       # item code -> [frequency, number of sentences] in the current document
+        self.emptyLemmaFreqs = [0] * nLanguages     # language ID -> frequency of words without a lemma
+        self.emptyLemmaSFreqs = [0] * nLanguages    # language ID -> number of sentences with such words
+        self.wordIDs = [{} for i in range(nLanguages)]      # word key (see word_keys.py) -> its integer ID
+        self.lemmaIDs = [{} for i in range(nLanguages)]     # lemma as string -> its integer ID
+        self.wordFreqs = array.array('q')       # word ID -> its frequency
+        self.wordSFreqs = array.array('q')      # word ID -> its number of sentences
+        self.word2lemma = array.array('q')      # word ID -> ID of its lemma (or 0, if none)
+        self.lemmaFreqs = array.array('q', [0])     # lemma ID -> its frequency
+        self.lemmaSFreqs = array.array('q', [0])    # lemma ID -> its number of sentences
+        self.docItems = array.array('q')        # item codes (see item_code())
+        self.docIDs = array.array('q')          # document IDs
+        self.docFreqs = array.array('q')        # frequencies of the items in the documents
+        self.docSFreqs = array.array('q')       # numbers of sentences with the items in the documents
+        self.docChildIDs = array.array('q')     # IDs of the word_freq documents in the index (or -1)
+        self.docOffsets = None                  # item slot -> start of its document list (after finalize())
+
+    def item_code(self, langID, itemType, itemID):
+        """
+        Return an integer code for a word (itemType == 'w') or
+        a lemma (itemType == 'l') that is unique across the corpus.
+        """
+        if itemType == 'w':
+            return itemID * 2
+        if itemID > 0:
+            return itemID * 2 + 1
+        return -langID - 1
+
+    @staticmethod
+    def item_by_code(itemCode):
+        """
+        Return (item type, item ID) tuple for an item code.
+        """
+        if itemCode < 0:
+            return 'l', 0
+        if itemCode % 2 == 0:
+            return 'w', itemCode // 2
+        return 'l', itemCode // 2
+
+    def word_id(self, langID, wordKey):
+        """
+        Return the ID of a word, given its key. If the word
+        has not been seen before, assign a new ID to it.
+        """
+        try:
+            return self.wordIDs[langID][wordKey]
+        except KeyError:
+            wID = self.nWords
+            self.nWords += 1
+            self.wordIDs[langID][wordKey] = wID
+            self.wordFreqs.append(0)
+            self.wordSFreqs.append(0)
+            self.word2lemma.append(0)
+            return wID
+
+    def lemma_id(self, langID, lemma):
+        """
+        Return the ID of a lemma. If the lemma has not been seen
+        before, assign a new ID to it. Lemma IDs start with 1.
+        """
+        try:
+            return self.lemmaIDs[langID][lemma]
+        except KeyError:
+            self.nLemmata += 1
+            lID = self.nLemmata
+            self.lemmaIDs[langID][lemma] = lID
+            self.lemmaFreqs.append(0)
+            self.lemmaSFreqs.append(0)
+            return lID
+
+    def set_word_lemma(self, wID, lID):
+        self.word2lemma[wID] = lID
+
+    def add_occurrences(self, langID, itemType, itemID, dID, freq=1, sFreq=1):
+        """
+        Add freq occurrences of a word or a lemma in sFreq sentences
+        of the document dID. Documents should be processed one after
+        another, in the order of their IDs.
+        """
+        if itemType == 'w':
+            self.wordFreqs[itemID] += freq
+            self.wordSFreqs[itemID] += sFreq
+        elif itemID > 0:
+            self.lemmaFreqs[itemID] += freq
+            self.lemmaSFreqs[itemID] += sFreq
+        else:
+            self.emptyLemmaFreqs[langID] += freq
+            self.emptyLemmaSFreqs[langID] += sFreq
+        if self.docOffsets is not None:
+            self.unfinalize()
+        if dID != self.curDID:
+            self.flush_doc()
+            self.curDID = dID
+        itemCode = self.item_code(langID, itemType, itemID)
+        try:
+            self.curDocFreqs[itemCode][0] += freq
+            self.curDocFreqs[itemCode][1] += sFreq
+        except KeyError:
+            self.curDocFreqs[itemCode] = [freq, sFreq]
+
+    def flush_doc(self):
+        """
+        Move the frequencies collected for the current document
+        to the document frequency storage.
+        """
+        for itemCode, (freq, sFreq) in self.curDocFreqs.items():
+            self.docItems.append(itemCode)
+            self.docIDs.append(self.curDID)
+            self.docFreqs.append(freq)
+            self.docSFreqs.append(sFreq)
+            self.docChildIDs.append(-1)
+        self.curDocFreqs = {}
+
+    def finalize(self):
+        """
+        Group document frequencies by items after all documents
+        have been processed, so that they can be retrieved
+        for each item quickly. This is done by counting sort,
+        which keeps the documents of each item in the order
+        they were added.
+        """
+        if self.docOffsets is not None:
+            return
+        self.flush_doc()
+        shift = self.nLanguages
+        nSlots = 2 * (max(self.nWords, self.nLemmata) + 1) + shift
+        docOffsets = array.array('q', [0]) * (nSlots + 1)
+        for itemCode in self.docItems:
+            docOffsets[itemCode + shift + 1] += 1
+        for i in range(nSlots):
+            docOffsets[i + 1] += docOffsets[i]
+        curPos = array.array('q', docOffsets)
+        columns = [self.docIDs, self.docFreqs, self.docSFreqs, self.docChildIDs]
+        sortedColumns = [array.array('q', [0]) * len(self.docItems) for column in columns]
+        for i in range(len(self.docItems)):
+            slot = self.docItems[i] + shift
+            for iColumn in range(len(columns)):
+                sortedColumns[iColumn][curPos[slot]] = columns[iColumn][i]
+            curPos[slot] += 1
+        self.docItems = None
+        self.docIDs, self.docFreqs, self.docSFreqs, self.docChildIDs = sortedColumns
+        self.docOffsets = docOffsets
+
+    def unfinalize(self):
+        """
+        Restore the item code of each document frequency entry
+        after finalize(), so that more documents can be added.
+        """
+        shift = self.nLanguages
+        self.docItems = array.array('q')
+        for slot in range(len(self.docOffsets) - 1):
+            nEntries = self.docOffsets[slot + 1] - self.docOffsets[slot]
+            if nEntries > 0:
+                self.docItems.extend([slot - shift] * nEntries)
+        self.docOffsets = None
+
+    def doc_freqs(self, langID, itemType, itemID):
+        """
+        Return a list of (document ID, frequency, word_freq ID) tuples
+        for a word or a lemma, sorted by document ID. If no word_freq
+        document has been indexed for a tuple yet, its word_freq ID is -1.
+        """
+        self.finalize()
+        slot = self.item_code(langID, itemType, itemID) + self.nLanguages
+        return [(self.docIDs[i], self.docFreqs[i], self.docChildIDs[i])
+                for i in range(self.docOffsets[slot], self.docOffsets[slot + 1])]
+
+    def set_child_id(self, langID, itemType, itemID, dID, childID):
+        """
+        Remember the ID of the word_freq document indexed for
+        a word or a lemma in the document dID.
+        """
+        self.finalize()
+        slot = self.item_code(langID, itemType, itemID) + self.nLanguages
+        i = bisect.bisect_left(self.docIDs, dID, self.docOffsets[slot], self.docOffsets[slot + 1])
+        self.docChildIDs[i] = childID
+
+    def remove_docs(self, dIDs):
+        """
+        Subtract the statistics of the documents whose IDs are in
+        the set dIDs and forget their frequencies. Return a list
+        of (item type, item ID, word_freq ID) tuples for the
+        word_freq documents that should be removed from the index.
+        """
+        self.finalize()
+        self.unfinalize()
+        removedChildren = []
+        columns = [self.docItems, self.docIDs, self.docFreqs, self.docSFreqs, self.docChildIDs]
+        keptColumns = [array.array('q') for column in columns]
+        for i in range(len(self.docItems)):
+            if self.docIDs[i] not in dIDs:
+                for iColumn in range(len(columns)):
+                    keptColumns[iColumn].append(columns[iColumn][i])
+                continue
+            itemType, itemID = self.item_by_code(self.docItems[i])
+            freq, sFreq = self.docFreqs[i], self.docSFreqs[i]
+            if itemType == 'w':
+                self.wordFreqs[itemID] -= freq
+                self.wordSFreqs[itemID] -= sFreq
+            elif itemID > 0:
+                self.lemmaFreqs[itemID] -= freq
+                self.lemmaSFreqs[itemID] -= sFreq
+            else:
+                langID = -self.docItems[i] - 1
+                self.emptyLemmaFreqs[langID] -= freq
+                self.emptyLemmaSFreqs[langID] -= sFreq
+            if self.docChildIDs[i] >= 0:
+                removedChildren.append((itemType, itemID, self.docChildIDs[i]))
+        self.docItems, self.docIDs, self.docFreqs, self.docSFreqs, self.docChildIDs = keptColumns
+        self.finalize()
+        return removedChildren
+
+    def lemma_freq(self, langID, lID):
+        if lID > 0:
+            return self.lemmaFreqs[lID]
+        return self.emptyLemmaFreqs[langID]
+
+    def lemma_sent_freq(self, langID, lID):
+        if lID > 0:
+            return self.lemmaSFreqs[lID]
+        return self.emptyLemmaSFreqs[langID]
+
+    def lemma_freqs(self, langID, lIDs):
+        """
+        Return a dictionary {lemma ID: frequency} for several lemmata.
+        """
+        return {lID: self.lemma_freq(langID, lID) for lID in lIDs}
+
+    def doc_freqs_batch(self, langID, itemType, itemIDs):
+        """
+        Return a dictionary {item ID: list of (document ID, frequency,
+        word_freq ID) tuples} for several words or lemmata (see doc_freqs()).
+        """
+        return {itemID: self.doc_freqs(langID, itemType, itemID) for itemID in itemIDs}
+
+    def iterate_words(self, langID):
+        """
+        Iterate over (word key, word ID, lemma ID, frequency,
+        number of sentences) tuples for all words of one language
+        in the order of their IDs.
+        """
+        for wordKey, wID in self.wordIDs[langID].items():
+            yield wordKey, wID, self.word2lemma[wID], self.wordFreqs[wID], self.wordSFreqs[wID]
+
+    def iterate_lemmata(self, langID):
+        """
+        Iterate over (lemma, lemma ID, frequency, number of sentences)
+        tuples for all lemmata of one language in the order of their IDs.
+        """
+        for lemma, lID in self.lemmaIDs[langID].items():
+            yield lemma, lID, self.lemmaFreqs[lID], self.lemmaSFreqs[lID]
+
+    def freq_counts(self, langID, itemType):
+        """
+        Return a list of (frequency, number of items) tuples for words
+        (itemType == 'w') or lemmata (itemType == 'l') of one language,
+        sorted by frequency in decreasing order. Words without
+        a lemma count as one item with lemma ID 0.
+        Words and lemmata whose frequency is zero (because all documents
+        where they occurred have been removed) are not counted.
+        """
+        counts = {}
+        if itemType == 'w':
+            freqs = [self.wordFreqs[wID] for wID in self.wordIDs[langID].values()]
+        else:
+            freqs = [self.lemmaFreqs[lID] for lID in self.lemmaIDs[langID].values()]
+            freqs.append(self.emptyLemmaFreqs[langID])
+        for freq in freqs:
+            if freq <= 0:
+                continue
+            try:
+                counts[freq] += 1
+            except KeyError:
+                counts[freq] = 1
+        return sorted(counts.items(), reverse=True)
+
+    def n_items(self):
+        """
+        Return total number of different words and lemmata
+        that occur in the corpus.
+        """
+        return (sum(1 for freq in self.wordFreqs if freq > 0)
+                + sum(1 for freq in self.lemmaFreqs if freq > 0)
+                + sum(1 for freq in self.emptyLemmaFreqs if freq > 0))
+
+    def merge(self, other, dID):
+        """
+        Add statistics collected in another WordStats object for a single
+        document (with document ID 0) to this object, using dID as its ID.
+        New words and lemmata get their IDs in the order they got them
+        in the other object, i.e. in the order of their first occurrence
+        in the document. Return two dictionaries that map the word and
+        lemma IDs of the other object to the IDs in this object.
+        """
+        lemmata = sorted((lID, langID, lemma, freq, sFreq)
+                         for langID in range(self.nLanguages)
+                         for lemma, lID, freq, sFreq in other.iterate_lemmata(langID))
+        lIDMap = {0: 0}
+        for localLID, langID, lemma, freq, sFreq in lemmata:
+            lID = self.lemma_id(langID, lemma)
+            lIDMap[localLID] = lID
+            self.add_occurrences(langID, 'l', lID, dID, freq, sFreq)
+        for langID in range(self.nLanguages):
+            if other.lemma_freq(langID, 0) > 0:
+                self.add_occurrences(langID, 'l', 0, dID,
+                                     other.lemma_freq(langID, 0),
+                                     other.lemma_sent_freq(langID, 0))
+        words = sorted((wID, langID, wordKey, lID, freq, sFreq)
+                       for langID in range(self.nLanguages)
+                       for wordKey, wID, lID, freq, sFreq in other.iterate_words(langID))
+        wIDMap = {}
+        for localWID, langID, wordKey, localLID, freq, sFreq in words:
+            wID = self.word_id(langID, wordKey)
+            wIDMap[localWID] = wID
+            if localLID > 0:
+                self.set_word_lemma(wID, lIDMap[localLID])
+            self.add_occurrences(langID, 'w', wID, dID, freq, sFreq)
+        return wIDMap, lIDMap
+
+    def save(self, fname):
+        """
+        Save the statistics to a file, so that they can be loaded
+        and updated when the corpus is indexed incrementally.
+        """
+        self.finalize()
+        with open(fname, 'wb') as fOut:
+            pickle.dump(self.__dict__, fOut, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, fname, nLanguages, **kwargs):
+        """
+        Load statistics previously saved with save().
+        """
+        wordStats = cls(nLanguages)
+        with open(fname, 'rb') as fIn:
+            wordStats.__dict__.update(pickle.load(fIn))
+        return wordStats
+
+    def close(self):
+        pass
+
+
+class SQLiteWordStats(WordStats):
+    """
+    Keeps the word and lemma statistics in an SQLite database on disk.
+    Only a limited number of word/lemma IDs and pending statistics
+    updates are kept in memory; when their number exceeds cacheSize,
+    they are written to the database. This way, the memory needed
+    for the statistics does not depend on the corpus size.
+    """
+    QUERY_BATCH_SIZE = 500      # maximal number of IDs or strings in one query
+
+    def __init__(self, nLanguages, cacheSize=1000000, dirname=None):
+        super().__init__(nLanguages)
+        self.cacheSize = cacheSize
+        fd, self.fname = tempfile.mkstemp(prefix='word_stats_', suffix='.sqlite', dir=dirname)
+        os.close(fd)
+        self.connect()
+        self.db.execute('CREATE TABLE words (id INTEGER PRIMARY KEY, lang INTEGER, key TEXT, '
+                        'lemma INTEGER, freq INTEGER, sfreq INTEGER)')
+        self.db.execute('CREATE UNIQUE INDEX words_key ON words (lang, key)')
+        self.db.execute('CREATE TABLE lemmata (id INTEGER PRIMARY KEY, lang INTEGER, lemma TEXT, '
+                        'freq INTEGER, sfreq INTEGER)')
+        self.db.execute('CREATE UNIQUE INDEX lemmata_lemma ON lemmata (lang, lemma)')
+        self.db.execute('CREATE TABLE doc_freqs (item INTEGER, did INTEGER, freq INTEGER, '
+                        'sfreq INTEGER, child INTEGER)')
+        self.db.execute('CREATE TABLE counters (name TEXT PRIMARY KEY, value TEXT)')
+        self.newWords = {}      # word ID -> [language ID, key, lemma ID] (not yet in the database)
+        self.newLemmata = {}    # lemma ID -> [language ID, lemma] (not yet in the database)
+        self.freqUpdates = {}   # item code -> [frequency, number of sentences] to be added
+        self.lemmaUpdates = {}  # word ID -> lemma ID to be written to the database
+        self.docFreqRows = []   # (item code, document ID, frequency, number of sentences) tuples to be written
+        self.childUpdates = []  # (word_freq ID, item code, document ID) tuples to be written
+        self.nCached = 0
+        self.finalized = False
+
+    def connect(self):
+        self.db = sqlite3.connect(self.fname)
+        self.db.execute('PRAGMA journal_mode = OFF')
+        self.db.execute('PRAGMA synchronous = OFF')
+
+    def word_id(self, langID, wordKey):
+        try:
+            return self.wordIDs[langID][wordKey]
+        except KeyError:
+            pass
+        row = self.db.execute('SELECT id FROM words WHERE lang = ? AND key = ?',
+                              (langID, key_to_text(wordKey))).fetchone()
+        if row is not None:
+            wID = row[0]
+        else:
+            wID = self.nWords
+            self.nWords += 1
+            self.newWords[wID] = [langID, wordKey, 0]
+        self.wordIDs[langID][wordKey] = wID
+        self.nCached += 1
+        return wID
+
+    def lemma_id(self, langID, lemma):
+        try:
+            return self.lemmaIDs[langID][lemma]
+        except KeyError:
+            pass
+        row = self.db.execute('SELECT id FROM lemmata WHERE lang = ? AND lemma = ?',
+                              (langID, lemma)).fetchone()
+        if row is not None:
+            lID = row[0]
+        else:
+            self.nLemmata += 1
+            lID = self.nLemmata
+            self.newLemmata[lID] = [langID, lemma]
+        self.lemmaIDs[langID][lemma] = lID
+        self.nCached += 1
+        return lID
+
+    def set_word_lemma(self, wID, lID):
+        if wID in self.newWords:
+            self.newWords[wID][2] = lID
+        else:
+            self.lemmaUpdates[wID] = lID
+
+    def add_occurrences(self, langID, itemType, itemID, dID, freq=1, sFreq=1):
+        if itemType == 'l' and itemID <= 0:
+            self.emptyLemmaFreqs[langID] += freq
+            self.emptyLemmaSFreqs[langID] += sFreq
+        else:
+            itemCode = self.item_code(langID, itemType, itemID)
+            try:
+                self.freqUpdates[itemCode][0] += freq
+                self.freqUpdates[itemCode][1] += sFreq
+            except KeyError:
+                self.freqUpdates[itemCode] = [freq, sFreq]
+                self.nCached += 1
+        self.finalized = False
+        if dID != self.curDID:
+            self.flush_doc()
+            self.curDID = dID
+            if self.nCached > self.cacheSize:
+                self.flush()
+        itemCode = self.item_code(langID, itemType, itemID)
+        try:
+            self.curDocFreqs[itemCode][0] += freq
+            self.curDocFreqs[itemCode][1] += sFreq
+        except KeyError:
+            self.curDocFreqs[itemCode] = [freq, sFreq]
+
+    def flush_doc(self):
+        self.docFreqRows += [(itemCode, self.curDID, freq, sFreq)
+                             for itemCode, (freq, sFreq) in self.curDocFreqs.items()]
+        self.nCached += len(self.curDocFreqs)
+        self.curDocFreqs = {}
+
+    def flush(self):
+        """
+        Write all pending data to the database and clear the cache.
+        """
+        self.db.executemany('INSERT INTO words VALUES (?, ?, ?, ?, 0, 0)',
+                            ((wID, langID, key_to_text(wordKey), lID)
+                             for wID, (langID, wordKey, lID) in self.newWords.items()))
+        self.db.executemany('INSERT INTO lemmata VALUES (?, ?, ?, 0, 0)',
+                            ((lID, langID, lemma)
+                             for lID, (langID, lemma) in self.newLemmata.items()))
+        self.db.executemany('UPDATE words SET lemma = ? WHERE id = ?',
+                            ((lID, wID) for wID, lID in self.lemmaUpdates.items()))
+        self.db.executemany('UPDATE words SET freq = freq + ?, sfreq = sfreq + ? WHERE id = ?',
+                            ((freq, sFreq, itemCode // 2)
+                             for itemCode, (freq, sFreq) in self.freqUpdates.items()
+                             if itemCode % 2 == 0))
+        self.db.executemany('UPDATE lemmata SET freq = freq + ?, sfreq = sfreq + ? WHERE id = ?',
+                            ((freq, sFreq, itemCode // 2)
+                             for itemCode, (freq, sFreq) in self.freqUpdates.items()
+                             if itemCode % 2 == 1))
+        self.db.executemany('INSERT INTO doc_freqs VALUES (?, ?, ?, ?, -1)', self.docFreqRows)
+        self.db.executemany('UPDATE doc_freqs SET child = ? WHERE item = ? AND did = ?', self.childUpdates)
+        self.db.commit()
+        self.wordIDs = [{} for i in range(self.nLanguages)]
+        self.lemmaIDs = [{} for i in range(self.nLanguages)]
+        self.newWords = {}
+        self.newLemmata = {}
+        self.freqUpdates = {}
+        self.lemmaUpdates = {}
+        self.docFreqRows = []
+        self.childUpdates = []
+        self.nCached = 0
+
+    def finalize(self):
+        if self.finalized:
+            return
+        self.flush_doc()
+        self.flush()
+        self.db.execute('CREATE INDEX IF NOT EXISTS doc_freqs_item ON doc_freqs (item, did)')
+        self.finalized = True
+
+    def doc_freqs(self, langID, itemType, itemID):
+        self.finalize()
+        return self.db.execute('SELECT did, freq, child FROM doc_freqs WHERE item = ? ORDER BY did',
+                               (self.item_code(langID, itemType, itemID),)).fetchall()
+
+    def set_child_id(self, langID, itemType, itemID, dID, childID):
+        # Updates are written in batches; they do not affect
+        # the data that is read before save() is called.
+        self.childUpdates.append((childID, self.item_code(langID, itemType, itemID), dID))
+        if len(self.childUpdates) > self.cacheSize:
+            self.db.executemany('UPDATE doc_freqs SET child = ? WHERE item = ? AND did = ?', self.childUpdates)
+            self.childUpdates = []
+
+    def remove_docs(self, dIDs):
+        self.finalize()
+        self.db.execute('CREATE INDEX IF NOT EXISTS doc_freqs_did ON doc_freqs (did)')
+        self.db.execute('CREATE TEMPORARY TABLE removed_docs (did INTEGER PRIMARY KEY)')
+        self.db.executemany('INSERT INTO removed_docs VALUES (?)', ((dID,) for dID in dIDs))
+        removedChildren = []
+        wordUpdates = []
+        lemmaUpdates = []
+        for itemCode, freq, sFreq, childID in self.db.execute(
+                'SELECT item, freq, sfreq, child FROM doc_freqs '
+                'WHERE did IN (SELECT did FROM removed_docs)').fetchall():
+            itemType, itemID = self.item_by_code(itemCode)
+            if itemType == 'w':
+                wordUpdates.append((freq, sFreq, itemID))
+            elif itemID > 0:
+                lemmaUpdates.append((freq, sFreq, itemID))
+            else:
+                self.emptyLemmaFreqs[-itemCode - 1] -= freq
+                self.emptyLemmaSFreqs[-itemCode - 1] -= sFreq
+            if childID >= 0:
+                removedChildren.append((itemType, itemID, childID))
+        self.db.executemany('UPDATE words SET freq = freq - ?, sfreq = sfreq - ? WHERE id = ?', wordUpdates)
+        self.db.executemany('UPDATE lemmata SET freq = freq - ?, sfreq = sfreq - ? WHERE id = ?', lemmaUpdates)
+        self.db.execute('DELETE FROM doc_freqs WHERE did IN (SELECT did FROM removed_docs)')
+        self.db.execute('DROP TABLE removed_docs')
+        self.db.commit()
+        return removedChildren
+
+    def lemma_freq(self, langID, lID):
+        if lID <= 0:
+            return self.emptyLemmaFreqs[langID]
+        self.finalize()
+        return self.db.execute('SELECT freq FROM lemmata WHERE id = ?', (lID,)).fetchone()[0]
+
+    def lemma_sent_freq(self, langID, lID):
+        if lID <= 0:
+            return self.emptyLemmaSFreqs[langID]
+        self.finalize()
+        return self.db.execute('SELECT sfreq FROM lemmata WHERE id = ?', (lID,)).fetchone()[0]
+
+    def lemma_freqs(self, langID, lIDs):
+        self.finalize()
+        lemmaFreqs = {}
+        dbIDs = []
+        for lID in lIDs:
+            if lID <= 0:
+                lemmaFreqs[lID] = self.emptyLemmaFreqs[langID]
+            else:
+                dbIDs.append(lID)
+        for i in range(0, len(dbIDs), self.QUERY_BATCH_SIZE):
+            batch = dbIDs[i:i + self.QUERY_BATCH_SIZE]
+            lemmaFreqs.update(self.db.execute('SELECT id, freq FROM lemmata WHERE id IN ('
+                                              + ','.join('?' * len(batch)) + ')', batch))
+        return lemmaFreqs
+
+    def doc_freqs_batch(self, langID, itemType, itemIDs):
+        self.finalize()
+        itemIDs = list(itemIDs)
+        docFreqs = {itemID: [] for itemID in itemIDs}
+        for i in range(0, len(itemIDs), self.QUERY_BATCH_SIZE):
+            itemCodes = [self.item_code(langID, itemType, itemID)
+                         for itemID in itemIDs[i:i + self.QUERY_BATCH_SIZE]]
+            for itemCode, dID, freq, childID in self.db.execute(
+                    'SELECT item, did, freq, child FROM doc_freqs WHERE item IN ('
+                    + ','.join('?' * len(itemCodes)) + ') ORDER BY item, did', itemCodes):
+                docFreqs[self.item_by_code(itemCode)[1]].append((dID, freq, childID))
+        return docFreqs
+
+    def sort_positions(self, name, strings, sortKey):
+        """
+        Sort the strings (ignoring duplicates) by the keys returned
+        by the sortKey function in a table of the database, so that
+        they do not have to be kept in memory. Strings with equal keys
+        are sorted by their code points. Return an SQLiteSortPositions
+        object; its close() method should be called when it is no
+        longer needed.
+        """
+        self.finalize()
+        return SQLiteSortPositions(self.db, 'sort_' + name, strings, sortKey, self.QUERY_BATCH_SIZE)
+
+    def iterate_words(self, langID):
+        self.finalize()
+        for row in self.db.execute('SELECT key, id, lemma, freq, sfreq FROM words '
+                                   'WHERE lang = ? ORDER BY id', (langID,)):
+            yield (key_from_text(row[0]),) + tuple(row[1:])
+
+    def iterate_lemmata(self, langID):
+        self.finalize()
+        for row in self.db.execute('SELECT lemma, id, freq, sfreq FROM lemmata '
+                                   'WHERE lang = ? ORDER BY id', (langID,)):
+            yield tuple(row)
+
+    def freq_counts(self, langID, itemType):
+        self.finalize()
+        if itemType == 'w':
+            rows = self.db.execute('SELECT freq, COUNT(*) FROM words WHERE lang = ? AND freq > 0 '
+                                   'GROUP BY freq', (langID,)).fetchall()
+        else:
+            rows = self.db.execute('SELECT freq, COUNT(*) FROM lemmata WHERE lang = ? AND freq > 0 '
+                                   'GROUP BY freq', (langID,)).fetchall()
+        counts = {freq: count for freq, count in rows}
+        if itemType == 'l' and self.emptyLemmaFreqs[langID] > 0:
+            try:
+                counts[self.emptyLemmaFreqs[langID]] += 1
+            except KeyError:
+                counts[self.emptyLemmaFreqs[langID]] = 1
+        return sorted(counts.items(), reverse=True)
+
+    def n_items(self):
+        self.finalize()
+        return (self.db.execute('SELECT COUNT(*) FROM words WHERE freq > 0').fetchone()[0]
+                + self.db.execute('SELECT COUNT(*) FROM lemmata WHERE freq > 0').fetchone()[0]
+                + sum(1 for freq in self.emptyLemmaFreqs if freq > 0))
+
+    def save(self, fname):
+        """
+        Save the statistics to a copy of the database. The counters
+        that are kept in memory are stored in the database as well.
+        """
+        self.finalize()
+        self.flush()
+        counters = {
+            'nWords': self.nWords,
+            'nLemmata': self.nLemmata,
+            'emptyLemmaFreqs': self.emptyLemmaFreqs,
+            'emptyLemmaSFreqs': self.emptyLemmaSFreqs
+        }
+        self.db.executemany('INSERT OR REPLACE INTO counters VALUES (?, ?)',
+                            ((k, json.dumps(v)) for k, v in counters.items()))
+        self.db.commit()
+        self.db.close()
+        shutil.copyfile(self.fname, fname)
+        self.connect()
+
+    @classmethod
+    def load(cls, fname, nLanguages, cacheSize=1000000, dirname=None):
+        """
+        Load statistics previously saved with save(). The saved
+        database is copied, so that it does not change until
+        the next save().
+        """
+        wordStats = cls(nLanguages, cacheSize=cacheSize, dirname=dirname)
+        wordStats.db.close()
+        shutil.copyfile(fname, wordStats.fname)
+        wordStats.connect()
+        for k, v in wordStats.db.execute('SELECT name, value FROM counters'):
+            setattr(wordStats, k, json.loads(v))
+        wordStats.finalized = True
+        return wordStats
+
+    def close(self):
+        """
+        Close the database and delete the temporary file.
+        """
+        self.db.close()
+        if os.path.exists(self.fname):
+            os.remove(self.fname)
@@ -2,7 +2,11 @@ from elasticsearch import Elasticsearch, helpers
 from elasticsearch.client import IndicesClient
 import json
 import os
+import copy
 import time
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
 from .query_parsers import InterfaceQueryParser
 
 
@@ -28,6 +32,11 @@ class SearchClient:
     def __init__(self, settings_dir, settings):
         self.settings = settings
         self.name = self.settings.corpus_name
+        # Aliases that point to the current version of each index;
+        # the indexator switches them when a new version is ready
+        self.wordsIndex = self.name + '.words'
+        self.docsIndex = self.name + '.docs'
+        self.sentencesIndex = self.name + '.sentences'
         esTimeout = max(20, self.settings.query_timeout)
         self.es = None
         if self.settings.elastic_url is not None and len(self.settings.elastic_url) > 0:
@@ -37,6 +46,16 @@ class SearchClient:
             self.es = Elasticsearch(timeout=esTimeout)
         self.es_ic = IndicesClient(self.es)
         self.qp = InterfaceQueryParser(settings_dir, self.settings)
+        self.docFreqMatrix = None   # DocFreqMatrix, if word_freq_storage is sidecar
+        self.msearchBatchSize = 50  # maximal number of queries in one _msearch request
+        # Version of the indexes, see indexes_version()
+        self.indexesVersion = None
+        self.indexesVersionChecked = 0      # time of the last request of the version
+        self.indexesVersionCheckInterval = 10   # seconds
+        # Cache of word and lemma objects retrieved by ID, see get_words_by_ids()
+        self.wordCache = collections.OrderedDict()    # ID -> hit
+        self.wordCacheVersion = None    # version of the indexes when the cache was filled
+        self.wordCacheLock = threading.Lock()
         self.logging = 'none'   # none|query|hits
         self.query_log = []
         # Logging is only switched temporarily when the user clicks on
@@ -73,17 +92,175 @@ class SearchClient:
         used to count the number of occurrences in a particular
         subcorpus.
         """
+        if 'subcorpus_aggs' in esQuery:
+            return self.get_words_subcorpus(esQuery)
         if self.settings.query_timeout > 0:
-            hits = self.es.search(index=self.name + '.words',
+            hits = self.es.search(index=self.wordsIndex,
                                   body=esQuery, request_timeout=self.settings.query_timeout)
         else:
-            hits = self.es.search(index=self.name + '.words',
+            hits = self.es.search(index=self.wordsIndex,
                                   body=esQuery)
         return hits
 
+    def scan_word_items(self, esQuery, source, scanInfo):
+        """
+        Iterate over the words and lemmata found by a query to the words
+        index whose frequencies in the documents are stored in the
+        document frequency files. Yield (item type, integer ID, hit),
+        most frequent items first. Stop after word_freq_scan_limit
+        items or after query_timeout seconds (including the time spent
+        by the caller), and set scanInfo['timed_out'] to True if some
+        items have been left out.
+        """
+        scanQuery = {'query': esQuery['query'], '_source': source, 'sort': [{'freq': 'desc'}]}
+        if self.settings.query_timeout > 0:
+            maxRunTime = time.time() + self.settings.query_timeout
+            iterator = helpers.scan(self.es, index=self.wordsIndex, query=scanQuery,
+                                    preserve_order=True, request_timeout=self.settings.query_timeout)
+        else:
+            maxRunTime = None
+            iterator = helpers.scan(self.es, index=self.wordsIndex, query=scanQuery,
+                                    preserve_order=True)
+        nItems = 0
+        for hit in iterator:
+            if (nItems >= self.settings.word_freq_scan_limit > 0
+                    or (maxRunTime is not None and time.time() > maxRunTime)):
+                scanInfo['timed_out'] = True
+                break
+            nItems += 1
+            itemType = hit['_id'][0]
+            if itemType not in ('w', 'l') or not hit['_id'][1:].isdigit():
+                continue
+            yield itemType, int(hit['_id'][1:]), hit
+
+    def get_words_subcorpus(self, esQuery):
+        """
+        Find words or lemmata in a subcorpus if their frequencies
+        in the documents are stored in the document frequency files
+        rather than in the index. Return a response that looks like
+        that of Elasticsearch to the corresponding word_freq query
+        (see InterfaceQueryParser.wrap_inner_word_query()). If not all
+        items could be looked up (see scan_word_items()), timed_out
+        is set to True in the response.
+        """
+        params = esQuery['subcorpus_aggs']
+        docIDSet = set(int(docID) for docID in params['doc_ids'])
+        docIDsSorted = sorted(docIDSet)
+        groupBy = params['group_by']
+        buckets = {}    # word or lemma ID -> bucket
+        foundDocs = set()
+        totalFreq = 0
+        nPairs = 0
+        scanInfo = {'timed_out': False}
+        for itemType, itemID, hit in self.scan_word_items(esQuery, esQuery['_source'], scanInfo):
+            docs, freq = self.docFreqMatrix.subcorpus_freqs(itemType, itemID, docIDsSorted, docIDSet)
+            if len(docs) <= 0:
+                continue
+            foundDocs |= set(docs)
+            totalFreq += freq
+            nPairs += len(docs)
+            if groupBy == 'word' and itemType == 'w':
+                key = hit['_id']
+            elif groupBy == 'lemma' and itemType == 'w' and 'l_id' in hit['_source']:
+                key = hit['_source']['l_id']
+            elif groupBy == 'lemma' and itemType == 'l':
+                key = hit['_id']
+            else:
+                continue
+            if key not in buckets:
+                buckets[key] = {'key': key, 'doc_count': 0,
+                                'subagg_freq': {'value': 0.0},
+                                'subagg_nforms': {'value': 0},
+                                'subagg_wf': {'value': None},
+                                'subagg_lemma': {'value': None}}
+            bucket = buckets[key]
+            bucket['doc_count'] += len(docs)
+            bucket['subagg_freq']['value'] += freq
+            if itemType == 'w':
+                bucket['subagg_nforms']['value'] += 1
+            for field, subagg in (('wf_order', 'subagg_wf'), ('l_order', 'subagg_lemma')):
+                if field in hit['_source'] and (bucket[subagg]['value'] is None
+                                                or hit['_source'][field] > bucket[subagg]['value']):
+                    bucket[subagg]['value'] = hit['_source'][field]
+        # Order the buckets the way the terms aggregation does
+        order = params['order']
+        if order is not None and 'subagg_freq' in order:
+            sortKey = lambda b: (-b['subagg_freq']['value'], b['key'])
+        elif order is not None and len(order) > 0:
+            subagg = list(order)[0]
+            sortKey = lambda b: (b[subagg]['value'] is None, b[subagg]['value'] or 0, b['key'])
+        else:
+            sortKey = lambda b: (-b['doc_count'], b['key'])
+        return {
+            'timed_out': scanInfo['timed_out'],
+            'hits': {'total': {'value': nPairs, 'relation': 'eq'}, 'hits': []},
+            'aggregations': {
+                'agg_freq': {'value': float(totalFreq)},
+                'agg_ndocs': {'value': len(foundDocs)},
+                'agg_noccurrences': {'value': len(buckets)},
+                'agg_group_by_word': {
+                    'buckets': sorted(buckets.values(), key=sortKey)[:params['size']]
+                }
+            }
+        }
+
+    @log_if_needed
+    def get_word_doc_freqs(self, esQuery):
+        """
+        Find words or lemmata with a query to the words index for the
+        entire corpus. Return a dictionary {document ID: total
+        frequency of the items found in the document} and a boolean
+        that tells if some of the items have been left out because
+        there were too many of them (see scan_word_items()).
+        """
+        docFreqs = {}
+        if self.docFreqMatrix is not None:
+            scanInfo = {'timed_out': False}
+            for itemType, itemID, hit in self.scan_word_items(esQuery, False, scanInfo):
+                rowDocIDs, rowFreqs = self.docFreqMatrix.row(itemType, itemID)
+                for i in range(len(rowDocIDs)):
+                    docFreqs[rowDocIDs[i]] = docFreqs.get(rowDocIDs[i], 0) + rowFreqs[i]
+            return docFreqs, scanInfo['timed_out']
+        # Sum the frequencies in the word_freq objects by document,
+        # with a paginated composite aggregation
+        freqsQuery = {
+            'query': {
+                'bool': {
+                    'must': [
+                        {'has_parent': {'parent_type': 'word', 'query': esQuery['query']}},
+                        {'term': {'wtype': 'word_freq'}}
+                    ]
+                }
+            },
+            'size': 0,
+            'aggs': {
+                'agg_docs': {
+                    'composite': {
+                        'size': 10000,
+                        'sources': [{'d_id': {'terms': {'field': 'd_id'}}}]
+                    },
+                    'aggs': {'subagg_freq': {'sum': {'field': 'freq'}}}
+                }
+            }
+        }
+        while True:
+            if self.settings.query_timeout > 0:
+                hits = self.es.search(index=self.wordsIndex, body=freqsQuery,
+                                      request_timeout=self.settings.query_timeout)
+            else:
+                hits = self.es.search(index=self.wordsIndex, body=freqsQuery)
+            agg = hits['aggregations']['agg_docs']
+            for bucket in agg['buckets']:
+                docID = int(bucket['key']['d_id'])
+                docFreqs[docID] = docFreqs.get(docID, 0) + bucket['subagg_freq']['value']
+            if len(agg['buckets']) <= 0 or 'after_key' not in agg:
+                break
+            freqsQuery['aggs']['agg_docs']['composite']['after'] = agg['after_key']
+        return docFreqs, False
+
     @log_if_needed
     def get_docs(self, esQuery):
-        hits = self.es.search(index=self.name + '.docs',
+        hits = self.es.search(index=self.docsIndex,
                               body=esQuery)
         return hits
 
@@ -92,17 +269,17 @@ class SearchClient:
         """
         Iterate over all documents found with the query.
         """
-        iterator = helpers.scan(self.es, index=self.name + '.docs',
+        iterator = helpers.scan(self.es, index=self.docsIndex,
                                 query=esQuery)
         return iterator
 
     @log_if_needed
     def get_sentences(self, esQuery):
         if self.settings.query_timeout > 0:
-            hits = self.es.search(index=self.name + '.sentences',
+            hits = self.es.search(index=self.sentencesIndex,
                                   body=esQuery, request_timeout=self.settings.query_timeout)
         else:
-            hits = self.es.search(index=self.name + '.sentences',
+            hits = self.es.search(index=self.sentencesIndex,
                                   body=esQuery)
         # print(json.dumps(hits, ensure_ascii=False, indent=1))
         return hits
@@ -113,28 +290,200 @@ class SearchClient:
         Iterate over all sentences found with the query.
         """
         if self.settings.query_timeout > 0:
-            iterator = helpers.scan(self.es, index=self.name + '.sentences',
+            iterator = helpers.scan(self.es, index=self.sentencesIndex,
                                     query=esQuery, request_timeout=self.settings.query_timeout)
         else:
-            iterator = helpers.scan(self.es, index=self.name + '.sentences',
+            iterator = helpers.scan(self.es, index=self.sentencesIndex,
                                     query=esQuery)
         return iterator
 
+    def process_sentence_slices(self, esQuery, nSlices, processSlice):
+        """
+        Scroll through all sentences found with the query in nSlices
+        sliced scrolls that run in parallel threads. processSlice is
+        called in the thread of each slice with an iterator over its
+        hits; it may stop before the iterator is exhausted. Return
+        the list of values returned by processSlice for all slices.
+        """
+        if nSlices <= 1:
+            return [processSlice(self.get_all_sentences(esQuery))]
+        if self.logging == 'query':
+            self.query_log.append(esQuery)
+
+        def run_slice(iSlice):
+            sliceQuery = copy.copy(esQuery)
+            sliceQuery['slice'] = {'id': iSlice, 'max': nSlices}
+            if self.settings.query_timeout > 0:
+                iterator = helpers.scan(self.es, index=self.sentencesIndex,
+                                        query=sliceQuery, request_timeout=self.settings.query_timeout)
+            else:
+                iterator = helpers.scan(self.es, index=self.sentencesIndex,
+                                        query=sliceQuery)
+            try:
+                return processSlice(iterator)
+            finally:
+                # Clear the scroll if processSlice has stopped early
+                iterator.close()
+
+        with ThreadPoolExecutor(max_workers=nSlices) as executor:
+            return list(executor.map(run_slice, range(nSlices)))
+
+    def multi_search(self, index, esQueries):
+        """
+        Run a list of queries against one index in as few _msearch
+        requests as possible. Return the list of responses in the
+        same order. A response to a query that failed contains
+        an "error" key instead of hits.
+        """
+        responses = []
+        for iStart in range(0, len(esQueries), self.msearchBatchSize):
+            body = []
+            for esQuery in esQueries[iStart:iStart + self.msearchBatchSize]:
+                body.append({})
+                body.append(esQuery)
+            if self.settings.query_timeout > 0:
+                result = self.es.msearch(index=index, body=body,
+                                         request_timeout=self.settings.query_timeout)
+            else:
+                result = self.es.msearch(index=index, body=body)
+            responses += result['responses']
+        return responses
+
+    def get_words_multi(self, esQueries):
+        """
+        Same as get_words(), but for a list of queries, which are
+        sent in batches. Return the list of responses.
+        """
+        if self.logging == 'query':
+            self.query_log += esQueries
+        responses = [None] * len(esQueries)
+        positionsES = []    # positions of the queries that are sent to Elasticsearch
+        for i in range(len(esQueries)):
+            if 'subcorpus_aggs' in esQueries[i]:
+                responses[i] = self.get_words_subcorpus(esQueries[i])
+            else:
+                positionsES.append(i)
+        for i, response in zip(positionsES,
+                               self.multi_search(self.wordsIndex, [esQueries[i] for i in positionsES])):
+            responses[i] = response
+        if self.logging == 'hits':
+            self.query_log += responses
+        return responses
+
+    def get_sentences_multi(self, esQueries):
+        """
+        Same as get_sentences(), but for a list of queries, which are
+        sent in batches. Return the list of responses.
+        """
+        if self.logging == 'query':
+            self.query_log += esQueries
+        responses = self.multi_search(self.sentencesIndex, esQueries)
+        if self.logging == 'hits':
+            self.query_log += responses
+        return responses
+
     def get_sentence_by_id(self, sentId):
         esQuery = {'query': {'term': {'_id': sentId}}}
-        hits = self.es.search(index=self.name + '.sentences',
+        hits = self.es.search(index=self.sentencesIndex,
                               body=esQuery)
         return hits
 
+    def get_sentences_by_ids(self, sentIds):
+        """
+        Retrieve the sentences with the given IDs with one request.
+        Return a list of hits for the sentences that exist, in the
+        order of the IDs.
+        """
+        if len(sentIds) <= 0:
+            return []
+        body = {'ids': [str(sentId) for sentId in sentIds]}
+        if self.settings.query_timeout > 0:
+            response = self.es.mget(index=self.sentencesIndex, body=body,
+                                    request_timeout=self.settings.query_timeout)
+        else:
+            response = self.es.mget(index=self.sentencesIndex, body=body)
+        return [doc for doc in response['docs'] if 'found' in doc and doc['found']]
+
     def get_word_by_id(self, wordId):
         esQuery = {'query': {'term': {'_id': wordId}}}
-        hits = self.es.search(index=self.name + '.words',
+        hits = self.es.search(index=self.wordsIndex,
                               body=esQuery)
         return hits
 
+    def indexes_version(self):
+        """
+        Return a value that changes each time the indexator has changed
+        the indexes: the UUID of the docs index, which is new after each
+        full indexation, and the counter of indexations stored in its
+        metadata, which the indexator increases after each full or
+        incremental indexation. Data kept in memory by the corpus app
+        is only valid while this value stays the same. Since this takes
+        a request, the value is only requested again after
+        indexesVersionCheckInterval seconds.
+        """
+        if (self.indexesVersion is None
+                or time.time() - self.indexesVersionChecked >= self.indexesVersionCheckInterval):
+            version = []
+            for indexInfo in self.es_ic.get(index=self.docsIndex).values():
+                counter = 0
+                if '_meta' in indexInfo['mappings'] and 'write_counter' in indexInfo['mappings']['_meta']:
+                    counter = indexInfo['mappings']['_meta']['write_counter']
+                version.append((indexInfo['settings']['index']['uuid'], counter))
+            self.indexesVersion = sorted(version)
+            self.indexesVersionChecked = time.time()
+        return self.indexesVersion
+
+    def check_word_cache(self):
+        """
+        Empty the cache of word and lemma objects if the corpus has
+        been indexed again, fully or incrementally, since it was filled
+        (see indexes_version()).
+        """
+        version = self.indexes_version()
+        with self.wordCacheLock:
+            if version != self.wordCacheVersion:
+                self.wordCache.clear()
+                self.wordCacheVersion = version
+
+    def get_words_by_ids(self, wordIds):
+        """
+        Retrieve the words or lemmata with the given IDs. Those that
+        have been retrieved recently are taken from the cache, the
+        rest are retrieved with one mget request. Return a dictionary
+        {ID: hit} for the IDs that exist. The hits are copies, so they
+        can be changed by the caller.
+        """
+        self.check_word_cache()
+        hits = {}
+        toRetrieve = []
+        with self.wordCacheLock:
+            for wordId in wordIds:
+                wordId = str(wordId)
+                if wordId in self.wordCache:
+                    self.wordCache.move_to_end(wordId)
+                    hits[wordId] = self.wordCache[wordId]
+                elif wordId not in toRetrieve:
+                    toRetrieve.append(wordId)
+        if len(toRetrieve) > 0:
+            if self.settings.query_timeout > 0:
+                response = self.es.mget(index=self.wordsIndex, body={'ids': toRetrieve},
+                                        request_timeout=self.settings.query_timeout)
+            else:
+                response = self.es.mget(index=self.wordsIndex, body={'ids': toRetrieve})
+            with self.wordCacheLock:
+                for doc in response['docs']:
+                    if 'found' not in doc or not doc['found']:
+                        continue
+                    hits[doc['_id']] = doc
+                    if self.settings.word_cache_size > 0:
+                        self.wordCache[doc['_id']] = doc
+                while len(self.wordCache) > self.settings.word_cache_size:
+                    self.wordCache.popitem(last=False)
+        return {wordId: copy.deepcopy(hit) for wordId, hit in hits.items()}
+
     def get_doc_by_id(self, docId):
         esQuery = {'query': {'term': {'_id': docId}}}
-        hits = self.es.search(index=self.name + '.docs',
+        hits = self.es.search(index=self.docsIndex,
                               body=esQuery)
         return hits
 
@@ -145,7 +494,7 @@ class SearchClient:
         aggNWords = {'agg_nwords': {'sum': {'field': 'n_words'}}}
         esQuery = {'query': {'match_all': {}}, 'from': 0, 'size': 0,
                    'aggs': aggNWords}
-        hits = self.es.search(index=self.name + '.docs',
+        hits = self.es.search(index=self.docsIndex,
                               body=esQuery)
         return hits['aggregations']['agg_nwords']['value']
 
@@ -165,7 +514,7 @@ class SearchClient:
         """
         htmlQuery = {'lang': lang, 'lang1': lang, 'wf1': '*', 'n_ana1': 'any'}
         esQuery = self.qp.word_freqs_query(htmlQuery, searchType='word')
-        hits = self.es.search(index=self.name + '.words',
+        hits = self.es.search(index=self.wordsIndex,
                               body=esQuery)
         return hits
 
@@ -176,7 +525,7 @@ class SearchClient:
         """
         htmlQuery = {'lang': lang, 'lang1': lang, 'wf1': '*', 'n_ana1': 'any'}
         esQuery = self.qp.word_freqs_query(htmlQuery, searchType='lemma')
-        hits = self.es.search(index=self.name + '.words',
+        hits = self.es.search(index=self.wordsIndex,
                               body=esQuery)
         return hits
 
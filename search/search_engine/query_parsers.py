@@ -416,6 +416,20 @@ class InterfaceQueryParser:
                 esQuery['aggs']['agg_group_by_word'] = self.composite_agg_word(query_size, order, groupBy, after_key)
             elif groupBy == 'word' and order is not None:
                 esQuery['sort'] = order
+        elif self.settings.word_freq_storage == 'sidecar':
+            # There are no word_freq objects in the index. The client
+            # finds the words or lemmata and then calculates the
+            # aggregations from the document frequency files.
+            esQuery = {
+                'query': innerQuery,
+                '_source': ['l_id', 'wf_order', 'l_order'],
+                'subcorpus_aggs': {
+                    'doc_ids': docIDs,
+                    'group_by': groupBy,
+                    'order': order,
+                    'size': query_size
+                }
+            }
         else:
             hasParentQuery = {'parent_type': 'word', 'score': True, 'query': innerQuery}
             innerWordFreqQuery = {
@@ -1,5 +1,6 @@
 import os
 import re
+import bisect
 import json
 
 
@@ -208,43 +209,87 @@ class WordRelations:
                 positions[hl] = [p for p in sorted(self.get_one_highlight_pos(innerHits[hl]))]
         return positions
 
+    def find_path_lengths_from(self, words, posFrom, countPunc=False, memo=None):
+        """
+        Return a dictionary {position: sorted list of lengths} with the
+        lengths of all paths (following next_word) from the word with
+        position posFrom to each word reachable from it.
+        The dictionaries calculated for posFrom and for all words that
+        follow it are stored in memo, so that they are calculated only
+        once if memo is reused for other positions in the same sentence
+        (with the same countPunc value).
+        """
+        if memo is None:
+            memo = {}
+        # Iterative depth-first traversal: the words that follow
+        # a word are processed before the word itself
+        stack = [(posFrom, False)]
+        while len(stack) > 0:
+            pos, bNextProcessed = stack.pop()
+            if pos in memo:
+                continue
+            nextPositions = []
+            if 0 <= pos < len(words) and 'next_word' in words[pos]:
+                nextPositions = words[pos]['next_word']
+                if type(nextPositions) == int:
+                    nextPositions = [nextPositions]
+            if not bNextProcessed:
+                stack.append((pos, True))
+                for nextPos in nextPositions:
+                    if nextPos not in memo:
+                        stack.append((nextPos, False))
+                continue
+            lenAdd = 1
+            if len(nextPositions) > 0 and words[pos]['wtype'] != 'word' and not countPunc:
+                lenAdd = 0
+            pathLengths = {pos: {0}}
+            for nextPos in nextPositions:
+                if nextPos not in memo:
+                    # Only possible if next_word links form a cycle
+                    continue
+                for posTo, lengths in memo[nextPos].items():
+                    if posTo == pos:
+                        continue
+                    if posTo not in pathLengths:
+                        pathLengths[posTo] = set()
+                    pathLengths[posTo].update(l + lenAdd for l in lengths)
+            memo[pos] = {posTo: sorted(lengths) for posTo, lengths in pathLengths.items()}
+        return memo[posFrom]
+
     def find_word_path_lengths(self, words, posFrom, posTo, cumulatedLen=0, countPunc=False,
-                               left2right=True):
+                               left2right=True, memo=None):
         """
         Return a set of path lengths between the words with positions
         posFrom and posTo.
         """
         if posFrom == posTo:
-            if left2right:
-                return {-cumulatedLen}
-            else:
-                return {cumulatedLen}
-        if not (0 <= posFrom < len(words)) or 'next_word' not in words[posFrom]:
-            return set()
-        result = set()
-        lenAdd = 1
-        if words[posFrom]['wtype'] != 'word' and not countPunc:
-            lenAdd = 0
-        if type(words[posFrom]['next_word']) == int:
-            result |= self.find_word_path_lengths(words, words[posFrom]['next_word'], posTo,
-                                                  cumulatedLen=cumulatedLen + lenAdd,
-                                                  countPunc=countPunc,
-                                                  left2right=left2right)
+            lengths = [0]
         else:
-            for iPos in words[posFrom]['next_word']:
-                result |= self.find_word_path_lengths(words, iPos, posTo,
-                                                      cumulatedLen=cumulatedLen+lenAdd,
-                                                      countPunc=countPunc,
-                                                      left2right=left2right)
-        return result
+            lengths = self.find_path_lengths_from(words, posFrom, countPunc=countPunc,
+                                                  memo=memo).get(posTo, [])
+        if left2right:
+            return {-(cumulatedLen + l) for l in lengths}
+        return {cumulatedLen + l for l in lengths}
+
+    @staticmethod
+    def length_in_range(lengths, minLen, maxLen):
+        """
+        Check if the sorted list lengths contains a value in the
+        range [minLen, maxLen].
+        """
+        i = bisect.bisect_left(lengths, minLen)
+        return i < len(lengths) and lengths[i] <= maxLen
 
-    def word_path_exists(self, sentence, posFrom, posTo, minEdges, maxEdges, countPunc=False):
+    def word_path_exists(self, sentence, posFrom, posTo, minEdges, maxEdges, countPunc=False,
+                         memo=None):
         """
         Check if a path with the length in the range [minEdges, maxEdges]
         exists between the words whose positions in the sentence words list
         are posFrom and posTo. If the "from" word is to the left of the
         "to" word in the sentence, the distance is negative. If countPunc
         is set to False, do not count non-word tokens when counting distance.
+        memo is a dictionary with the path lengths already calculated
+        for this sentence (see find_path_lengths_from()).
         """
         if '_source' not in sentence or 'words' not in sentence['_source']:
             return False
@@ -255,15 +300,14 @@ class WordRelations:
             return False
         if posFrom == posTo and minEdges <= 0 <= maxEdges:
             return True
-        pathLengths = self.find_word_path_lengths(words, posFrom, posTo,
-                                                  countPunc=countPunc,
-                                                  left2right=True)
-        if any(minEdges <= pl <= maxEdges for pl in pathLengths):
+        if memo is None:
+            memo = {}
+        # Left to right: the distance is negative
+        pathLengths = self.find_path_lengths_from(words, posFrom, countPunc=countPunc, memo=memo)
+        if posTo in pathLengths and self.length_in_range(pathLengths[posTo], -maxEdges, -minEdges):
             return True
-        pathLengths = self.find_word_path_lengths(words, posTo, posFrom,
-                                                  countPunc=countPunc,
-                                                  left2right=False)
-        if any(minEdges <= pl <= maxEdges for pl in pathLengths):
+        pathLengths = self.find_path_lengths_from(words, posTo, countPunc=countPunc, memo=memo)
+        if posFrom in pathLengths and self.length_in_range(pathLengths[posFrom], minEdges, maxEdges):
             return True
         return False
 
@@ -275,6 +319,7 @@ class WordRelations:
             return False
         self.rp.filter_multi_word_highlight(sentence, nWords=nWords)
         wordOffsets = self.get_all_highlight_pos(sentence['inner_hits'], constraints)
+        memo = {}   # path lengths in this sentence, see find_path_lengths_from()
         for k, v in constraints.items():
             # wFrom, wTo = 'w' + str(k[0]), 'w' + str(k[1])
             # if wFrom not in wordOffsets or wTo not in wordOffsets:
@@ -289,7 +334,7 @@ class WordRelations:
                             continue
                         for hlTo in wordOffsets[wTo]:
                             if self.word_path_exists(sentence, hlFrom, hlTo, v['from'], v['to'],
-                                                     countPunc=False):
+                                                     countPunc=False, memo=memo):
                                 pathFound = True
                                 # return {'to': hlTo, 'from': hlFrom,
                                 #         'minEdges': v['from'], 'maxEdges': v['to'],
@@ -27,15 +27,23 @@ def load_csv_translations(fname, pfx=''):
 def generate_po(lang):
     """
     Generate a messages.po translation file for pybabel based on
-    the contents of translations/lang
+    the contents of translations/lang, unless it is newer than
+    them and has already been compiled. Return True if the file
+    has been generated.
     """
     srcDir = os.path.join('web_app/translations', lang)
     targetDir = os.path.join('web_app/translations_pybabel', lang, 'LC_MESSAGES')
     if not os.path.exists(srcDir):
-        return
+        return False
     if not os.path.exists(targetDir):
         os.makedirs(targetDir)
-    with open(os.path.join(targetDir, 'messages.po'), 'w', encoding='utf-8') as fOut:
+    fnamePo = os.path.join(targetDir, 'messages.po')
+    if os.path.exists(fnamePo) and os.path.exists(os.path.join(targetDir, 'messages.mo')):
+        srcMtime = max((os.path.getmtime(os.path.join(srcDir, fname)) for fname in os.listdir(srcDir)),
+                       default=0)
+        if os.path.getmtime(fnamePo) >= srcMtime:
+            return False
+    with open(fnamePo, 'w', encoding='utf-8') as fOut:
         try:
             with open(os.path.join(srcDir, 'header.txt'), 'r', encoding='utf-8') as fIn:
                 fOut.write(fIn.read() + '\n')
@@ -62,6 +70,7 @@ def generate_po(lang):
                 fOut.write('msgstr "' + dictMessages[k].replace('\n', '\\n').replace('"', '&quot;').replace('%', '%%') + '"\n\n')
         except:
             print('Something went wrong when generating interface translations.')
+    return True
 
 
 def compile_translations():
@@ -104,29 +113,46 @@ settings = CorpusSettings()
 settings.load_settings(os.path.join(SETTINGS_DIR, 'corpus.json'),
                        os.path.join(SETTINGS_DIR, 'categories.json'))
 
-# Prepare pybabel translations
+# Prepare pybabel translations (each worker process does this,
+# so they are only compiled if they have changed)
+bTranslationsChanged = False
 for lang in settings.interface_languages:
-    generate_po(lang)
-compile_translations()
+    if generate_po(lang):
+        bTranslationsChanged = True
+if bTranslationsChanged:
+    compile_translations()
 
 # Continue with module imports. Beware that there are other
 # circular import issues, so the order of imported modules
 # should not change.
 from search_engine.client import SearchClient
 from .response_processors import SentenceViewer
+from .fulltext_store import FulltextStore
+from .doc_freq_matrix import DocFreqMatrix
+from .corpus_stats import CorpusStats
+from .subcorpus_cache import SubcorpusCache
 localizations = {}
 sc = SearchClient(SETTINGS_DIR, settings)
 sentView = SentenceViewer(settings, sc)
+fulltextStore = FulltextStore(os.path.join('corpus_html', settings.corpus_name),
+                              cacheSize=settings.fulltext_cache_size)
+if settings.word_freq_storage == 'sidecar':
+    sc.docFreqMatrix = DocFreqMatrix(os.path.join('corpus_freqs', settings.corpus_name))
 sc.qp.rp = sentView
 sc.qp.wr.rp = sentView
+corpusStats = CorpusStats(sc, sentView, settings)
+subcorpusCache = SubcorpusCache(sc, cacheSize=settings.subcorpus_cache_size)
 
 try:
-    settings.corpus_size = sc.get_n_words()  # size of the corpus in words
-    for lang in settings.languages:
-        # number of word types for each frequency rank
-        settings.word_freq_by_rank.append(sentView.extract_cumulative_freq_by_rank(sc.get_word_freq_by_rank(lang)))
-        # number of lemmata for each frequency rank
-        settings.lemma_freq_by_rank.append(sentView.extract_cumulative_freq_by_rank(sc.get_lemma_freq_by_rank(lang)))
+    # The statistics are normally taken from the snapshot saved
+    # by the indexator; if it is missing or outdated, ask Elasticsearch
+    if not corpusStats.load(os.path.join('corpus_stats', settings.corpus_name + '.json')):
+        corpusStats.collect(metafields=False)
+    settings.corpus_size = corpusStats.corpus_size  # size of the corpus in words
+    # number of word types for each frequency rank
+    settings.word_freq_by_rank = corpusStats.word_freq_by_rank
+    # number of lemmata for each frequency rank
+    settings.lemma_freq_by_rank = corpusStats.lemma_freq_by_rank
     settings.ready_for_work = True
 except (ConnectionError, NotFoundError):
     # Elasticsearch is down
@@ -44,6 +44,26 @@ class CorpusSettings:
         # Indexation and search options
         self.debug = False
         self.sample_size = 1.0
+        self.indexing_processes = 1
+        self.word_stats_storage = 'memory'
+        self.word_stats_cache_size = 1000000
+        self.word_stats_dir = ''
+        self.word_freq_storage = 'index'
+        self.keep_index_state = False
+        self.index_state_dir = ''
+        self.bulk_max_chunk_bytes = 10485760
+        self.bulk_max_retries = 8
+        self.bulk_request_timeout = 60
+        self.bulk_threads = 2
+        self.read_ahead_files = 2
+        self.read_ahead_max_bytes = 268435456
+        self.two_pass_alignment = False
+        self.indexing_report_file = ''
+        self.indexing_report_interval = 0
+        self.indexing_tracemalloc = False
+        self.checkpoint_interval = 0
+        self.fulltext_processes = 1
+        self.fulltext_concurrent = True
         self.all_language_search_enabled = True
         self.fulltext_search_enabled = True
         self.negative_search_enabled = True
@@ -53,9 +73,13 @@ class CorpusSettings:
         self.max_docs_retrieve = 9999
         self.max_words_in_sentence = 40
         self.max_context_expand = 5
+        self.context_prefetch_size = 3    # Number of sentences retrieved in advance on each side when expanding a context
         self.max_distance_filter = 200000
         self.max_hits_retrieve = 10000      # Increasing this value will have no effect unless you also reconfigure Elasticsearch
         self.query_timeout = 60
+        self.word_search_slices = 1       # Number of parallel sliced scrolls in multi-word word/lemma search
+        self.word_cache_size = 10000      # Number of word/lemma objects retrieved by ID kept in memory
+        self.word_freq_scan_limit = 100000    # Max number of words/lemmata looked up in the sidecar files per query
         self.max_suggestions = 8
 
         # Interface options and tools
@@ -77,6 +101,8 @@ class CorpusSettings:
         self.citation = None
         self.start_page_url = None
         self.fulltext_page_size = 100     # Size of one page of the full-text representation in sentences
+        self.fulltext_cache_size = 256    # Number of full-text pages kept in memory
+        self.subcorpus_cache_size = 64    # Number of subcorpora whose document IDs are kept in memory
         self.accidental_word_fields = []
         self.default_view = 'standard'
 
@@ -0,0 +1,289 @@
+"""
+Corpus-wide statistics used by the corpus app: the size of the corpus,
+the number of words and lemmata of each frequency rank, and the
+distribution of documents and sentences by values of the metafields.
+Calculating them requires several Elasticsearch aggregations, so the
+indexator saves them to a snapshot file after each indexation, and
+the corpus app loads them from there at startup. The snapshot is
+ignored if the indexes have been replaced since it was saved.
+"""
+
+import os
+import copy
+import json
+
+
+class CorpusStats:
+    """
+    Calculates, saves and loads the corpus-wide statistics.
+    sc is a SearchClient and sentView is a SentenceViewer.
+    """
+    FORMAT_VERSION = 1
+
+    def __init__(self, sc, sentView, settings):
+        self.sc = sc
+        self.sentView = sentView
+        self.settings = settings
+        self.corpus_size = 0
+        self.word_freq_by_rank = []     # number of word types for each frequency rank, for each language
+        self.lemma_freq_by_rank = []    # number of lemmata for each frequency rank, for each language
+        # Buckets for the entire corpus, see doc_metafield_buckets()
+        # and sent_metafield_buckets(); key: field name + '|' + language ID
+        self.doc_buckets = {}
+        self.sent_buckets = {}
+        # Values of document-level metafields, see doc_metafield_values();
+        # field name -> (version of the indexes, {document ID: list of values})
+        self.doc_values = {}
+
+    def index_version(self, indexes=None):
+        """
+        Return the UUIDs of the indexes that are currently used
+        for search (all three by default). They change each time
+        the corpus is fully indexed.
+        """
+        if indexes is None:
+            indexes = [self.sc.docsIndex, self.sc.wordsIndex, self.sc.sentencesIndex]
+        version = {}
+        for index in indexes:
+            response = self.sc.es_ic.get_settings(index=index, name='index.uuid')
+            version[index] = sorted(v['settings']['index']['uuid'] for v in response.values())
+        return version
+
+    def collect(self, metafields=True):
+        """
+        Calculate the statistics with Elasticsearch queries. Bucket
+        tables for the metafields are only calculated if metafields
+        is True; otherwise, they are calculated later when needed.
+        """
+        self.corpus_size = self.sc.get_n_words()
+        self.word_freq_by_rank = []
+        self.lemma_freq_by_rank = []
+        for lang in self.settings.languages:
+            self.word_freq_by_rank.append(self.sentView.extract_cumulative_freq_by_rank(
+                self.sc.get_word_freq_by_rank(lang)))
+            self.lemma_freq_by_rank.append(self.sentView.extract_cumulative_freq_by_rank(
+                self.sc.get_lemma_freq_by_rank(lang)))
+        self.doc_buckets = {}
+        self.sent_buckets = {}
+        if not metafields:
+            return
+        for fieldName in self.settings.search_meta['stat_options']:
+            for langID in range(-1, len(self.settings.languages)):
+                key = fieldName + '|' + str(langID)
+                self.doc_buckets[key] = self.doc_metafield_buckets(fieldName, langID=langID)
+                if fieldName in self.settings.sentence_meta:
+                    self.sent_buckets[key] = self.sent_metafield_buckets(fieldName, langID=langID)
+
+    def save(self, fname):
+        """
+        Save the statistics to a snapshot file.
+        """
+        data = {
+            'format_version': self.FORMAT_VERSION,
+            'index_version': self.index_version(),
+            'corpus_size': self.corpus_size,
+            # JSON keys are strings, so the ranks are stored as lists of pairs
+            'word_freq_by_rank': [sorted(freqByRank.items()) for freqByRank in self.word_freq_by_rank],
+            'lemma_freq_by_rank': [sorted(freqByRank.items()) for freqByRank in self.lemma_freq_by_rank],
+            'doc_buckets': self.doc_buckets,
+            'sent_buckets': self.sent_buckets
+        }
+        dirname = os.path.dirname(fname)
+        if len(dirname) > 0 and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        with open(fname + '.tmp', 'w', encoding='utf-8') as fOut:
+            json.dump(data, fOut, ensure_ascii=False)
+        os.replace(fname + '.tmp', fname)
+
+    def load(self, fname):
+        """
+        Load the statistics from a snapshot file. Return False if
+        there is no snapshot or if it does not correspond to the
+        current indexes.
+        """
+        if not os.path.exists(fname):
+            return False
+        with open(fname, 'r', encoding='utf-8') as fIn:
+            data = json.load(fIn)
+        if (data['format_version'] != self.FORMAT_VERSION
+                or data['index_version'] != self.index_version()
+                or len(data['word_freq_by_rank']) != len(self.settings.languages)):
+            return False
+        self.corpus_size = data['corpus_size']
+        self.word_freq_by_rank = [{rank: freq for rank, freq in freqByRank}
+                                  for freqByRank in data['word_freq_by_rank']]
+        self.lemma_freq_by_rank = [{rank: freq for rank, freq in freqByRank}
+                                   for freqByRank in data['lemma_freq_by_rank']]
+        self.doc_buckets = data['doc_buckets']
+        self.sent_buckets = data['sent_buckets']
+        return True
+
+    def doc_metafield_values(self, fieldName):
+        """
+        Return a dictionary {document ID: list of values of the
+        fieldName metafield} for all documents of the corpus.
+        The values are converted to strings. The dictionary is kept
+        until the corpus is indexed again (see
+        SearchClient.indexes_version()).
+        """
+        version = self.sc.indexes_version()
+        if fieldName in self.doc_values and self.doc_values[fieldName][0] == version:
+            return self.doc_values[fieldName][1]
+        docValues = {}
+        for doc in self.sc.get_all_docs({'query': {'match_all': {}}, '_source': [fieldName]}):
+            if fieldName not in doc['_source']:
+                continue
+            values = doc['_source'][fieldName]
+            if type(values) != list:
+                values = [values]
+            docValues[int(doc['_id'])] = [str(v) for v in values]
+        self.doc_values[fieldName] = (version, docValues)
+        return docValues
+
+    def doc_metafield_buckets(self, fieldName, langID=-1, docIDs=None, maxBuckets=300):
+        """
+        Group all documents into buckets, each corresponding to one
+        of the unique values for the fieldName metafield. Consider
+        only top maxBuckets field values (in terms of document count).
+        If langID is provided, count only data for a particular language.
+        Return a dictionary with the values and corresponding document
+        count.
+        """
+        if fieldName not in self.settings.search_meta['stat_options'] or langID >= len(self.settings.languages) > 1:
+            return {}
+        key = fieldName + '|' + str(langID)
+        if docIDs is None and maxBuckets == 300 and key in self.doc_buckets:
+            return copy.deepcopy(self.doc_buckets[key])
+        innerQuery = {'match_all': {}}
+        if docIDs is not None:
+            innerQuery = {'ids': {'values': list(docIDs)}}
+        if not fieldName.startswith('year'):
+            queryFieldName = fieldName + '_kw'
+        else:
+            queryFieldName = fieldName
+        if len(self.settings.languages) == 1 or langID < 0:
+            nWordsFieldName = 'n_words'
+            nSentsFieldName = 'n_sents'
+        else:
+            nWordsFieldName = 'n_words_' + self.settings.languages[langID]
+            nSentsFieldName = 'n_sents_' + self.settings.languages[langID]
+        esQuery = {
+            'query': innerQuery,
+            'size': 0,
+            'aggs': {
+                'metafield': {
+                    'terms': {
+                        'field': queryFieldName,
+                        'size': maxBuckets
+                    },
+                    'aggs': {
+                        'subagg_n_words': {
+                            'sum': {
+                                'field': nWordsFieldName
+                            }
+                        },
+                        'subagg_n_sents': {
+                            'sum': {
+                                'field': nSentsFieldName
+                            }
+                        }
+                    }
+                }
+            }
+        }
+        hits = self.sc.get_docs(esQuery)
+        if 'aggregations' not in hits or 'metafield' not in hits['aggregations']:
+            return {}
+        buckets = []
+        for bucket in hits['aggregations']['metafield']['buckets']:
+            bucketListItem = {'name': bucket['key'],
+                              'n_docs': bucket['doc_count'],
+                              'n_words': bucket['subagg_n_words']['value']}
+            buckets.append(bucketListItem)
+        if not fieldName.startswith(('year', 'byear', 'birth_year')):
+            buckets.sort(key=lambda b: (-b['n_words'], -b['n_docs'], b['name']))
+        else:
+            buckets.sort(key=lambda b: b['name'])
+        if len(buckets) > 25 and not fieldName.startswith('year'):
+            bucketsFirst = buckets[:25]
+            lastBucket = {'name': '>>', 'n_docs': 0, 'n_words': 0}
+            for i in range(25, len(buckets)):
+                lastBucket['n_docs'] += buckets[i]['n_docs']
+                lastBucket['n_words'] += buckets[i]['n_words']
+            bucketsFirst.append(lastBucket)
+            buckets = bucketsFirst
+        return buckets
+
+    def sent_metafield_buckets(self, fieldName, langID=-1, docIDs=None, maxBuckets=300):
+        """
+        Group all sentences into buckets, each corresponding to one
+        of the unique values for the fieldName metafield. Consider
+        only top maxBuckets field values (in terms of document count).
+        If langID is provided, count only data for a particular language.
+        Return a dictionary with the values and corresponding sentence/word
+        count.
+        """
+        if fieldName not in self.settings.search_meta['stat_options'] or langID >= len(self.settings.languages) > 1:
+            return {}
+        key = fieldName + '|' + str(langID)
+        if docIDs is None and maxBuckets == 300 and key in self.sent_buckets:
+            return copy.deepcopy(self.sent_buckets[key])
+        if langID >= 0:
+            innerQuery = {'match': {'lang': langID}}
+        else:
+            innerQuery = {'match_all': {}}
+        if docIDs is not None:
+            innerQuery = {'filter': {'bool': {'must': [{'terms': {'d_id': docIDs}}]}}}
+        # if not fieldName.startswith('year'):
+        #     queryFieldName = fieldName + '_kw'
+        # else:
+        #     queryFieldName = fieldName
+        if not fieldName.startswith('meta.'):
+            queryFieldName = 'meta.' + fieldName
+        else:
+            queryFieldName = fieldName
+        if not queryFieldName.startswith('meta.year'):
+            queryFieldName += '_kw'
+        esQuery = {
+            'query': innerQuery,
+            'size': 0,
+            'aggs': {
+                'metafield': {
+                    'terms': {
+                        'field': queryFieldName,
+                        'size': maxBuckets
+                    },
+                    'aggs': {
+                        'subagg_n_words': {
+                            'sum': {
+                                'field': 'n_words'
+                            }
+                        }
+                    }
+                }
+            }
+        }
+        hits = self.sc.get_sentences(esQuery)
+        if 'aggregations' not in hits or 'metafield' not in hits['aggregations']:
+            return {}
+        buckets = []
+        for bucket in hits['aggregations']['metafield']['buckets']:
+            bucketListItem = {
+                'name': bucket['key'],
+                'n_sents': bucket['doc_count'],
+                'n_words': bucket['subagg_n_words']['value']
+            }
+            buckets.append(bucketListItem)
+        if not fieldName.startswith(('year', 'byear', 'birth_year')):
+            buckets.sort(key=lambda b: (-b['n_words'], -b['n_sents'], b['name']))
+        else:
+            buckets.sort(key=lambda b: b['name'])
+        if len(buckets) > 25 and not fieldName.startswith('year'):
+            bucketsFirst = buckets[:25]
+            lastBucket = {'name': '>>', 'n_sents': 0, 'n_words': 0}
+            for i in range(25, len(buckets)):
+                lastBucket['n_sents'] += buckets[i]['n_sents']
+                lastBucket['n_words'] += buckets[i]['n_words']
+            bucketsFirst.append(lastBucket)
+            buckets = bucketsFirst
+        return buckets
@@ -0,0 +1,207 @@
+"""
+Compact storage for the frequencies of words and lemmata in each
+document, which can be used instead of the word_freq documents in
+the words index (see word_freq_storage in corpus.json).
+The frequencies of the words and those of the lemmata are stored in
+two files (words.docfreq and lemmata.docfreq) in compressed sparse
+row format: the row of an item contains the IDs of the documents
+where it occurs, sorted, and its frequencies in these documents.
+Each indexation writes the files to a new subdirectory named after
+the words index they belong to. The indexator writes the name of
+the subdirectory to the file named current when the indexes are
+switched, so that the corpus app never uses files that do not
+match the indexes it searches.
+
+File layout (in the byte order of the machine where the files
+were written):
+    magic (8 bytes), number of rows N, number of (document, frequency)
+    pairs M (unsigned 64-bit integers);
+    N start offsets and N end offsets of the rows (unsigned 64-bit);
+    M document IDs (unsigned 32-bit);
+    M frequencies (unsigned 32-bit).
+The row of an item is its integer ID (without the w/l prefix).
+"""
+
+import os
+import mmap
+import array
+import bisect
+import shutil
+import struct
+import threading
+
+
+class DocFreqMatrix:
+    """
+    Reads the frequencies of words and lemmata in the documents
+    from the files written by DocFreqMatrixWriter. The files are
+    memory-mapped and opened again if the indexator switches to
+    a new version.
+    """
+    MAGIC = b'TSAKDF01'
+    HEADER = struct.Struct('=8sQQ')
+    FILENAMES = {'w': 'words.docfreq', 'l': 'lemmata.docfreq'}
+    CURRENT = 'current'
+
+    def __init__(self, dirname):
+        self.dirname = dirname
+        self.current = (None, dirname)      # (mtime of the pointer file, directory of the current version)
+        self.matrices = {}      # item type (w/l) -> (file name, file, mmap, starts, ends, document IDs, frequencies)
+        self.lock = threading.Lock()
+
+    def current_dir(self):
+        """
+        Return the directory where the current version of the files
+        is stored. If there is no pointer file, the files are looked
+        for in the main directory (where the indexator used to put them).
+        """
+        fnamePointer = os.path.join(self.dirname, self.CURRENT)
+        try:
+            mtime = os.stat(fnamePointer).st_mtime_ns
+        except FileNotFoundError:
+            return self.dirname
+        current = self.current
+        if current[0] == mtime:
+            return current[1]
+        with open(fnamePointer, 'r', encoding='utf-8') as fIn:
+            version = fIn.read().strip()
+        current = (mtime, os.path.join(self.dirname, version))
+        self.current = current
+        return current[1]
+
+    def open_matrix(self, itemType):
+        """
+        Return the data of the matrix for words (itemType == 'w') or
+        lemmata (itemType == 'l'), opening the file if it has not
+        been opened yet or a new version has become current since.
+        Return None if there is no such file.
+        """
+        fname = os.path.join(self.current_dir(), self.FILENAMES[itemType])
+        matrix = self.matrices.get(itemType)
+        if matrix is not None and matrix[0] == fname:
+            return matrix
+        with self.lock:
+            if itemType in self.matrices and self.matrices[itemType][0] == fname:
+                return self.matrices[itemType]
+            try:
+                fIn = open(fname, 'rb')
+            except FileNotFoundError:
+                return None
+            mm = mmap.mmap(fIn.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, nRows, nPairs = self.HEADER.unpack(mm[:self.HEADER.size])
+            if magic != self.MAGIC:
+                mm.close()
+                fIn.close()
+                raise ValueError(fname + ' is not a document frequency file.')
+            mv = memoryview(mm)
+            pos = self.HEADER.size
+            starts = mv[pos:pos + 8 * nRows].cast('Q')
+            pos += 8 * nRows
+            ends = mv[pos:pos + 8 * nRows].cast('Q')
+            pos += 8 * nRows
+            docIDs = mv[pos:pos + 4 * nPairs].cast('I')
+            pos += 4 * nPairs
+            freqs = mv[pos:pos + 4 * nPairs].cast('I')
+            # The previous version (if any) is closed when it is garbage
+            # collected, since other threads may still be reading it
+            self.matrices[itemType] = (fname, fIn, mm, starts, ends, docIDs, freqs)
+            return self.matrices[itemType]
+
+    def row(self, itemType, itemID):
+        """
+        Return (document IDs, frequencies) for a word or a lemma.
+        Both are sequences of integers, the document IDs are sorted.
+        """
+        matrix = self.open_matrix(itemType)
+        if matrix is None or itemID >= len(matrix[3]):
+            return (), ()
+        start, end = matrix[3][itemID], matrix[4][itemID]
+        return matrix[5][start:end], matrix[6][start:end]
+
+    def subcorpus_freqs(self, itemType, itemID, docIDsSorted, docIDSet):
+        """
+        Return the list of the documents of a subcorpus where a word
+        or a lemma occurs and its total frequency in these documents.
+        The subcorpus is given both as a sorted list of document IDs
+        and as a set.
+        """
+        rowDocIDs, rowFreqs = self.row(itemType, itemID)
+        docs = []
+        freq = 0
+        if len(docIDsSorted) * 16 < len(rowDocIDs):
+            # Small subcorpus, long row: look up each document
+            for docID in docIDsSorted:
+                i = bisect.bisect_left(rowDocIDs, docID)
+                if i < len(rowDocIDs) and rowDocIDs[i] == docID:
+                    docs.append(docID)
+                    freq += rowFreqs[i]
+        else:
+            for i in range(len(rowDocIDs)):
+                if rowDocIDs[i] in docIDSet:
+                    docs.append(rowDocIDs[i])
+                    freq += rowFreqs[i]
+        return docs, freq
+
+
+class DocFreqMatrixWriter:
+    """
+    Writes the frequencies of words or lemmata in the documents
+    to a file read by DocFreqMatrix. The rows can be added in any
+    order; the pairs are kept in temporary files until finish()
+    is called.
+    """
+    BUFFER_SIZE = 1000000
+
+    def __init__(self, fname):
+        self.fname = fname
+        dirname = os.path.dirname(fname)
+        if len(dirname) > 0 and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        self.starts = array.array('Q')
+        self.ends = array.array('Q')
+        self.nPairs = 0
+        self.docIDs = array.array('I')
+        self.freqs = array.array('I')
+        self.fDocIDs = open(fname + '.docs.tmp', 'wb')
+        self.fFreqs = open(fname + '.freqs.tmp', 'wb')
+
+    def add_row(self, itemID, docFreqs):
+        """
+        Add the row of a word or a lemma. docFreqs is a list of
+        (document ID, frequency, ...) tuples sorted by document ID.
+        """
+        if itemID >= len(self.starts):
+            self.starts.extend([0] * (itemID + 1 - len(self.starts)))
+            self.ends.extend([0] * (itemID + 1 - len(self.ends)))
+        self.starts[itemID] = self.nPairs
+        for docFreq in docFreqs:
+            self.docIDs.append(docFreq[0])
+            self.freqs.append(docFreq[1])
+        self.nPairs += len(docFreqs)
+        self.ends[itemID] = self.nPairs
+        if len(self.docIDs) >= self.BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        self.docIDs.tofile(self.fDocIDs)
+        self.freqs.tofile(self.fFreqs)
+        self.docIDs = array.array('I')
+        self.freqs = array.array('I')
+
+    def finish(self):
+        """
+        Write the file and remove the temporary files.
+        """
+        self.flush()
+        self.fDocIDs.close()
+        self.fFreqs.close()
+        # The file only gets its name when it is complete
+        with open(self.fname + '.tmp', 'wb') as fOut:
+            fOut.write(DocFreqMatrix.HEADER.pack(DocFreqMatrix.MAGIC, len(self.starts), self.nPairs))
+            self.starts.tofile(fOut)
+            self.ends.tofile(fOut)
+            for fnameTmp in [self.fname + '.docs.tmp', self.fname + '.freqs.tmp']:
+                with open(fnameTmp, 'rb') as fIn:
+                    shutil.copyfileobj(fIn, fOut)
+                os.remove(fnameTmp)
+        os.replace(self.fname + '.tmp', self.fname)
@@ -0,0 +1,181 @@
+"""
+Compact storage for the full-text views of the documents.
+Each document is stored in one file that starts with a table
+of row offsets, so that one page of a long text can be read
+without loading the rest of it.
+
+File layout (all integers are unsigned 64-bit little-endian):
+    magic (8 bytes), number of rows N, length of the metadata in bytes;
+    N + 1 offsets of the rows, relative to the start of the first row;
+    metadata (UTF-8 JSON);
+    rows (UTF-8 HTML strings, one after another).
+
+Full-text views written as JSON by older versions of the indexator
+can still be read. They can be converted to the new format with
+    python3 fulltext_store.py ../corpus_html/%corpus_name%
+"""
+
+import os
+import re
+import json
+import struct
+import argparse
+import threading
+import collections
+
+
+class FulltextStore:
+    """
+    Reads pages of the full-text views stored in one directory
+    and keeps recently requested pages in an LRU cache.
+    """
+    EXTENSION = '.fulltext'
+    MAGIC = b'TSAKFT01'
+    HEADER = struct.Struct('<8sQQ')
+
+    def __init__(self, dirname, cacheSize=256):
+        self.dirname = dirname
+        self.cacheSize = cacheSize      # maximal number of pages in the cache
+        self.cache = collections.OrderedDict()   # (doc name, page, page size) -> (mtime, page data)
+        self.lock = threading.Lock()
+
+    @classmethod
+    def write(cls, fname, meta, rows):
+        """
+        Store the metadata and the rows (HTML strings) of one
+        document in fname.
+        """
+        metaBytes = json.dumps(meta, ensure_ascii=False).encode('utf-8')
+        rowsBytes = [row.encode('utf-8') for row in rows]
+        offsets = [0]
+        for row in rowsBytes:
+            offsets.append(offsets[-1] + len(row))
+        dirname = os.path.dirname(fname)
+        if len(dirname) > 0 and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        # The web app may be reading the previous version of the file
+        with open(fname + '.tmp', 'wb') as fOut:
+            fOut.write(cls.HEADER.pack(cls.MAGIC, len(rows), len(metaBytes)))
+            fOut.write(struct.pack('<' + str(len(offsets)) + 'Q', *offsets))
+            fOut.write(metaBytes)
+            for row in rowsBytes:
+                fOut.write(row)
+        os.replace(fname + '.tmp', fname)
+
+    @classmethod
+    def read_page(cls, fname, page, pageSize):
+        """
+        Read the metadata and one page of rows from fname.
+        page is zero-based; it is reduced to the number of the last
+        page if it is too large. Return a dictionary with the
+        metadata, the rows, the page number and the number of rows.
+        """
+        with open(fname, 'rb') as fIn:
+            magic, nRows, metaLength = cls.HEADER.unpack(fIn.read(cls.HEADER.size))
+            if magic != cls.MAGIC:
+                raise ValueError(fname + ' is not a full-text view file.')
+            page = max(0, min(page, nRows // pageSize))
+            iStart = min(page * pageSize, nRows)
+            iEnd = min(iStart + pageSize, nRows)
+            offsetsStart = cls.HEADER.size
+            rowsStart = offsetsStart + 8 * (nRows + 1) + metaLength
+            fIn.seek(offsetsStart + 8 * iStart)
+            offsets = struct.unpack('<' + str(iEnd - iStart + 1) + 'Q',
+                                    fIn.read(8 * (iEnd - iStart + 1)))
+            fIn.seek(offsetsStart + 8 * (nRows + 1))
+            meta = json.loads(fIn.read(metaLength).decode('utf-8'))
+            fIn.seek(rowsStart + offsets[0])
+            rowsBytes = fIn.read(offsets[-1] - offsets[0])
+        rows = [rowsBytes[offsets[i] - offsets[0]:offsets[i + 1] - offsets[0]].decode('utf-8')
+                for i in range(len(offsets) - 1)]
+        return {
+            'meta': meta,
+            'rows': rows,
+            'page': page,
+            'n_rows': nRows
+        }
+
+    @staticmethod
+    def read_json_page(fname, page, pageSize):
+        """
+        Same as read_page(), but for a view stored in JSON.
+        """
+        with open(fname, 'r', encoding='utf-8') as fIn:
+            data = json.load(fIn)
+        nRows = len(data['rows'])
+        page = max(0, min(page, nRows // pageSize))
+        return {
+            'meta': data['meta'],
+            'rows': data['rows'][page * pageSize:(page + 1) * pageSize],
+            'page': page,
+            'n_rows': nRows
+        }
+
+    def get_page(self, docName, page, pageSize):
+        """
+        Return one page of the view of the document docName (see
+        read_page()), or None if there is no such document.
+        The returned data must not be changed, since it is cached.
+        """
+        fname = os.path.join(self.dirname, docName + self.EXTENSION)
+        bJson = False
+        try:
+            mtime = os.stat(fname).st_mtime_ns
+        except FileNotFoundError:
+            # Not converted yet
+            fname = os.path.join(self.dirname, docName + '.json')
+            bJson = True
+            try:
+                mtime = os.stat(fname).st_mtime_ns
+            except FileNotFoundError:
+                return None
+        key = (docName, page, pageSize)
+        with self.lock:
+            if key in self.cache and self.cache[key][0] == mtime:
+                self.cache.move_to_end(key)
+                return self.cache[key][1]
+        try:
+            if bJson:
+                data = self.read_json_page(fname, page, pageSize)
+            else:
+                data = self.read_page(fname, page, pageSize)
+        except FileNotFoundError:
+            return None
+        if self.cacheSize > 0:
+            with self.lock:
+                self.cache[key] = (mtime, data)
+                self.cache.move_to_end(key)
+                while len(self.cache) > self.cacheSize:
+                    self.cache.popitem(last=False)
+        return data
+
+    @classmethod
+    def convert_json(cls, fnameJson, removeJson=False):
+        """
+        Convert a view stored in JSON to the new format.
+        Return the name of the new file.
+        """
+        with open(fnameJson, 'r', encoding='utf-8') as fIn:
+            data = json.load(fIn)
+        fname = re.sub('\\.json$', '', fnameJson) + cls.EXTENSION
+        cls.write(fname, data['meta'], data['rows'])
+        if removeJson:
+            os.remove(fnameJson)
+        return fname
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert full-text views stored in JSON '
+                                                 'to the paged format read by the corpus app.')
+    parser.add_argument('dirname', help='directory with the views of one corpus, '
+                                        'e.g. ../corpus_html/%%corpus_name%%')
+    parser.add_argument('--remove-json', action='store_true',
+                        help='delete the JSON files after conversion')
+    args = parser.parse_args()
+    nConverted = 0
+    for root, dirs, files in os.walk(args.dirname):
+        for fname in files:
+            if fname.lower().endswith('.json'):
+                FulltextStore.convert_json(os.path.join(root, fname), removeJson=args.remove_json)
+                nConverted += 1
+    print(nConverted, 'files converted.')
@@ -1224,9 +1224,10 @@ class SentenceViewer:
             elif sortOrder == 'lemma' and searchType == 'word':
                 hitsProcessedAll['words'].sort(key=lambda w: w['_source']['lemma'])
         processedWords = []
-        for i in range(startFrom, min(len(hitsProcessedAll['words']), startFrom + pageSize)):
-            word = hitsProcessedAll['words'][i]
-            wordSource = self.sc.get_word_by_id(word['w_id'])['hits']['hits'][0]['_source']
+        pageWords = hitsProcessedAll['words'][startFrom:startFrom + pageSize]
+        wordHits = self.sc.get_words_by_ids([word['w_id'] for word in pageWords])
+        for word in pageWords:
+            wordSource = wordHits[str(word['w_id'])]['_source']
             wordSource.update(word['_source'])
             word['_source'] = wordSource
             processedWords.append(self.process_word(word, lang=self.settings.languages[word['_source']['lang']],
@@ -1438,6 +1439,8 @@ class SentenceViewer:
         lemmata, as well as for any objects searched in a subcorpus.
         """
         result = {'n_occurrences': 0, 'n_sentences': 0, 'n_docs': 0, 'message': 'Nothing found.'}
+        if 'timed_out' in response and response['timed_out']:
+            result['timeout'] = True
         if ('aggregations' not in response
                 or 'agg_freq' not in response['aggregations']
                 or 'value' not in response['aggregations']['agg_freq']
@@ -1453,6 +1456,11 @@ class SentenceViewer:
         result['total_freq'] = response['aggregations']['agg_freq']['value']
         result['words'] = []
         # print(response['aggregations']['agg_group_by_word']['buckets'])
+        if subcorpus:
+            wordIDs = [bucket['key'] for bucket in response['aggregations']['agg_group_by_word']['buckets']]
+        else:
+            wordIDs = [bucket['key']['l_id'] for bucket in response['aggregations']['agg_group_by_word']['buckets']]
+        wordHits = self.sc.get_words_by_ids(wordIDs)
         for iHit in range(len(response['aggregations']['agg_group_by_word']['buckets'])):
             if subcorpus:
                 wordID = response['aggregations']['agg_group_by_word']['buckets'][iHit]['key']
@@ -1470,9 +1478,9 @@ class SentenceViewer:
                 wordFreq = response['aggregations']['agg_group_by_word']['buckets'][iHit]['subagg_freq']['value']
             except KeyError:
                 wordFreq = None
-            hit = self.sc.get_word_by_id(wordID)
-            langID, lang = self.get_lang_from_hit(hit['hits']['hits'][0])
-            result['words'].append(self.process_word_buckets(hit['hits']['hits'][0],
+            hit = wordHits[str(wordID)]
+            langID, lang = self.get_lang_from_hit(hit)
+            result['words'].append(self.process_word_buckets(hit,
                                                              nDocuments=docCount,
                                                              nForms=nForms,
                                                              freq=wordFreq,
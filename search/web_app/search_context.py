@@ -26,6 +26,7 @@ class SearchContext:
         self.processed_words = []  # List of word hits taken from sentences when looking for
                                    # word/lemma in multi-word search
         self.after_key = None      # ID of the last retrieved word/lemma bucket for pagination
+        self.context_sentences = {}   # sentence ID -> ES hit for sentences retrieved when expanding the context
 
     def flush(self):
         """
@@ -36,6 +37,7 @@ class SearchContext:
         self.sentence_data = {}
         self.processed_words = []
         self.after_key = None
+        self.context_sentences = {}
 
     def add_sent_data_for_session(self, sent, sentData):
         """
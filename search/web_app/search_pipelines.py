@@ -8,36 +8,57 @@ processing the hits using response_processors.
 import copy
 import math
 import time
+import threading
 from flask import request
-from . import sc, sentView, settings, MIN_TOTAL_FREQ_WORD_QUERY, rxIndexAtEnd
+from . import sc, sentView, corpusStats, subcorpusCache, settings, MIN_TOTAL_FREQ_WORD_QUERY, rxIndexAtEnd
 from .session_management import set_session_data, get_session_data, get_locale, change_display_options, cur_search_context
 from .auxiliary_functions import jsonp, gzipped, nocache, lang_sorting_key, copy_request_args,\
     wilson_confidence_interval, distance_constraints_too_complex, log_query
 
 
-def find_parallel_for_one_sent(sSource):
+def find_parallel_for_sents(hits):
     """
     Retrieve all sentences in other languages which are aligned
-    with the given sentence. Return the search results in JSON.
+    with the sentences in hits, with one request for all of them.
+    Return a list with the aligned sentences (ES hits) for each hit.
     """
-    sids = set()
-    for pa in sSource['para_alignment']:
-        sids |= set(pa['sent_ids'])
-    sids = list(sid for sid in sorted(sids))
-    query = {'query': {'ids': {'values': sids}}}
-    paraSentHits = sc.get_sentences(query)
-    if 'hits' in paraSentHits and 'hits' in paraSentHits['hits']:
-        return paraSentHits['hits']['hits']
-    return []
+    sidsByHit = []
+    allSids = set()
+    for hit in hits:
+        sids = set()
+        if 'para_alignment' in hit['_source']:
+            for pa in hit['_source']['para_alignment']:
+                sids |= set(pa['sent_ids'])
+        sidsByHit.append(sorted(sids))
+        allSids |= sids
+    paraSents = {}
+    for s in sc.get_sentences_by_ids(sorted(allSids)):
+        paraSents[s['_id']] = s
+    paraSentsByHit = []
+    usedSids = set()
+    for sids in sidsByHit:
+        curParaSents = []
+        for sid in sids:
+            if str(sid) not in paraSents:
+                continue
+            if str(sid) in usedSids:
+                # The same sentence is aligned with several hits;
+                # each of them gets its own copy
+                curParaSents.append(copy.deepcopy(paraSents[str(sid)]))
+            else:
+                curParaSents.append(paraSents[str(sid)])
+                usedSids.add(str(sid))
+        paraSentsByHit.append(curParaSents)
+    return paraSentsByHit
 
 
-def get_parallel_for_one_sent_html(sSource, numHit):
+def get_parallel_html(paraSents, numHit):
     """
     Iterate over HTML strings with sentences in other languages
-    aligned with the given sentence.
+    (paraSents) aligned with the hit number numHit.
     """
     curSearchContext = cur_search_context()
-    for s in find_parallel_for_one_sent(sSource):
+    for s in paraSents:
         curSearchContext.last_sent_num += 1
         curSearchContext.add_sent_data_for_session(s, curSearchContext.sentence_data[numHit])
         langID = s['_source']['lang']
@@ -60,11 +81,11 @@ def add_parallel(hits, htmlResponse):
     search results to the response.
     """
     addLanguages = set()
+    paraSentsByHit = find_parallel_for_sents(hits)
     for iHit in range(len(hits)):
-        if ('para_alignment' not in hits[iHit]['_source']
-                or len(hits[iHit]['_source']['para_alignment']) <= 0):
+        if len(paraSentsByHit[iHit]) <= 0:
             continue
-        for sentHTML, lang in get_parallel_for_one_sent_html(hits[iHit]['_source'], iHit):
+        for sentHTML, lang in get_parallel_html(paraSentsByHit[iHit], iHit):
             try:
                 htmlResponse['contexts'][iHit]['languages'][lang]['text'] += ' ' + sentHTML
             except KeyError:
@@ -83,73 +104,10 @@ def add_parallel(hits, htmlResponse):
 def get_buckets_for_doc_metafield(fieldName, langID=-1, docIDs=None, maxBuckets=300):
     """
     Group all documents into buckets, each corresponding to one
-    of the unique values for the fieldName metafield. Consider
-    only top maxBuckets field values (in terms of document count).
-    If langID is provided, count only data for a particular language.
-    Return a dictionary with the values and corresponding document
-    count.
+    of the unique values for the fieldName metafield
+    (see CorpusStats.doc_metafield_buckets()).
     """
-    if fieldName not in settings.search_meta['stat_options'] or langID >= len(settings.languages) > 1:
-        return {}
-    innerQuery = {'match_all': {}}
-    if docIDs is not None:
-        innerQuery = {'ids': {'values': list(docIDs)}}
-    if not fieldName.startswith('year'):
-        queryFieldName = fieldName + '_kw'
-    else:
-        queryFieldName = fieldName
-    if len(settings.languages) == 1 or langID < 0:
-        nWordsFieldName = 'n_words'
-        nSentsFieldName = 'n_sents'
-    else:
-        nWordsFieldName = 'n_words_' + settings.languages[langID]
-        nSentsFieldName = 'n_sents_' + settings.languages[langID]
-    esQuery = {
-        'query': innerQuery,
-        'size': 0,
-        'aggs': {
-            'metafield': {
-                'terms': {
-                    'field': queryFieldName,
-                    'size': maxBuckets
-                },
-                'aggs': {
-                    'subagg_n_words': {
-                        'sum': {
-                            'field': nWordsFieldName
-                        }
-                    },
-                    'subagg_n_sents': {
-                        'sum': {
-                            'field': nSentsFieldName
-                        }
-                    }
-                }
-            }
-        }
-    }
-    hits = sc.get_docs(esQuery)
-    if 'aggregations' not in hits or 'metafield' not in hits['aggregations']:
-        return {}
-    buckets = []
-    for bucket in hits['aggregations']['metafield']['buckets']:
-        bucketListItem = {'name': bucket['key'],
-                          'n_docs': bucket['doc_count'],
-                          'n_words': bucket['subagg_n_words']['value']}
-        buckets.append(bucketListItem)
-    if not fieldName.startswith(('year', 'byear', 'birth_year')):
-        buckets.sort(key=lambda b: (-b['n_words'], -b['n_docs'], b['name']))
-    else:
-        buckets.sort(key=lambda b: b['name'])
-    if len(buckets) > 25 and not fieldName.startswith('year'):
-        bucketsFirst = buckets[:25]
-        lastBucket = {'name': '>>', 'n_docs': 0, 'n_words': 0}
-        for i in range(25, len(buckets)):
-            lastBucket['n_docs'] += buckets[i]['n_docs']
-            lastBucket['n_words'] += buckets[i]['n_words']
-        bucketsFirst.append(lastBucket)
-        buckets = bucketsFirst
-    return buckets
+    return corpusStats.doc_metafield_buckets(fieldName, langID=langID, docIDs=docIDs, maxBuckets=maxBuckets)
 
 
 def suggest_metafield(fieldName, query):
@@ -276,73 +234,78 @@ def suggest_word(lang, fieldName, query):
 def get_buckets_for_sent_metafield(fieldName, langID=-1, docIDs=None, maxBuckets=300):
     """
     Group all sentences into buckets, each corresponding to one
-    of the unique values for the fieldName metafield. Consider
-    only top maxBuckets field values (in terms of document count).
-    If langID is provided, count only data for a particular language.
-    Return a dictionary with the values and corresponding sentence/word
-    count.
+    of the unique values for the fieldName metafield
+    (see CorpusStats.sent_metafield_buckets()).
     """
-    if fieldName not in settings.search_meta['stat_options'] or langID >= len(settings.languages) > 1:
-        return {}
-    if langID >= 0:
-        innerQuery = {'match': {'lang': langID}}
-    else:
-        innerQuery = {'match_all': {}}
+    return corpusStats.sent_metafield_buckets(fieldName, langID=langID, docIDs=docIDs, maxBuckets=maxBuckets)
+
+
+def word_html_query(htmlQuery, iWord, searchType):
+    """
+    Return a copy of htmlQuery that only contains the query word
+    number iWord (in the first position), unless searchType == 'context'.
+    """
+    if searchType == 'context':
+        return copy.deepcopy(htmlQuery)
+    wordHtmlQuery = sc.qp.swap_query_words(1, iWord, copy.deepcopy(htmlQuery))
+    wordHtmlQuery = sc.qp.remove_non_first_words(wordHtmlQuery)
+    wordHtmlQuery['lang1'] = htmlQuery['lang1']
+    wordHtmlQuery['n_words'] = 1
+    return wordHtmlQuery
+
+
+def get_word_buckets_by_docs(searchType, queryFieldName, nWordsProcess, htmlQuery,
+                             docIDs, buckets):
+    """
+    Calculate the distribution of words or lemmata over the values
+    of a document-level metafield (see get_word_buckets()) in one pass:
+    find the frequencies of the query word in all documents and
+    then group them by the values of the metafield.
+    """
+    docValues = corpusStats.doc_metafield_values(queryFieldName)
     if docIDs is not None:
-        innerQuery = {'filter': {'bool': {'must': [{'terms': {'d_id': docIDs}}]}}}
-    # if not fieldName.startswith('year'):
-    #     queryFieldName = fieldName + '_kw'
-    # else:
-    #     queryFieldName = fieldName
-    if not fieldName.startswith('meta.'):
-        queryFieldName = 'meta.' + fieldName
-    else:
-        queryFieldName = fieldName
-    if not queryFieldName.startswith('meta.year'):
-        queryFieldName += '_kw'
-    esQuery = {
-        'query': innerQuery,
-        'size': 0,
-        'aggs': {
-            'metafield': {
-                'terms': {
-                    'field': queryFieldName,
-                    'size': maxBuckets
-                },
-                'aggs': {
-                    'subagg_n_words': {
-                        'sum': {
-                            'field': 'n_words'
-                        }
-                    }
-                }
-            }
-        }
-    }
-    hits = sc.get_sentences(esQuery)
-    if 'aggregations' not in hits or 'metafield' not in hits['aggregations']:
-        return {}
-    buckets = []
-    for bucket in hits['aggregations']['metafield']['buckets']:
-        bucketListItem = {
-            'name': bucket['key'],
-            'n_sents': bucket['doc_count'],
-            'n_words': bucket['subagg_n_words']['value']
-        }
-        buckets.append(bucketListItem)
-    if not fieldName.startswith(('year', 'byear', 'birth_year')):
-        buckets.sort(key=lambda b: (-b['n_words'], -b['n_sents'], b['name']))
-    else:
-        buckets.sort(key=lambda b: b['name'])
-    if len(buckets) > 25 and not fieldName.startswith('year'):
-        bucketsFirst = buckets[:25]
-        lastBucket = {'name': '>>', 'n_sents': 0, 'n_words': 0}
-        for i in range(25, len(buckets)):
-            lastBucket['n_sents'] += buckets[i]['n_sents']
-            lastBucket['n_words'] += buckets[i]['n_words']
-        bucketsFirst.append(lastBucket)
-        buckets = bucketsFirst
-    return buckets
+        docIDs = set(int(docID) for docID in docIDs)
+    results = []
+    for iWord in range(1, nWordsProcess + 1):
+        wordHtmlQuery = word_html_query(htmlQuery, iWord, searchType)
+        wordHtmlQuery.pop('doc_ids', None)
+        query = sc.qp.html2es(wordHtmlQuery,
+                              searchOutput='words',
+                              groupBy='word',
+                              sortOrder='no',
+                              query_size=1,
+                              highlight=False)
+        valueFreqs = {}     # metafield value -> [frequency, number of documents]
+        docFreqs, timedOut = sc.get_word_doc_freqs(query)
+        for docID, freq in docFreqs.items():
+            if docIDs is not None and docID not in docIDs:
+                continue
+            for value in docValues.get(docID, []):
+                if value not in valueFreqs:
+                    valueFreqs[value] = [0, 0]
+                valueFreqs[value][0] += freq
+                valueFreqs[value][1] += 1
+        curWordBuckets = []
+        for bucket in buckets:
+            if bucket['name'] == '>>':
+                continue
+            newBucket = copy.deepcopy(bucket)
+            curWordBuckets.append(newBucket)
+            if timedOut:
+                # Only some of the words found by the query were counted
+                newBucket['timeout'] = True
+            if newBucket['n_words'] <= 0:
+                newBucket['n_words_conf_int'] = [0.0, 0.0]
+                continue
+            freq, nDocs = valueFreqs.get(str(bucket['name']), [0, 0])
+            successRate = freq / newBucket['n_words']
+            newBucket['n_words_conf_int'] = wilson_confidence_interval(successRate,
+                                                                       newBucket['n_words'],
+                                                                       1000000)
+            newBucket['n_words'] = successRate * 1000000
+            newBucket['n_sents'] = nDocs / newBucket['n_docs'] * 100
+        results.append(curWordBuckets)
+    return results
 
 
 def get_word_buckets(searchType, metaField, nWords, htmlQuery,
@@ -365,12 +328,19 @@ def get_word_buckets(searchType, metaField, nWords, htmlQuery,
         buckets = get_buckets_for_sent_metafield(metaField, langID=langID, docIDs=docIDs)
     else:
         buckets = get_buckets_for_doc_metafield(metaField, langID=langID, docIDs=docIDs)
-    results = []
     if searchType == 'context':
         nWordsProcess = 1
     else:
         nWordsProcess = nWords
+    if searchIndex == 'words' and not bSentenceLevel:
+        return get_word_buckets_by_docs(searchType, queryFieldName, nWordsProcess, htmlQuery,
+                                        docIDs, buckets)
+    bucketDocIDs = {}       # bucket name -> IDs of the documents in the bucket
+    results = []
+    queries = []            # ES queries for all words and buckets, sent in batches
+    queryBuckets = []       # bucket objects corresponding to these queries
     for iWord in range(1, nWordsProcess + 1):
+        wordHtmlQuery = word_html_query(htmlQuery, iWord, searchType)
         curWordBuckets = []
         for bucket in buckets:
             # if (bucket['name'] == '>>'
@@ -379,85 +349,94 @@ def get_word_buckets(searchType, metaField, nWords, htmlQuery,
             if bucket['name'] == '>>':
                 continue
             newBucket = copy.deepcopy(bucket)
-            if searchType == 'context':
-                curHtmlQuery = copy.deepcopy(htmlQuery)
-            else:
-                curHtmlQuery = sc.qp.swap_query_words(1, iWord, copy.deepcopy(htmlQuery))
-                curHtmlQuery = sc.qp.remove_non_first_words(curHtmlQuery)
-                curHtmlQuery['lang1'] = htmlQuery['lang1']
-                curHtmlQuery['n_words'] = 1
+            curWordBuckets.append(newBucket)
+            if newBucket['n_words'] <= 0:
+                newBucket['n_words_conf_int'] = [0.0, 0.0]
+                continue
+            if searchIndex not in ('words', 'sentences'):
+                continue
+            # Only the top-level values are changed, so a shallow copy is enough
+            curHtmlQuery = dict(wordHtmlQuery)
             # if metaField not in curHtmlQuery or len(curHtmlQuery[metaField]) <= 0:
             curHtmlQuery[queryFieldName] = bucket['name']
             # elif type(curHtmlQuery[metaField]) == str:
             #     curHtmlQuery[metaField] += ',' + bucket['name']
             if not bSentenceLevel:
-                curHtmlQuery['doc_ids'] = subcorpus_ids(curHtmlQuery)
-            query = sc.qp.html2es(curHtmlQuery,
-                                  searchOutput=searchIndex,
-                                  groupBy='word',
-                                  sortOrder='no',
-                                  query_size=1,
-                                  distances=queryWordConstraints,
-                                  highlight=False)
-            if searchIndex == 'words' and newBucket['n_words'] > 0:
-                hits = sc.get_words(query)
-                if ('aggregations' not in hits
-                    or 'agg_freq' not in hits['aggregations']
-                    or 'agg_ndocs' not in hits['aggregations']
-                    or hits['aggregations']['agg_ndocs']['value'] is None):
-                        # or (hits['aggregations']['agg_ndocs']['value'] <= 0
-                        #     and not metaField.startswith('year'))):
-                        continue
-                successRate = hits['aggregations']['agg_freq']['value'] / newBucket['n_words']
-                newBucket['n_words_conf_int'] = wilson_confidence_interval(successRate,
-                                                                           newBucket['n_words'],
-                                                                           1000000)
-                newBucket['n_words'] = successRate * 1000000
-                newBucket['n_sents'] = hits['aggregations']['agg_ndocs']['value'] / newBucket['n_docs'] * 100
-            elif searchIndex == 'sentences' and newBucket['n_words'] > 0:
-                hits = sc.get_sentences(query)
-                if ('aggregations' not in hits
-                    or 'agg_nwords' not in hits['aggregations']
-                    or 'agg_ndocs' not in hits['aggregations']
-                    or hits['aggregations']['agg_ndocs']['value'] is None
-                    or hits['aggregations']['agg_nwords']['sum'] is None):
-                        # or (hits['aggregations']['agg_ndocs']['value'] <= 0
-                        #     and not metaField.startswith('year'))):
-                        continue
-                successRate = hits['aggregations']['agg_nwords']['sum'] / newBucket['n_words']
-                newBucket['n_words_conf_int'] = wilson_confidence_interval(successRate,
-                                                                           newBucket['n_words'],
-                                                                           1000000)
-                newBucket['n_words'] = successRate * 1000000
-                if nWords > 1:
-                    newBucket['n_sents'] = hits['hits']['total']['value']
-                if not bSentenceLevel:
-                    if newBucket['n_docs'] > 0:
-                        newBucket['n_docs'] = hits['aggregations']['agg_ndocs']['value'] / newBucket['n_docs'] * 100
-                else:
-                    if newBucket['n_sents'] > 0:
-                        newBucket['n_sents'] = hits['hits']['total']['value'] / newBucket['n_sents'] * 100
-            elif newBucket['n_words'] <= 0:
-                newBucket['n_words_conf_int'] = [0.0, 0.0]
-            curWordBuckets.append(newBucket)
+                # The documents of a bucket do not depend on the query word
+                if bucket['name'] not in bucketDocIDs:
+                    bucketDocIDs[bucket['name']] = subcorpus_ids(curHtmlQuery)
+                curHtmlQuery['doc_ids'] = bucketDocIDs[bucket['name']]
+            queries.append(sc.qp.html2es(curHtmlQuery,
+                                         searchOutput=searchIndex,
+                                         groupBy='word',
+                                         sortOrder='no',
+                                         query_size=1,
+                                         distances=queryWordConstraints,
+                                         highlight=False))
+            queryBuckets.append(newBucket)
         results.append(curWordBuckets)
+
+    # All bucket queries are sent at once in batched requests
+    if searchIndex == 'words':
+        responses = sc.get_words_multi(queries)
+    else:
+        responses = sc.get_sentences_multi(queries)
+    failedBuckets = set()   # IDs of the bucket objects without a valid response
+    for newBucket, hits in zip(queryBuckets, responses):
+        if searchIndex == 'words':
+            if ('aggregations' not in hits
+                or 'agg_freq' not in hits['aggregations']
+                or 'agg_ndocs' not in hits['aggregations']
+                or hits['aggregations']['agg_ndocs']['value'] is None):
+                    # or (hits['aggregations']['agg_ndocs']['value'] <= 0
+                    #     and not metaField.startswith('year'))):
+                    failedBuckets.add(id(newBucket))
+                    continue
+            successRate = hits['aggregations']['agg_freq']['value'] / newBucket['n_words']
+            newBucket['n_words_conf_int'] = wilson_confidence_interval(successRate,
+                                                                       newBucket['n_words'],
+                                                                       1000000)
+            newBucket['n_words'] = successRate * 1000000
+            newBucket['n_sents'] = hits['aggregations']['agg_ndocs']['value'] / newBucket['n_docs'] * 100
+        else:
+            if ('aggregations' not in hits
+                or 'agg_nwords' not in hits['aggregations']
+                or 'agg_ndocs' not in hits['aggregations']
+                or hits['aggregations']['agg_ndocs']['value'] is None
+                or hits['aggregations']['agg_nwords']['sum'] is None):
+                    # or (hits['aggregations']['agg_ndocs']['value'] <= 0
+                    #     and not metaField.startswith('year'))):
+                    failedBuckets.add(id(newBucket))
+                    continue
+            successRate = hits['aggregations']['agg_nwords']['sum'] / newBucket['n_words']
+            newBucket['n_words_conf_int'] = wilson_confidence_interval(successRate,
+                                                                       newBucket['n_words'],
+                                                                       1000000)
+            newBucket['n_words'] = successRate * 1000000
+            if nWords > 1:
+                newBucket['n_sents'] = hits['hits']['total']['value']
+            if not bSentenceLevel:
+                if newBucket['n_docs'] > 0:
+                    newBucket['n_docs'] = hits['aggregations']['agg_ndocs']['value'] / newBucket['n_docs'] * 100
+            else:
+                if newBucket['n_sents'] > 0:
+                    newBucket['n_sents'] = hits['hits']['total']['value'] / newBucket['n_sents'] * 100
+    if len(failedBuckets) > 0:
+        results = [[b for b in curWordBuckets if id(b) not in failedBuckets]
+                   for curWordBuckets in results]
     return results
 
 
 def subcorpus_ids(htmlQuery):
     """
     Return IDs of the documents specified by the subcorpus selection
-    fields in htmlQuery.
+    fields in htmlQuery. The IDs are taken from the subcorpus cache
+    if the same subcorpus has been requested before.
     """
-    subcorpusQuery = sc.qp.subcorpus_query(htmlQuery, sortOrder='',
-                                           exclude=get_session_data('excluded_doc_ids'))
-    if subcorpusQuery is None or ('query' in subcorpusQuery and subcorpusQuery['query'] == {'match_all': {}}):
+    docIDs = subcorpusCache.doc_ids(htmlQuery, exclude=get_session_data('excluded_doc_ids'))
+    if docIDs is None:
         return None
-    iterator = sc.get_all_docs(subcorpusQuery)
-    docIDs = []
-    for doc in iterator:
-        docIDs.append(doc['_id'])
-    return docIDs
+    return [str(docID) for docID in docIDs]
 
 
 def para_ids(htmlQuery):
@@ -627,6 +606,80 @@ def find_sentences_json(page=0):
     return hits
 
 
+def merge_collected_words(hitsProcessedAll, hitsProcessed):
+    """
+    Add the words collected from one slice of the sentences
+    (see collect_words_from_sentences()) to hitsProcessedAll.
+    """
+    hitsProcessedAll['n_sentences'] += hitsProcessed['n_sentences']
+    hitsProcessedAll['total_freq'] += hitsProcessed['total_freq']
+    hitsProcessedAll['doc_ids'] |= hitsProcessed['doc_ids']
+    for wID, wordData in hitsProcessed['word_ids'].items():
+        if wID not in hitsProcessedAll['word_ids']:
+            hitsProcessedAll['n_occurrences'] += 1
+            hitsProcessedAll['word_ids'][wID] = wordData
+            continue
+        wordDataAll = hitsProcessedAll['word_ids'][wID]
+        wordDataAll['n_occurrences'] += wordData['n_occurrences']
+        wordDataAll['sents'] |= wordData['sents']
+        wordDataAll['docs'] |= wordData['docs']
+        if 'forms' in wordData:
+            wordDataAll['forms'] |= wordData['forms']
+    if 'timeout' in hitsProcessed:
+        hitsProcessedAll['timeout'] = True
+
+
+def collect_words_from_sentences(query, nWords, negWords, searchType, wordConstraints, maxRunTime):
+    """
+    Find all sentences with a multi-word query and collect the words
+    found by its first term (see SentenceViewer.add_word_from_sentence()).
+    If wordConstraints is not None, the sentences are checked against
+    them. The sentences are retrieved in settings.word_search_slices
+    parallel slices, each of which collects the words separately.
+    Stop when maxRunTime has passed, unless too few words have been
+    collected so far.
+    """
+    slicesProcessed = []
+    stopEvent = threading.Event()
+
+    def process_slice(iterator):
+        hitsProcessed = {
+            'n_occurrences': 0,
+            'n_sentences': 0,
+            'n_docs': 0,
+            'total_freq': 0,
+            'words': [],
+            'doc_ids': set(),
+            'word_ids': {}
+        }
+        slicesProcessed.append(hitsProcessed)
+        for hit in iterator:
+            if stopEvent.is_set():
+                hitsProcessed['timeout'] = True
+                break
+            if wordConstraints is not None:
+                if not sc.qp.wr.check_sentence(hit, wordConstraints, nWords=nWords):
+                    continue
+            sentView.add_word_from_sentence(hitsProcessed, hit, nWords=nWords,
+                                            negWords=negWords, searchType=searchType)
+            if (time.time() > maxRunTime
+                    and sum(h['total_freq'] for h in slicesProcessed) >= MIN_TOTAL_FREQ_WORD_QUERY):
+                hitsProcessed['timeout'] = True
+                stopEvent.set()
+                break
+        return hitsProcessed
+
+    hitsProcessedAll = None
+    for hitsProcessed in sc.process_sentence_slices(query, max(settings.word_search_slices, 1),
+                                                    process_slice):
+        if hitsProcessedAll is None:
+            hitsProcessedAll = hitsProcessed
+        else:
+            merge_collected_words(hitsProcessedAll, hitsProcessed)
+    hitsProcessedAll['n_docs'] = len(hitsProcessedAll['doc_ids'])
+    return hitsProcessedAll
+
+
 def find_words_json(searchType='word', page=0):
     """
     Find words/lemmata (either in words/lemmata index or, in the case of
@@ -728,27 +781,10 @@ def find_words_json(searchType='word', page=0):
             # cur_search_context().processed_words contains processed hits
             # if the same query has already been run
 
-            # We will get actual hits in a loop below
-            hitsProcessedAll = {
-                'n_occurrences': 0,
-                'n_sentences': 0,
-                'n_docs': 0,
-                'total_freq': 0,
-                'words': [],
-                'doc_ids': set(),
-                'word_ids': {}
-            }
             # print(query)
-            for hit in sc.get_all_sentences(query):
-                if constraintsTooComplex:
-                    if not sc.qp.wr.check_sentence(hit, wordConstraints, nWords=nWords):
-                        continue
-                sentView.add_word_from_sentence(hitsProcessedAll, hit, nWords=nWords,
-                                                negWords=negWords, searchType=searchType)
-                if hitsProcessedAll['total_freq'] >= MIN_TOTAL_FREQ_WORD_QUERY and time.time() > maxRunTime:
-                    hitsProcessedAll['timeout'] = True
-                    break
-            hitsProcessedAll['n_docs'] = len(hitsProcessedAll['doc_ids'])
+            hitsProcessedAll = collect_words_from_sentences(query, nWords, negWords, searchType,
+                                                            wordConstraints if constraintsTooComplex else None,
+                                                            maxRunTime)
         else:
             hitsProcessedAll = cur_search_context().processed_words
         if hitsProcessedAll['n_docs'] > 0:
@@ -773,6 +809,47 @@ def find_words_json(searchType='word', page=0):
     return hitsProcessed
 
 
+def get_context_sentences(sentIDs, nSteps):
+    """
+    Return a dictionary {sentence ID (string): ES hit} with the sentences
+    whose IDs are listed in sentIDs as (ID, 'next' or 'prev') pairs.
+    The sentences are taken from the current search context if they
+    have been retrieved before. Otherwise, they are retrieved together
+    with up to nSteps - 1 sentences that follow them in the same
+    direction, which are stored in the search context for further
+    expansions. All sentences that are one step further are retrieved
+    with one request.
+    """
+    cachedSents = cur_search_context().context_sentences
+    sentences = {}
+    toRetrieve = []
+    for sentID, side in sentIDs:
+        if sentID is None or int(sentID) < 0:
+            continue
+        if str(sentID) in cachedSents:
+            sentences[str(sentID)] = cachedSents[str(sentID)]
+        else:
+            toRetrieve.append((sentID, side))
+    for iStep in range(nSteps):
+        if len(toRetrieve) <= 0:
+            break
+        for sent in sc.get_sentences_by_ids(sorted(set(sentID for sentID, side in toRetrieve))):
+            cachedSents[sent['_id']] = sent
+            if iStep == 0:
+                sentences[sent['_id']] = sent
+        nextToRetrieve = []
+        for sentID, side in toRetrieve:
+            if str(sentID) not in cachedSents or '_source' not in cachedSents[str(sentID)]:
+                continue
+            sSource = cachedSents[str(sentID)]['_source']
+            if (side + '_id' in sSource
+                    and sSource[side + '_id'] >= 0
+                    and str(sSource[side + '_id']) not in cachedSents):
+                nextToRetrieve.append((sSource[side + '_id'], side))
+        toRetrieve = nextToRetrieve
+    return sentences
+
+
 def find_sent_context(curSentData, n):
     """
     Find sentences adjacent to the one described by curSentData (which
@@ -782,6 +859,17 @@ def find_sent_context(curSentData, n):
     context = {'n': n, 'languages': {lang: {} for lang in curSentData['languages']},
                'src_alignment': {}}
     adjacentIDs = {lang: {'next': -1, 'prev': -1} for lang in curSentData['languages']}
+    # Sentences further from the current one are retrieved in advance,
+    # but only if the user will be allowed to expand the context further
+    nSteps = max(settings.context_prefetch_size, 1)
+    if settings.max_context_expand >= 0:
+        nSteps = max(min(nSteps, settings.max_context_expand - curSentData['times_expanded']), 1)
+    sentIDs = []
+    for lang in curSentData['languages']:
+        for side in ['next', 'prev']:
+            if side + '_id' in curSentData['languages'][lang]:
+                sentIDs.append((curSentData['languages'][lang][side + '_id'], side))
+    contextSents = get_context_sentences(sentIDs, nSteps)
     for lang in curSentData['languages']:
         try:
             langID = settings.languages.index(lang)
@@ -790,15 +878,11 @@ def find_sent_context(curSentData, n):
             langID = settings.languages.index(rxIndexAtEnd.sub('', lang))
         for side in ['next', 'prev']:
             curCxLang = context['languages'][lang]
+            curSent = None
             if side + '_id' in curSentData['languages'][lang]:
-                curCxLang[side] = sc.get_sentence_by_id(curSentData['languages'][lang][side + '_id'])
-            if (side in curCxLang
-                    and len(curCxLang[side]) > 0
-                    and 'hits' in curCxLang[side]
-                    and 'hits' in curCxLang[side]['hits']
-                    and len(curCxLang[side]['hits']['hits']) > 0):
+                curSent = contextSents.get(str(curSentData['languages'][lang][side + '_id']))
+            if curSent is not None:
                 lastSentNum = cur_search_context().last_sent_num + 1
-                curSent = curCxLang[side]['hits']['hits'][0]
                 if '_source' in curSent and 'lang' not in curSent['_source']:
                     curCxLang[side] = ''
                     continue
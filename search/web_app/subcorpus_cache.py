@@ -0,0 +1,61 @@
+"""
+Cache for the lists of documents that constitute subcorpora.
+A subcorpus is selected by the metadata fields of the search form
+and by the documents the user has excluded manually. Finding its
+documents requires scrolling through the docs index, which is
+only done once for each subcorpus until the corpus is indexed
+again. The IDs are kept as sorted arrays of integers.
+"""
+
+import json
+import array
+import threading
+import collections
+
+
+class SubcorpusCache:
+    """
+    Finds the IDs of the documents of a subcorpus and keeps the
+    IDs for recently requested subcorpora in an LRU cache.
+    sc is a SearchClient, which tells when the corpus has been
+    indexed again. The version of the indexes is only requested from
+    Elasticsearch every few seconds (see SearchClient.indexes_version()),
+    so a cache hit usually takes no requests at all.
+    """
+
+    def __init__(self, sc, cacheSize=64):
+        self.sc = sc
+        self.cacheSize = cacheSize      # maximal number of subcorpora in the cache
+        self.cache = collections.OrderedDict()   # subcorpus query -> (version of the indexes, IDs)
+        self.lock = threading.Lock()
+
+    def doc_ids(self, htmlQuery, exclude=None):
+        """
+        Return a sorted array of the IDs of the documents specified
+        by the subcorpus selection fields in htmlQuery, except those
+        listed in exclude. Return None if there is no subcorpus
+        selection, i.e. the entire corpus is searched.
+        The returned array must not be changed, since it is cached.
+        """
+        if exclude is not None:
+            exclude = sorted(exclude)
+        subcorpusQuery = self.sc.qp.subcorpus_query(htmlQuery, sortOrder='', exclude=exclude)
+        if subcorpusQuery is None or ('query' in subcorpusQuery and subcorpusQuery['query'] == {'match_all': {}}):
+            return None
+        if self.cacheSize <= 0:
+            return array.array('I', sorted(int(doc['_id']) for doc in self.sc.get_all_docs(subcorpusQuery)))
+        # The query does not depend on anything else in htmlQuery,
+        # so it can serve as the key
+        key = json.dumps(subcorpusQuery, sort_keys=True, ensure_ascii=False)
+        version = self.sc.indexes_version()
+        with self.lock:
+            if key in self.cache and self.cache[key][0] == version:
+                self.cache.move_to_end(key)
+                return self.cache[key][1]
+        docIDs = array.array('I', sorted(int(doc['_id']) for doc in self.sc.get_all_docs(subcorpusQuery)))
+        with self.lock:
+            self.cache[key] = (version, docIDs)
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.cacheSize:
+                self.cache.popitem(last=False)
+        return docIDs
@@ -13,7 +13,7 @@ import shutil
 import uuid
 import xlsxwriter
 from werkzeug.utils import secure_filename
-from . import app, settings, sc, sentView, MAX_PAGE_SIZE
+from . import app, settings, sc, sentView, fulltextStore, MAX_PAGE_SIZE
 from .session_management import get_locale, get_session_data, change_display_options, set_session_data
 from .auxiliary_functions import jsonp, gzipped, nocache, lang_sorting_key, copy_request_args,\
     distance_constraints_too_complex, remove_sensitive_data, log_query
@@ -501,23 +501,7 @@ def send_text_html(doc_fname):
     """
     if not settings.fulltext_view_enabled:
         return ''
-    doc_fname = secure_filename(re.sub('\\.html?$', '', doc_fname))
-    if not doc_fname.endswith('.json'):
-        doc_fname += '.json'
-    try:
-        with open(os.path.join('corpus_html',
-                               settings.corpus_name,
-                               doc_fname),
-                  'r', encoding='utf-8') as fText:
-            data = json.load(fText)
-    except FileNotFoundError:
-        data = {
-            'meta': {},
-            'rows': [],
-            'page': 1
-        }
-    data['meta'] = {k: data['meta'][k]
-                    for k in data['meta'] if k in settings.viewable_meta}
+    doc_fname = secure_filename(re.sub('\\.(html?|json)$', '', doc_fname))
     page = request.args.get('page', 1)
     try:
         page = int(page) - 1
@@ -525,12 +509,22 @@ def send_text_html(doc_fname):
         page = 0
     if page < 0:
         page = 0
-    maxPage = len(data['rows']) // settings.fulltext_page_size
-    if page > maxPage:
-        page = maxPage
-    data['rows'] = data['rows'][page * settings.fulltext_page_size:
-                                (page + 1) * settings.fulltext_page_size]
-    data['page'] = page + 1
+    # Only the requested page is read from the disk
+    pageData = fulltextStore.get_page(doc_fname, page, settings.fulltext_page_size)
+    if pageData is None:
+        pageData = {
+            'meta': {},
+            'rows': [],
+            'page': 0,
+            'n_rows': 0
+        }
+    data = {
+        'meta': {k: pageData['meta'][k]
+                 for k in pageData['meta'] if k in settings.viewable_meta},
+        'rows': pageData['rows'],
+        'page': pageData['page'] + 1
+    }
+    maxPage = pageData['n_rows'] // settings.fulltext_page_size
     return render_template('fulltext.html',
                            locale=get_locale(),
                            corpus_name=settings.corpus_name,
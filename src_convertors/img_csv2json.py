@@ -167,14 +167,14 @@ class ImgCsv2JSON(Txt2JSON):
                         if textJSON['sentences'][i]['lang'] != textJSON['sentences'][i + 1]['lang']:
                             if textJSON['sentences'][i + 1]['lang'] == transLangID:
                                 textJSON['sentences'][i]['last'] = True
-                    self.write_output(re.sub('\\.(json|json\\.gz)$',
+                    self.write_output(re.sub('\\.(json|json\\.gz|jsonl|jsonl\\.gz)$',
                                              '_' + self.rxStripExt.sub('', prevImg) + '.\\1', fnameTarget), textJSON)
                 curMeta = self.get_meta(curImg)
                 textJSON = {'meta': curMeta, 'sentences': []}
                 prevImg = curImg
             textJSON['sentences'].append(s)
         if len(prevImg) > 0:
-            self.write_output(re.sub('\\.(json|json\\.gz)$',
+            self.write_output(re.sub('\\.(json|json\\.gz|jsonl|jsonl\\.gz)$',
                                      '_' + self.rxStripExt.sub('', prevImg) + '.\\1', fnameTarget), textJSON)
         return nTokens, nWords, nAnalyze
 
@@ -527,7 +527,7 @@ class Morphy_YAML2JSON(Txt2JSON):
         else:
             docGenerator = self.get_documents_parallel(fIn, curMeta)
         for textJSON in docGenerator:
-            curFnameTarget = self.rxStripExt.sub('_' + str(iDocument) + '.json', fnameTarget)
+            curFnameTarget = self.rxStripExt.sub('_' + str(iDocument) + self.output_extension(), fnameTarget)
             iDocument += 1
             if curFnameTarget == fnameSrc or curFnameTarget == fnameTarget:
                 continue
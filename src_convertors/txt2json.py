@@ -206,17 +206,39 @@ class Txt2JSON:
         else:
             self.load_meta_csv(fnameMeta)
 
+    def output_extension(self):
+        """
+        Return the extension of the output files, which depends
+        on the settings.
+        """
+        fext = '.json'
+        if 'jsonl' in self.corpusSettings and self.corpusSettings['jsonl']:
+            fext = '.jsonl'
+        if self.corpusSettings['gzip']:
+            fext += '.gz'
+        return fext
+
     def write_output(self, fnameTarget, textJSON):
         """
         Write the JSON text to fnameTarget either as plain text
         or as gzipped text, dependeing on the settings.
+        If line-delimited output is switched on, the first line
+        contains everything except the sentences (i.e. the metadata),
+        and each of the following lines contains one sentence.
         """
         if self.corpusSettings['gzip']:
             fTarget = gzip.open(fnameTarget, 'wt', encoding='utf-8')
         else:
             fTarget = open(fnameTarget, 'w', encoding='utf-8')
-        json.dump(textJSON, fp=fTarget, ensure_ascii=False,
-                  indent=self.corpusSettings['json_indent'])
+        if 'jsonl' in self.corpusSettings and self.corpusSettings['jsonl']:
+            header = {k: v for k, v in textJSON.items() if k != 'sentences'}
+            fTarget.write(json.dumps(header, ensure_ascii=False) + '\n')
+            if 'sentences' in textJSON:
+                for s in textJSON['sentences']:
+                    fTarget.write(json.dumps(s, ensure_ascii=False) + '\n')
+        else:
+            json.dump(textJSON, fp=fTarget, ensure_ascii=False,
+                      indent=self.corpusSettings['json_indent'])
         fTarget.close()
 
     def get_meta(self, fname):
@@ -306,10 +328,7 @@ class Txt2JSON:
                     os.makedirs(targetPath)
                 fnameSrc = os.path.join(path, filename)
                 fnameTarget = os.path.join(targetPath, filename)
-                fextTarget = '.json'
-                if self.corpusSettings['gzip']:
-                    fextTarget = '.json.gz'
-                fnameTarget = self.rxStripExt.sub(fextTarget, fnameTarget)
+                fnameTarget = self.rxStripExt.sub(self.output_extension(), fnameTarget)
                 self.log_message('Processing ' + fnameSrc + '...')
                 curTokens, curWords, curAnalyzed = self.convert_file(fnameSrc, fnameTarget)
                 nTokens += curTokens